@@ -0,0 +1,41 @@
+"""
+Measure the decision latency of MctsAgent playing episodes of PnpscLocalEnv, with a sample budget and with a time
+budget, and how many rollouts it simulates per decision.
+Run from the repository root with: python -m benchmarks.mcts_benchmark
+"""
+import time
+
+import numpy as np
+
+from src.pnpsc_env.agents.mcts_agent import MctsAgent
+from src.pnpsc_env.env.pnpsc_local_env import PnpscLocalEnv
+
+
+def measure(net, num_decisions, **kwargs):
+    """
+    Time the decisions of an agent over consecutive episodes
+    :param net: file name of the net
+    :param num_decisions: number of decisions
+    :param kwargs: arguments of the agent
+    :return: median and maximum milliseconds per decision and mean rollouts per decision
+    """
+    env = PnpscLocalEnv('Attacker', net, seed=0)
+    agent = MctsAgent('Attacker', seed=0, **kwargs)
+    env.reset()
+    times, samples = [], []
+    for _ in range(num_decisions):
+        start = time.perf_counter()
+        rates = agent.act(env.net)[0]
+        times.append((time.perf_counter() - start) * 1e3)
+        samples.append(agent.last_samples)
+        if env.step(rates)[2]:
+            env.reset()
+    return np.median(times), np.max(times), np.mean(samples)
+
+
+if __name__ == '__main__':
+    print('%-10s %-24s %12s %12s %12s' % ('net', 'budget', 'median ms', 'max ms', 'rollouts'))
+    for net in ['example_net', 'capec63', 'capec163']:
+        for name, kwargs in [('4096 samples', {'num_samples': 4096}),
+                             ('10 ms', {'num_samples': 10 ** 9, 'batch_size': 256, 'time_budget': 0.01})]:
+            print('%-10s %-24s %12.2f %12.2f %12.0f' % ((net, name) + measure(net + '.json', 50, **kwargs)))
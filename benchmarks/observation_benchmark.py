@@ -0,0 +1,76 @@
+"""
+Measure the time and the Python allocations of PnpscLocalEnv steps and observations.
+Allocations are counted as the growth of sys.getallocatedblocks() between consecutive profiler events, which counts
+the objects a call creates even when they are freed before it returns.
+Run from the repository root with: python -m benchmarks.observation_benchmark
+"""
+import sys
+import time
+
+import numpy as np
+
+from src.pnpsc_env.agents.capec63_agent import Capec63Agent
+from src.pnpsc_env.env.pnpsc_local_env import PnpscLocalEnv
+
+
+def count_allocations(f, *args):
+    """
+    Count the memory blocks allocated by a call
+    :param f: function to call
+    :param args: arguments of the call
+    :return: number of blocks allocated
+    """
+    total = 0
+    last = sys.getallocatedblocks()
+
+    def profile(frame, event, arg):
+        nonlocal total, last
+        total += max(0, sys.getallocatedblocks() - last)
+        last = sys.getallocatedblocks()
+
+    sys.setprofile(profile)
+    f(*args)
+    sys.setprofile(None)
+    return total
+
+
+def measure(env, f, num_steps):
+    """
+    Time a function of the environment and count its allocations, resetting the environment when it is done
+    :param env: environment
+    :param f: function returning the usual (observation, reward, done, info) tuple
+    :param num_steps: number of calls
+    :return: microseconds and allocated blocks per call
+    """
+    np.random.seed(0)
+    env.reset()
+    start = time.perf_counter()
+    for _ in range(num_steps):
+        if f()[2]:
+            env.reset()
+    elapsed = (time.perf_counter() - start) / num_steps * 1e6
+
+    np.random.seed(0)
+    env.reset()
+    blocks = []
+    for _ in range(1_000):
+        result = []
+        blocks.append(count_allocations(lambda: result.append(f())))
+        if result[0][2]:
+            env.reset()
+    return elapsed, np.mean(blocks)
+
+
+if __name__ == '__main__':
+    print('profiler overhead of an empty call: %.1f blocks' % np.mean([count_allocations(lambda: ())
+                                                                      for _ in range(1_000)]))
+    print('%-22s %22s %22s' % ('env', 'get_observation', 'step'))
+    for net, opponent in [('example_net', None), ('capec63', None), ('capec63', 'Defender'), ('capec163', None)]:
+        env = PnpscLocalEnv('Attacker', net + '.json')
+        if opponent is not None:
+            env.add_other_player(Capec63Agent(opponent))
+        rates = list(env.get_controlled_rates().values())
+        obs = measure(env, lambda: env.get_observation(env.player_name), 20_000)
+        step = measure(env, lambda: env.step(rates), 20_000)
+        name = net + (' + ' + opponent if opponent is not None else '')
+        print('%-22s %8.2f us %6.1f blocks %8.2f us %6.1f blocks' % ((name,) + obs + step))
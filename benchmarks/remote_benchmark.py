@@ -0,0 +1,63 @@
+"""
+Measure the environment steps per second of the remote path against the local simulator server, with and without
+added latency: the blocking PnpscRemoteEnv, and PnpscAsyncVecEnv keeping several sessions in flight.
+The server runs in a thread of this process, so without latency the numbers include the server's own time.
+Run from the repository root with: python -m benchmarks.remote_benchmark
+"""
+import time
+
+import numpy as np
+
+from src.pnpsc_env.env.pnpsc_async_vec_env import PnpscAsyncVecEnv
+from src.pnpsc_env.env.pnpsc_local_env import PnpscLocalEnv
+from src.pnpsc_env.env.pnpsc_remote_env import PnpscRemoteEnv
+from src.pnpsc_env.simulator.simulator_server import SimulatorServer
+
+
+def measure_env(env, num_steps):
+    """
+    Step a single environment, resetting it when it is done
+    :param env: environment
+    :param num_steps: number of steps
+    :return: steps per second
+    """
+    action = list(env.get_controlled_rates().values())
+    env.reset()
+    start = time.perf_counter()
+    for _ in range(num_steps):
+        if env.step(action)[2]:
+            env.reset()
+    return num_steps / (time.perf_counter() - start)
+
+
+def measure_vec_env(env, num_steps):
+    """
+    Step a vectorized environment, finished environments reset themselves
+    :param env: vectorized environment
+    :param num_steps: number of steps of each environment
+    :return: environment steps per second
+    """
+    actions = np.full((env.num_envs,) + env.action_space.shape, 10.0)
+    env.reset()
+    start = time.perf_counter()
+    for _ in range(num_steps):
+        env.step(actions)
+    return num_steps * env.num_envs / (time.perf_counter() - start)
+
+
+if __name__ == '__main__':
+    net = 'capec63.json'
+    print('local env %36.0f steps/s' % measure_env(PnpscLocalEnv('Attacker', net), 2_000))
+    for latency in [0, 0.005]:
+        server = SimulatorServer(('127.0.0.1', 0), latency=latency)
+        server.start()
+        env = PnpscRemoteEnv('Attacker', net, sim_url=server.url)
+        print('latency %4.1f ms remote env %20.0f steps/s' % (latency * 1e3, measure_env(env, 200)))
+        env.close()
+        for num_envs in [1, 8, 32]:
+            env = PnpscAsyncVecEnv('Attacker', net, num_envs=num_envs, sim_url=server.url)
+            print('latency %4.1f ms async vec env %3d envs %8.0f steps/s' % (latency * 1e3, num_envs,
+                                                                              measure_vec_env(env, 50)))
+            env.close()
+        server.shutdown()
+        server.server_close()
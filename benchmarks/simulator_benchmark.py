@@ -0,0 +1,42 @@
+"""
+Compare the step time of the simulator schedulers on the shipped nets and on large synthetic nets.
+Run from the repository root with: python -m benchmarks.simulator_benchmark
+"""
+import time
+
+import numpy as np
+
+from benchmarks.synthetic_net import compose_net, load_net
+from src.pnpsc_env.env.pnpsc_net import PnpscNet
+from src.pnpsc_env.simulator.simulator import Simulator, SCHEDULERS
+
+
+def time_steps(json, scheduler, num_steps):
+    """
+    Step a simulator, resetting at the end of each episode
+    :param json: PNPSC net definition in json format
+    :param scheduler: simulator scheduling mode
+    :param num_steps: number of steps to time
+    :return: mean time per step in microseconds
+    """
+    net = PnpscNet(json)
+    s = Simulator(net, scheduler=scheduler)
+    np.random.seed(0)
+    start = time.perf_counter()
+    for i in range(num_steps):
+        s.step()
+        if net.done:
+            s.reset()
+    return (time.perf_counter() - start) / num_steps * 1e6
+
+
+if __name__ == '__main__':
+    nets = {n: load_net(n + '.json') for n in ['example_net', 'capec63', 'capec66', 'capec163']}
+    for copies in [10, 50, 200]:
+        nets['capec63 x' + str(copies)] = compose_net(nets['capec63'], copies)
+
+    print('%-16s %8s %8s' % ('net', 'places', 'trans') + ''.join(' %14s' % s for s in SCHEDULERS))
+    for name, json in nets.items():
+        times = [time_steps(json, s, 5_000) for s in SCHEDULERS]
+        print('%-16s %8d %8d' % (name, len(json['places']), len(json['transitions'])) +
+              ''.join(' %11.1f us' % t for t in times))
@@ -0,0 +1,47 @@
+import copy
+import json
+import os
+
+
+def load_net(net_path):
+    """
+    Load a PNPSC net definition from the nets directory
+    :param net_path: path to the PNPSC net definition relative to the nets directory
+    :return: the PNPSC net in json format
+    """
+    with open(os.path.join(os.path.dirname(__file__), '..', 'nets', net_path)) as f:
+        return json.load(f)
+
+
+def _rename(names, suffix):
+    return ','.join(n + suffix if n != '' else '' for n in names.split(','))
+
+
+def compose_net(json, copies):
+    """
+    Build a large synthetic net from independent copies of a PNPSC net definition. Place and transition names of
+    copy c are suffixed with _c and only the goals of the first copy are kept, so an episode ends when the first
+    copy reaches a goal while every other copy keeps adding enabled transitions to the net.
+    :param json: PNPSC net definition in json format
+    :param copies: number of copies
+    :return: the composed PNPSC net in json format
+    """
+    places, transitions = [], []
+    for c in range(copies):
+        suffix = '_' + str(c)
+        for p in json['places']:
+            p = copy.deepcopy(p)
+            p['name'] += suffix
+            if c > 0 and 'goal' in p:
+                del p['goal']
+            places.append(p)
+        for t in json['transitions']:
+            t = copy.deepcopy(t)
+            t['name'] += suffix
+            t['input'] = _rename(t['input'], suffix)
+            t['output'] = _rename(t['output'], suffix)
+            t['inhibitor'] = _rename(t['inhibitor'], suffix)
+            t['control_rate'] = ','.join(_rename(cr.split('=')[0], suffix) + '=' + cr.split('=')[1]
+                                         for cr in t['control_rate'].split(',') if cr != '')
+            transitions.append(t)
+    return {'places': places, 'transitions': transitions, 'players': copy.deepcopy(json['players'])}
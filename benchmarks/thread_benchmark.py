@@ -0,0 +1,41 @@
+"""
+Measure how the batched baseline of PnpscVecEnv scales with the number of threads.
+Run from the repository root with: python -m benchmarks.thread_benchmark [max_threads] [num_envs]
+"""
+import os
+import sys
+import time
+
+import numpy as np
+
+from src.pnpsc_env.env.pnpsc_vec_env import PnpscVecEnv
+
+
+def time_baseline(net_path, num_threads, num_envs, repeats=3):
+    """
+    Time the run to completion from the initial marking
+    :param net_path: PNPSC net definition, relative to the nets directory
+    :param num_threads: number of threads
+    :param num_envs: number of executions in the batch
+    :param repeats: the best of this many runs is reported
+    :return: seconds per baseline
+    """
+    env = PnpscVecEnv('Attacker', net_path, num_envs=num_envs, num_threads=num_threads)
+    np.random.seed(0)
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        env._run_batch_until_complete(tuple(env.places), tuple(env.rates))
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+if __name__ == '__main__':
+    max_threads = int(sys.argv[1]) if len(sys.argv) > 1 else os.cpu_count()
+    num_envs = int(sys.argv[2]) if len(sys.argv) > 2 else 100_000
+    threads = sorted({1, max_threads} | {2 ** i for i in range(max_threads.bit_length()) if 2 ** i <= max_threads})
+
+    print('%-10s' % 'net' + ''.join(' %16s' % ('%d threads' % t) for t in threads))
+    for net in ['capec63', 'capec66', 'capec163']:
+        times = [time_baseline(net + '.json', t, num_envs) for t in threads]
+        print('%-10s' % net + ''.join(' %7.2fs %6.2fx' % (t, times[0] / t) for t in times))
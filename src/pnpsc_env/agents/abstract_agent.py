@@ -2,16 +2,20 @@ from abc import ABC, abstractmethod
 
 import numpy as np
 
+from ..simulator.rng import make_rng
+
 
 class AbstractAgent(ABC):
     """
     An agent that simulates a player for a PNPSC net.
     """
-    def __init__(self, player_name):
+    def __init__(self, player_name, seed=None):
         """
         :param player_name: Name of the player, must match a player listed in the net definition
+        :param seed: seed or Generator of stochastic actions, None draws from the global np.random state
         """
         self.player_name = player_name
+        self.rng = make_rng(seed)
 
     def act(self, net, output_strategy=False):
         """
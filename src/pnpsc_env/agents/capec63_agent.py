@@ -8,12 +8,13 @@ class Capec63Agent(AbstractAgent):
     A reimplementation of the optimal strategy for CAPEC-63 from [Bland, 2020]. This agent is
     only assumed to work for the exact CAPEC-63 net structure and rates found in the cited paper.
     """
-    def __init__(self, player_name, eps=0.0):
+    def __init__(self, player_name, eps=0.0, seed=None):
         """
         :param player_name: Name of the player, must match a player listed in the net definition
         :param eps: optional probability to choose a random action instead of the optimal one
+        :param seed: seed or Generator of the random actions, None draws from the global np.random state
         """
-        super().__init__(player_name)
+        super().__init__(player_name, seed)
         self.eps = eps
 
     def _act(self, net, print_strategy=False):
@@ -27,10 +28,10 @@ class Capec63Agent(AbstractAgent):
         rates = net.get_controlled_rates(self.player_name)
 
         # select a random update with probability eps
-        if np.random.sample() < self.eps:
-            i = np.random.choice(len(rates))
+        if self.rng.random() < self.eps:
+            i = self.rng.choice(len(rates))
             rates = list(rates.values())
-            rates[i] = np.random.choice([0, 10])
+            rates[i] = self.rng.choice([0, 10])
             return rates
 
         if self.player_name == 'Attacker':
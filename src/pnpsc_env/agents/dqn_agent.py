@@ -2,6 +2,7 @@ import numpy as np
 from stable_baselines3.dqn import DQN
 
 from .abstract_agent import AbstractAgent
+from ..env.pnpsc_lockstep_vec_env import PnpscLockstepVecEnv
 from ..env.wrappers.discrete_pnpsc_wrapper import DiscretePnpscWrapper
 
 
@@ -20,7 +21,8 @@ class DqnAgent(AbstractAgent):
     """
     def __init__(self, env, f=replace_rate, options=(0, 10), max_actions=1, model_kwargs=None):
         """
-        :param env: learning environment
+        :param env: learning environment, or a PnpscLockstepVecEnv created with options whose action table is used in
+            place of f, options and max_actions
         :param eval_env: optional evaluation environment
         :param f: update function for rates
         :param options: update options for f
@@ -28,7 +30,12 @@ class DqnAgent(AbstractAgent):
         :param model_kwargs: deviations from model default hyperparameters
         """
         super().__init__(env.player_name)
-        self.env = DiscretePnpscWrapper(env, f, options, max_actions)
+        if isinstance(env, PnpscLockstepVecEnv):
+            assert env.options is not None, 'the vectorized environment must be created with discrete options'
+            self.env = env
+            max_actions = env.max_actions
+        else:
+            self.env = DiscretePnpscWrapper(env, f, options, max_actions)
         self.policy_type = "MlpPolicy"
         self.max_actions = max_actions
 
@@ -0,0 +1,163 @@
+import math
+import time
+
+import numpy as np
+
+from .abstract_agent import AbstractAgent
+from ..env.baseline_cache import BaselineCache
+from ..simulator.batch_kernel import make_batch_kernel
+from ..simulator.simulator import GOAL_REWARD
+
+
+class MctsAgent(AbstractAgent):
+    """
+    Planning agent that searches the single rate updates of the DiscretePnpscWrapper action table with batched Monte
+    Carlo rollouts from the current marking.
+    Each candidate is valued by its update cost and the mean reward of running the net to completion with the updated
+    rates, the same estimate PnpscVecEnv uses as a baseline. The rollouts of all candidates are stepped together with
+    the batch kernel, and the budget is spent by sequential halving: every round simulates a batch split evenly over
+    the candidates still in the race, then drops the worse half.
+    The estimates are pooled in a BaselineCache keyed by marking and rates, so later decisions that reach the same
+    marking, or candidates that lead to the same rates, reuse the earlier rollouts.
+    """
+    def __init__(self, player_name, f=None, options=(0, 10), num_samples=4096, batch_size=1024, time_budget=None,
+                 max_samples=None, max_steps=1000, cache_size=4096, backend='auto', seed=None):
+        """
+        :param player_name: Name of the player, must match a player listed in the net definition
+        :param f: update function for rates, f(rate, option), defaults to replacing the rate with the option
+        :param options: update options for f
+        :param num_samples: most rollouts simulated for one decision
+        :param batch_size: rollouts simulated together in each round of the search
+        :param time_budget: stop starting new rounds after this many seconds, None only limits the samples
+        :param max_samples: candidates whose pooled estimate has this many samples are not simulated again, None
+            keeps refining them
+        :param max_steps: transitions fired in a rollout before it is stopped without reaching a goal
+        :param cache_size: number of marking and rates estimates kept between decisions
+        :param backend: backend of the batch kernel, 'dense', 'sparse' or 'auto'
+        :param seed: seed or Generator of the rollouts, None draws from the global np.random state
+        """
+        super().__init__(player_name, seed)
+        assert batch_size > 0, 'batch_size must be positive'
+        self.f = f if f is not None else lambda x, o: o
+        self.options = options
+        self.num_samples = num_samples
+        self.batch_size = batch_size
+        self.time_budget = time_budget
+        self.max_samples = max_samples
+        self.max_steps = max_steps
+        self.backend = backend
+        self.cache = BaselineCache(cache_size)
+        # rollouts simulated by the last decision
+        self.last_samples = 0
+
+        self.compiled = None
+        self.kernel = None
+
+    def _compile(self, net):
+        """
+        Build the kernel and the index arrays for the net, once for each compiled net
+        :param net: the current pnpsc net object
+        """
+        self.compiled = net.compiled
+        self.kernel = make_batch_kernel(self.compiled, self.backend)
+        index = self.compiled.place_index
+        self.goal_places = np.array([index[p] for p in net.get_goal_places(self.player_name)], dtype=np.intp)
+        self.end_places = np.array([index[p] for p in net.get_end_places(self.player_name)], dtype=np.intp)
+        self.controlled = self.compiled.controlled_index[self.player_name]
+
+    def _candidates(self, rates):
+        """
+        Rates after each action of the action table, actions that lead to the same rates are merged
+        :param rates: current rates of all transitions
+        :return: matrix of candidate rates, one row per distinct candidate, the current rates first
+        """
+        candidates = [rates]
+        for t in self.controlled:
+            for o in self.options:
+                candidate = rates.copy()
+                candidate[t] = self.f(candidate[t], o)
+                candidates.append(candidate)
+        _, first = np.unique(np.array(candidates), axis=0, return_index=True)
+        return np.array(candidates)[np.sort(first)]
+
+    def _rollout(self, places, rates):
+        """
+        Run a batch of executions to completion with fixed rates
+        :param places: marking matrix, one row per execution, updated in place
+        :param rates: rates matrix, one row per execution
+        :return: reward of each execution
+        """
+        rewards = np.zeros(len(places))
+        rows = np.arange(len(places))
+        for _ in range(self.max_steps):
+            j, _, running = self.kernel.race(places, rates, self.rng)
+            self.kernel.fire(places, j, running[:, np.newaxis])
+
+            done = ~running
+            if len(self.goal_places) > 0:
+                # the reward of PnpscEnv, for each marked goal place
+                goals = np.count_nonzero(places[:, self.goal_places] > 0, axis=1) * running
+                rewards[rows] += GOAL_REWARD * goals
+                done |= goals > 0
+            if len(self.end_places) > 0:
+                done |= np.any(places[:, self.end_places] > 0, axis=1)
+
+            # drop the finished executions from the batch
+            if np.any(done):
+                running = ~done
+                places, rates, rows = places[running], rates[running], rows[running]
+                if len(rows) == 0:
+                    break
+        return rewards
+
+    def _act(self, net, print_strategy=False):
+        """
+        Search the rate updates for the given state of the net
+        :param net: the current pnpsc net object
+        :param print_strategy: toggle to output the strategy of the player
+        :return: The desired rates for the player controlled transitions
+        """
+        if net.compiled is not self.compiled:
+            self._compile(net)
+        marking = net.place_values.copy()
+        current = net.rate_values.copy()
+        candidates = self._candidates(current)
+        costs = np.sum(np.abs(candidates - current), axis=1) / 10
+        keys = [self.cache.key(marking, c) for c in candidates]
+        # pooled estimates of this decision, seeded from the cache, which may evict them while the search runs
+        means, counts = np.zeros(len(candidates)), np.zeros(len(candidates))
+        for i, key in enumerate(keys):
+            entry = self.cache.get(key)
+            if entry is not None:
+                means[i], counts[i] = entry
+
+        deadline = None if self.time_budget is None else time.perf_counter() + self.time_budget
+        active = np.arange(len(candidates))
+        samples = 0
+        while samples < self.num_samples and (deadline is None or time.perf_counter() < deadline):
+            if self.max_samples is not None:
+                active = active[counts[active] < self.max_samples]
+                if len(active) == 0:
+                    break
+            per = max(1, min(self.batch_size, self.num_samples - samples) // len(active))
+            rewards = self._rollout(np.repeat(marking[np.newaxis], per * len(active), axis=0),
+                                    np.repeat(candidates[active], per, axis=0))
+            samples += per * len(active)
+            for i, mean in zip(active, rewards.reshape(len(active), per).mean(axis=1)):
+                # exact estimates are kept as they are
+                if not np.isinf(counts[i]):
+                    means[i] = (means[i] * counts[i] + mean * per) / (counts[i] + per)
+                    counts[i] += per
+                    self.cache.put(keys[i], means[i], counts[i])
+
+            if len(active) == 1:
+                break
+            # sequential halving, keep the better half of the candidates
+            values = means[active] - costs[active]
+            active = active[np.argsort(-values, kind='stable')[:math.ceil(len(active) / 2)]]
+        self.last_samples = samples
+
+        # pick the best candidate with an estimate, candidates never simulated are skipped
+        values = np.where(counts > 0, means - costs, -np.inf)
+        best = candidates[int(np.argmax(values))] if np.any(np.isfinite(values)) else current
+        return best[self.controlled].tolist()
@@ -1,5 +1,3 @@
-import numpy as np
-
 from .abstract_agent import AbstractAgent
 
 
@@ -7,12 +5,13 @@ class RandomAgent(AbstractAgent):
     """
     A PNPSC player agent that updates a single random rate each step to a random value between 0 and 10
     """
-    def __init__(self, player_name, eps=1.0):
+    def __init__(self, player_name, eps=1.0, seed=None):
         """
         :param player_name: Name of the player, must match a player listed in the net definition
         :param eps: optional probability to choose a random action (otherwise no action)
+        :param seed: seed or Generator of the random actions, None draws from the global np.random state
         """
-        super().__init__(player_name)
+        super().__init__(player_name, seed)
         self.eps = eps
 
     def _act(self, net, print_strategy=False):
@@ -23,7 +22,7 @@ class RandomAgent(AbstractAgent):
         :return: The desired rates for the player controlled transitions
         """
         rates = list(net.get_controlled_rates(self.player_name).values())
-        if np.random.sample() < self.eps:
-            i = np.random.choice(len(rates))
-            rates[i] = np.random.choice(10)
+        if self.rng.random() < self.eps:
+            i = self.rng.choice(len(rates))
+            rates[i] = self.rng.choice(10)
         return rates
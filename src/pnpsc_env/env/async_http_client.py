@@ -0,0 +1,233 @@
+import asyncio
+import json
+import select
+from urllib.parse import urlsplit
+
+# Statuses whose responses have no body
+NO_BODY_STATUSES = (204, 304)
+
+
+class HttpConnectError(ConnectionError):
+    """
+    Opening a connection to the server failed or timed out, the request was not sent
+    """
+    pass
+
+
+class HttpResponse():
+    """
+    Status and body of a response, with the parts of the requests.Response interface the remote environments use
+    """
+    def __init__(self, status_code, headers, content):
+        """
+        :param status_code: HTTP status
+        :param headers: dictionary of the headers, with lower case names
+        :param content: body of the response
+        """
+        self.status_code = status_code
+        self.headers = headers
+        self.content = content
+
+    @property
+    def text(self):
+        return self.content.decode('utf-8', errors='replace')
+
+    def json(self):
+        """
+        Parse the body as json
+        :return: the parsed body
+        """
+        return json.loads(self.content)
+
+
+class AsyncHttpClient():
+    """
+    Minimal HTTP/1.1 client on asyncio streams for the json requests of the remote simulator.
+    Connections are kept alive and pooled per host, and at most max_connections requests are in flight at once, so
+    many coroutines can share one client without opening a connection per request. Only plain http is supported.
+    The pool belongs to the event loop the client is used on, using it on another loop drops the idle connections.
+    """
+    def __init__(self, max_connections=64, headers=None):
+        """
+        :param max_connections: most requests in flight at once, each on its own connection
+        :param headers: headers sent with every request
+        """
+        assert max_connections > 0, 'max_connections must be positive'
+        self.max_connections = max_connections
+        self.headers = {'Accept': 'application/json'}
+        self.headers.update(headers if headers is not None else {})
+        self._loop = None
+        self._slots = None
+        # idle connections of each (host, port)
+        self._idle = {}
+        # private loop of run()
+        self._runner = None
+
+    def _bind(self):
+        """
+        Attach the pool to the running event loop
+        """
+        loop = asyncio.get_running_loop()
+        if loop is not self._loop:
+            self._close_idle()
+            self._loop = loop
+            self._slots = asyncio.Semaphore(self.max_connections)
+
+    def _close_idle(self):
+        """
+        Close the idle connections
+        """
+        if self._loop is not None and not self._loop.is_closed():
+            for connections in self._idle.values():
+                for reader, writer in connections:
+                    writer.close()
+        self._idle = {}
+
+    async def _connect(self, host, port, timeout):
+        """
+        Take an idle connection to a server or open a new one
+        :param host: host name
+        :param port: port
+        :param timeout: seconds to wait for a new connection
+        :return: reader and writer of the connection
+        """
+        idle = self._idle.get((host, port))
+        while idle:
+            reader, writer = idle.pop()
+            if not writer.is_closing() and not reader.at_eof() and not _dropped(writer):
+                return reader, writer
+            writer.close()
+        try:
+            return await asyncio.wait_for(asyncio.open_connection(host, port), timeout)
+        except (OSError, asyncio.TimeoutError) as e:
+            raise HttpConnectError('could not connect to ' + host + ':' + str(port) + ': ' + repr(e)) from e
+
+    async def _read_response(self, reader):
+        """
+        Read a response from a connection
+        :param reader: stream of the connection
+        :return: the response and whether the connection can be reused
+        """
+        line = await reader.readline()
+        if not line:
+            # the server closed the connection, usually an idle connection timing out on the server
+            raise ConnectionResetError('connection closed by the server')
+        version, status = line.decode('latin-1').split(' ', 2)[:2]
+        status = int(status)
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+        keep_alive = version == 'HTTP/1.1' and headers.get('connection', '').lower() != 'close'
+        if status in NO_BODY_STATUSES or status < 200:
+            content = b''
+        elif headers.get('transfer-encoding', '').lower() == 'chunked':
+            chunks = []
+            while True:
+                size = int((await reader.readline()).split(b';')[0], 16)
+                if size == 0:
+                    # skip the trailers
+                    while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                        pass
+                    break
+                chunks.append(await reader.readexactly(size))
+                await reader.readexactly(2)
+            content = b''.join(chunks)
+        elif 'content-length' in headers:
+            content = await reader.readexactly(int(headers['content-length']))
+        else:
+            # the body ends with the connection
+            content = await reader.read()
+            keep_alive = False
+        return HttpResponse(status, headers, content), keep_alive
+
+    async def request(self, method, url, json=None, headers=None, timeout=None):
+        """
+        Send a request and read the response
+        :param method: HTTP method
+        :param url: http URL
+        :param json: json body of the request
+        :param headers: headers of this request, added to the headers of the client
+        :param timeout: seconds to wait for the server, a single value or a (connect, read) tuple, None waits forever
+        :return: the response
+        """
+        parts = urlsplit(url)
+        assert parts.scheme == 'http', 'only http URLs are supported'
+        host, port = parts.hostname, parts.port or 80
+        path = (parts.path or '/') + ('?' + parts.query if parts.query else '')
+        connect_timeout, read_timeout = timeout if isinstance(timeout, tuple) else (timeout, timeout)
+
+        # the json argument shadows the module
+        body = b'' if json is None else _dumps(json)
+        lines = [method + ' ' + path + ' HTTP/1.1', 'Host: ' + parts.netloc, 'Content-Length: ' + str(len(body))]
+        if json is not None:
+            lines.append('Content-Type: application/json')
+        for name, value in dict(self.headers, **(headers if headers is not None else {})).items():
+            lines.append(name + ': ' + str(value))
+        message = ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1') + body
+
+        self._bind()
+        async with self._slots:
+            reader, writer = await self._connect(host, port, connect_timeout)
+            try:
+                writer.write(message)
+                res, keep_alive = await asyncio.wait_for(self._read_response(reader), read_timeout)
+            except asyncio.IncompleteReadError as e:
+                writer.close()
+                raise ConnectionResetError('connection closed by the server during the response') from e
+            except BaseException:
+                writer.close()
+                raise
+            if keep_alive:
+                self._idle.setdefault((host, port), []).append((reader, writer))
+            else:
+                writer.close()
+        return res
+
+    def run(self, coroutine):
+        """
+        Run a coroutine to completion on the private event loop of the client, for callers outside an event loop
+        :param coroutine: coroutine using the client
+        :return: the result of the coroutine
+        """
+        if self._runner is None or self._runner.is_closed():
+            self._runner = asyncio.new_event_loop()
+        return self._runner.run_until_complete(coroutine)
+
+    def close(self):
+        """
+        Close the idle connections and the private event loop
+        """
+        self._close_idle()
+        if self._runner is not None and not self._runner.is_closed():
+            self._runner.close()
+
+
+def _dropped(writer):
+    """
+    Check if the server closed an idle connection. The private loop of run() does not run between requests, so the
+    reader has not seen the end of the stream yet. An idle connection is readable only once the server closed it,
+    the check is made before the request is written since a closed connection after it is ambiguous.
+    :param writer: writer of the connection
+    :return: True if the connection cannot be reused
+    """
+    sock = writer.get_extra_info('socket')
+    if sock is None:
+        return False
+    try:
+        return bool(select.select([sock], [], [], 0)[0])
+    except (OSError, ValueError):
+        return True
+
+
+def _dumps(data):
+    """
+    Encode a json body
+    :param data: json data
+    :return: utf-8 bytes
+    """
+    return json.dumps(data).encode('utf-8')
@@ -0,0 +1,98 @@
+from collections import OrderedDict
+
+import numpy as np
+
+
+class BaselineCache():
+    """
+    Least recently used cache of run to completion baselines keyed by marking and rates.
+    Each entry holds the mean reward and the number of samples it was estimated from, so further estimates for the
+    same key can be pooled into it. Exact baselines are stored with an infinite number of samples.
+    """
+    def __init__(self, max_size=1024, rate_decimals=None):
+        """
+        :param max_size: maximum number of entries, the least recently used entry is evicted when full
+        :param rate_decimals: round rates to this many decimals in the keys so nearly equal rates share an entry,
+            None uses the exact rates
+        """
+        assert max_size > 0, 'max_size must be positive'
+        self.max_size = max_size
+        self.rate_decimals = rate_decimals
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def key(self, places, rates):
+        """
+        Build the cache key for a marking and rates
+        :param places: marking
+        :param rates: rates
+        :return: hashable key
+        """
+        rates = np.asarray(rates, dtype=float)
+        if self.rate_decimals is not None:
+            # adding 0 turns -0.0 into 0.0 so both round to the same key
+            rates = np.round(rates, self.rate_decimals) + 0
+        return tuple(np.asarray(places).tolist()), tuple(rates.tolist())
+
+    def get(self, key):
+        """
+        Look up an entry and mark it as most recently used
+        :param key: cache key
+        :return: (mean, samples) or None if the key is not cached
+        """
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return entry
+
+    def put(self, key, mean, samples):
+        """
+        Store an estimate, replacing any existing entry
+        :param key: cache key
+        :param mean: mean reward
+        :param samples: number of samples in the estimate
+        """
+        self.entries[key] = (mean, samples)
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def pool(self, key, mean, samples):
+        """
+        Combine an estimate with the cached estimate as a sample weighted mean
+        :param key: cache key
+        :param mean: mean reward of the new samples
+        :param samples: number of new samples
+        :return: the pooled mean
+        """
+        entry = self.entries.get(key)
+        if entry is not None and np.isinf(entry[1]):
+            return entry[0]
+        if entry is not None:
+            total = entry[1] + samples
+            mean = (entry[0] * entry[1] + mean * samples) / total
+            samples = total
+        self.put(key, mean, samples)
+        return mean
+
+    def clear(self):
+        """
+        Remove all entries, the counters are kept
+        """
+        self.entries.clear()
+
+    def stats(self):
+        """
+        Cache counters
+        :return: dictionary of hits, misses, evictions and current size
+        """
+        return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions, 'size': len(self.entries)}
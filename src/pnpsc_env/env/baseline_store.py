@@ -0,0 +1,117 @@
+import hashlib
+import json
+import sqlite3
+import threading
+
+import numpy as np
+
+
+def net_hash(net_json):
+    """
+    Content hash of a PNPSC net definition, independent of key order and formatting
+    :param net_json: PNPSC net definition in json format
+    :return: hex digest
+    """
+    return hashlib.sha256(json.dumps(net_json, sort_keys=True, separators=(',', ':')).encode()).hexdigest()
+
+
+def merge_moments(a, b):
+    """
+    Combine the sample count, mean and sum of squared deviations of two sets of samples
+    :param a: (samples, mean, m2) of the first set
+    :param b: (samples, mean, m2) of the second set
+    :return: (samples, mean, m2) of the union
+    """
+    na, mean_a, m2_a = a
+    nb, mean_b, m2_b = b
+    n = na + nb
+    if n == 0:
+        return 0, 0.0, 0.0
+    delta = mean_b - mean_a
+    return n, mean_a + delta * nb / n, m2_a + m2_b + delta * delta * na * nb / n
+
+
+class BaselineStore():
+    """
+    On disk store of Monte Carlo baselines in SQLite, shared by processes and runs that simulate the same net.
+    Entries are keyed by a content hash of the net definition, the marking, the rates and the opponent strategy, and
+    hold the sample count, mean and sum of squared deviations so new samples can be pooled into them.
+    """
+    def __init__(self, path, net_json, timeout=30, rate_decimals=None):
+        """
+        :param path: path of the SQLite database, created if it does not exist
+        :param net_json: PNPSC net definition in json format
+        :param timeout: seconds to wait for another writer to release the database
+        :param rate_decimals: round rates to this many decimals in the keys as BaselineCache does, so nearly equal
+            rates and float32 rates share an entry, None uses the exact rates
+        """
+        self.path = path
+        self.net = net_hash(net_json)
+        self.rate_decimals = rate_decimals
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, timeout=timeout, isolation_level=None, check_same_thread=False)
+        # write ahead logging lets readers continue while another process writes
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('CREATE TABLE IF NOT EXISTS baselines (net TEXT, marking TEXT, rates TEXT, strategy TEXT, '
+                         'samples INTEGER, mean REAL, m2 REAL, PRIMARY KEY (net, marking, rates, strategy))')
+
+    def _key(self, places, rates, strategy):
+        rates = np.array(list(rates), dtype=np.float64)
+        if self.rate_decimals is not None:
+            # adding 0 turns -0.0 into 0.0 so both round to the same key
+            rates = np.round(rates, self.rate_decimals) + 0
+        return json.dumps([int(p) for p in places]), json.dumps(rates.tolist()), \
+            json.dumps(strategy if strategy is not None else {}, sort_keys=True)
+
+    def get(self, places, rates, strategy=None):
+        """
+        Look up the stored estimate for a marking
+        :param places: marking in place name order
+        :param rates: rates in transition name order
+        :param strategy: json serialisable description of the opponent strategy
+        :return: (samples, mean, variance) or None if nothing is stored
+        """
+        with self._lock:
+            row = self._db.execute('SELECT samples, mean, m2 FROM baselines WHERE net=? AND marking=? AND rates=? '
+                                   'AND strategy=?', (self.net,) + self._key(places, rates, strategy)).fetchone()
+        if row is None:
+            return None
+        samples, mean, m2 = row
+        return samples, mean, m2 / (samples - 1) if samples > 1 else 0.0
+
+    def add(self, places, rates, strategy, samples, mean, m2):
+        """
+        Pool new samples into the stored estimate
+        :param places: marking in place name order
+        :param rates: rates in transition name order
+        :param strategy: json serialisable description of the opponent strategy
+        :param samples: number of new samples
+        :param mean: mean of the new samples
+        :param m2: sum of squared deviations of the new samples from their mean
+        :return: (samples, mean, variance) of the pooled estimate
+        """
+        key = (self.net,) + self._key(places, rates, strategy)
+        with self._lock:
+            # take the write lock before reading so concurrent writers cannot lose each other's samples
+            self._db.execute('BEGIN IMMEDIATE')
+            try:
+                row = self._db.execute('SELECT samples, mean, m2 FROM baselines WHERE net=? AND marking=? AND '
+                                       'rates=? AND strategy=?', key).fetchone()
+                n, mean, m2 = merge_moments(row if row is not None else (0, 0.0, 0.0), (samples, mean, m2))
+                self._db.execute('INSERT OR REPLACE INTO baselines VALUES (?, ?, ?, ?, ?, ?, ?)',
+                                 key + (n, mean, m2))
+                self._db.execute('COMMIT')
+            except BaseException:
+                self._db.execute('ROLLBACK')
+                raise
+        return n, mean, m2 / (n - 1) if n > 1 else 0.0
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute('SELECT COUNT(*) FROM baselines WHERE net=?', (self.net,)).fetchone()[0]
+
+    def close(self):
+        """
+        Close the database connection
+        """
+        self._db.close()
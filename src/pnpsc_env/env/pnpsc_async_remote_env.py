@@ -0,0 +1,184 @@
+import asyncio
+import time
+import uuid
+
+import numpy as np
+
+from .async_http_client import AsyncHttpClient, HttpConnectError
+from .pnpsc_env import _StepInfo
+from .pnpsc_remote_env import PnpscRemoteEnv, RemoteSimulatorError, SIM_URL
+
+
+class PnpscAsyncRemoteEnv(PnpscRemoteEnv):
+    """
+    Remote environment whose requests are coroutines, so many environments can wait on the simulator at once.
+    async_reset and async_step follow reset and step, and the blocking methods run them on the private event loop of
+    the client. The requests go through an AsyncHttpClient that can be shared by many environments, and each
+    environment drives its own simulator session, named by a random session id unless one is given. close() deletes
+    the sessions with a random id from the server.
+    The retries, errors and latency counters are those of PnpscRemoteEnv.
+    """
+
+    def __init__(self, player_name, net_path, sim_url=SIM_URL, max_tokens=16, max_rate=10, timeout=(3.05, 30),
+                 max_retries=3, backoff=0.1, session=None, session_id=None):
+        """
+        Create a wrapper for the PNPNSC simulator
+        :param player_name: Name of the agent player, must match one of the players in the PNPSC net definition
+        :param net_path: Path to the PNPSC net definition
+        :param sim_url: URL of the simulator, http only
+        :param max_tokens: Maximum expected tokens at any place
+        :param max_rate: Maximum rate allowed a at any transition
+        :param timeout: seconds to wait for the server, a single value or a (connect, read) tuple
+        :param max_retries: number of times a failed request is sent again
+        :param backoff: seconds to wait before the first retry, doubled for each further retry
+        :param session: AsyncHttpClient to send the requests with, shared clients are not closed by close(), by
+            default the environment opens its own
+        :param session_id: id of the simulator session, defaults to a random id
+        """
+        super().__init__(player_name, net_path, sim_url, max_tokens, max_rate, timeout, max_retries, backoff, session,
+                         uuid.uuid4().hex if session_id is None else session_id)
+        # sessions with a random id are only known to this environment, so it deletes them on close
+        self.owns_simulator = session_id is None
+
+    def _open_session(self):
+        """
+        Open the client the environment sends its requests with
+        :return: a new AsyncHttpClient
+        """
+        return AsyncHttpClient()
+
+    def _retryable(self, error, idempotent):
+        """
+        Check if a failed request can be sent again
+        :param error: exception raised by the request
+        :param idempotent: the request can be sent twice
+        :return: True if the request is sent again
+        """
+        if idempotent:
+            return isinstance(error, (ConnectionError, asyncio.TimeoutError))
+        # the client raises HttpConnectError before anything is written, later errors may follow an applied request
+        return isinstance(error, HttpConnectError)
+
+    async def _async_request(self, method, endpoint, json=None, idempotent=False):
+        """
+        Send a request to the simulator, retrying transient failures
+        :param method: HTTP method
+        :param endpoint: path of the endpoint relative to sim_url
+        :param json: json body of the request
+        :param idempotent: the request can be sent twice, so it is also retried after errors that may follow its
+            arrival at the simulator
+        :return: the response
+        """
+        counters = self._counters(endpoint)
+
+        counters['calls'] += 1
+        start = time.perf_counter()
+        try:
+            for attempt in range(self.max_retries + 1):
+                if attempt > 0:
+                    counters['retries'] += 1
+                    await asyncio.sleep(self.backoff * 2 ** (attempt - 1))
+                try:
+                    res = await self.session.request(method, self.sim_url + endpoint, json=json, headers=self.headers,
+                                                     timeout=self.timeout)
+                except (OSError, asyncio.TimeoutError, ValueError) as e:
+                    if not self._retryable(e, idempotent):
+                        self._fail(counters, endpoint, 'request failed', e)
+                    if attempt < self.max_retries:
+                        continue
+                    self._fail(counters, endpoint, 'request failed after ' + str(attempt + 1) + ' attempts', e)
+                if self._accept(res, counters, endpoint, attempt, idempotent):
+                    return res
+        finally:
+            elapsed = time.perf_counter() - start
+            counters['total'] += elapsed
+            counters['max'] = max(counters['max'], elapsed)
+
+    async def _async_update_simulator(self, action, player_name):
+        """
+        Perform a transition rate update
+        :param action: player's rate updates
+        :param player_name: player to update
+        """
+        data = self._rate_changes(action, player_name)
+        res = await self._async_request('POST', 'change_transitions/', json=data)
+        self._apply_changes(res, data)
+
+    async def _async_step_simulator(self):
+        """
+        Step the simulator
+        """
+        res = await self._async_request('GET', 'step/')
+        self.net.update_net(self._json(res, 'step/'))
+
+    async def _async_reset_simulator(self):
+        """
+        Reset the simulator
+        """
+        await self._async_request('GET', 'delete/', idempotent=True)
+        await self._async_request('POST', 'uploadpetrinet/', json=self.net.get_json(), idempotent=True)
+        res = await self._async_request('GET', 'status/', idempotent=True)
+        # the simulator does not report the rates, restore the rates changed in the last episode
+        self.net.reset()
+        self.net.update_net(self._json(res, 'status/'))
+
+    async def async_step(self, action, step_sim=True):
+        """
+        Step the environment with the player's action, see PnpscEnv.step
+        :param action: Player's rate updates
+        :param step_sim: Allow the player to update rates without stepping the simulator
+        :return: environment observation and reward
+        """
+        if action is not None:
+            action = np.array(action)
+            self._pre_step(action)
+            await self._async_update_simulator(action, self.player_name)
+
+        if step_sim:
+            for rates, player_name in self._other_updates():
+                await self._async_update_simulator(rates, player_name)
+            await self._async_step_simulator()
+        return self.get_observation(self.player_name)
+
+    async def async_reset(self, info=False):
+        """
+        Reset the environment, see PnpscEnv.reset
+        :param info: Should the debugging info be returned?
+        :return: the initial observation
+        """
+        await self._async_reset_simulator()
+        self.last_cost = 0
+
+        state = self._state(self.player_name)
+
+        if info:
+            return state, _StepInfo(self.net)
+        else:
+            return state
+
+    async def async_close(self):
+        """
+        Delete the simulator session from the server if the environment created it, the server may be unreachable
+        """
+        if self.owns_simulator:
+            self.owns_simulator = False
+            try:
+                await self._async_request('GET', 'delete/', idempotent=True)
+            except RemoteSimulatorError:
+                pass
+
+    def close(self):
+        """
+        Delete the simulator session created by the environment and close the client opened by the environment
+        """
+        self.session.run(self.async_close())
+        super().close()
+
+    def _update_simulator(self, action, player_name):
+        self.session.run(self._async_update_simulator(action, player_name))
+
+    def _step_simulator(self):
+        self.session.run(self._async_step_simulator())
+
+    def _reset_simulator(self):
+        self.session.run(self._async_reset_simulator())
@@ -0,0 +1,147 @@
+import asyncio
+
+import numpy as np
+from stable_baselines3.common.vec_env import VecEnv
+
+from .async_http_client import AsyncHttpClient
+from .pnpsc_async_remote_env import PnpscAsyncRemoteEnv
+from .pnpsc_remote_env import SIM_URL
+from .pnpsc_subproc_vec_env import _to_gymnasium
+
+
+class PnpscAsyncVecEnv(VecEnv):
+    """
+    Vectorized environment over remote simulator sessions, stepped concurrently from one event loop.
+    Each environment is a PnpscAsyncRemoteEnv with its own simulator session, and all of them share one
+    AsyncHttpClient, so a step costs about one round trip to the server for the whole batch instead of one per
+    environment. The episodes of the environments are independent.
+    Finished environments are reset automatically and their last observation is returned in the info under
+    'terminal_observation', the infos returned by the environments are not forwarded.
+    """
+    def __init__(self, player_name, net_path, num_envs=16, sim_url=SIM_URL, max_connections=None, session=None,
+                 **kwargs):
+        """
+        :param player_name: Name of the agent player, must match one of the players in the PNPSC net definition
+        :param net_path: Path to the PNPSC net definition
+        :param num_envs: number of simulator sessions
+        :param sim_url: URL of the simulator, the server must host one simulator per session id, or a list of URLs
+            the environments are spread over in turn
+        :param max_connections: most requests in flight at once, defaults to one per environment
+        :param session: AsyncHttpClient shared by the environments, by default the vectorized environment opens its
+            own with max_connections connections
+        :param kwargs: further arguments of PnpscAsyncRemoteEnv
+        """
+        self.owns_session = session is None
+        self.session = AsyncHttpClient(max_connections if max_connections is not None else num_envs) \
+            if session is None else session
+        urls = [sim_url] if isinstance(sim_url, str) else list(sim_url)
+        self.envs = [PnpscAsyncRemoteEnv(player_name, net_path, urls[i % len(urls)], session=self.session, **kwargs)
+                     for i in range(num_envs)]
+        observation_space = _to_gymnasium(self.envs[0].observation_space)
+        action_space = _to_gymnasium(self.envs[0].action_space)
+
+        self.actions = None
+        self.observations = np.zeros((num_envs,) + observation_space.shape, dtype=observation_space.dtype)
+        self.rewards = np.zeros(num_envs, dtype=np.float32)
+        self.dones = np.zeros(num_envs, dtype=bool)
+
+        self.render_mode = None
+        super().__init__(num_envs, observation_space, action_space)
+
+    def _gather(self, coroutines):
+        """
+        Run coroutines concurrently on the event loop of the client
+        :param coroutines: coroutines to run
+        :return: their results
+        """
+        async def gather():
+            # wait for all the coroutines before raising, so no request is left half done on the loop
+            results = await asyncio.gather(*coroutines, return_exceptions=True)
+            for result in results:
+                if isinstance(result, BaseException):
+                    raise result
+            return results
+        return self.session.run(gather())
+
+    async def _reset_env(self, i, seed):
+        """
+        Reset one environment into its row of the buffers
+        :param i: index of the environment
+        :param seed: seed of the environment, None to keep its generator
+        """
+        if seed is not None:
+            self.envs[i].seed(seed)
+        self.observations[i] = await self.envs[i].async_reset()
+
+    async def _step_env(self, i, action):
+        """
+        Step one environment into its row of the buffers, resetting it when its episode ends
+        :param i: index of the environment
+        :param action: rate updates of the environment
+        :return: the terminal observation, None if the episode continues
+        """
+        obs, reward, done, _ = await self.envs[i].async_step(action)
+        terminal = None
+        if done:
+            terminal = obs.copy()
+            obs = await self.envs[i].async_reset()
+        self.observations[i], self.rewards[i], self.dones[i] = obs, reward, done
+        return terminal
+
+    def reset(self):
+        """
+        Reset all the environments, seeds set with seed() are passed to the environments
+        :return: matrix of initial observations
+        """
+        self._gather([self._reset_env(i, seed) for i, seed in enumerate(self._seeds)])
+        self._reset_seeds()
+        return self.observations.copy()
+
+    def step_async(self, actions):
+        self.actions = actions
+
+    def step_wait(self):
+        """
+        Step all the environments concurrently
+        :return: observations, rewards, dones and infos of the environments
+        """
+        terminals = self._gather([self._step_env(i, action) for i, action in enumerate(self.actions)])
+        infos = [{} if t is None else {'terminal_observation': t} for t in terminals]
+        return self.observations.copy(), self.rewards.copy(), self.dones.copy(), infos
+
+    def latency_stats(self):
+        """
+        Request counters of each endpoint summed over the environments, times are the wall clock seconds of the
+        requests, which overlap between environments
+        :return: dictionary of calls, retries, errors, total, mean and max time per endpoint
+        """
+        stats = {}
+        for env in self.envs:
+            for endpoint, c in env.latency.items():
+                total = stats.setdefault(endpoint, {'calls': 0, 'retries': 0, 'errors': 0, 'total': 0.0, 'max': 0.0})
+                for k in ['calls', 'retries', 'errors', 'total']:
+                    total[k] += c[k]
+                total['max'] = max(total['max'], c['max'])
+        return {endpoint: dict(c, mean=c['total'] / c['calls']) for endpoint, c in stats.items()}
+
+    def close(self):
+        """
+        Delete the simulator sessions of the environments and close the connections of the client opened by the
+        vectorized environment
+        """
+        self._gather([env.async_close() for env in self.envs])
+        if self.owns_session:
+            self.session.close()
+
+    def get_attr(self, attr_name, indices=None):
+        return [getattr(self.envs[i], attr_name) for i in self._get_indices(indices)]
+
+    def set_attr(self, attr_name, value, indices=None):
+        for i in self._get_indices(indices):
+            setattr(self.envs[i], attr_name, value)
+
+    def env_method(self, method_name, *method_args, indices=None, **method_kwargs):
+        return [getattr(self.envs[i], method_name)(*method_args, **method_kwargs) for i in self._get_indices(indices)]
+
+    def env_is_wrapped(self, wrapper_class, indices=None):
+        return [isinstance(self.envs[i], wrapper_class) for i in self._get_indices(indices)]
@@ -1,25 +1,73 @@
-import json
 import os
 from abc import ABC, abstractmethod
+from collections.abc import MutableMapping
 
 import gym
 import numpy as np
 
 from .pnpsc_net import PnpscNet
 from ..agents.abstract_agent import AbstractAgent
+from ..simulator.compiled_net import load_net
+from ..simulator.rng import make_rng
+from ..simulator.simulator import GOAL_REWARD
+
+
+class _StepInfo(MutableMapping):
+    """
+    Info returned by the environment, the marking is only looked up when it is read. The first write copies the
+    marking into a dict, so wrappers can add and pop keys as with a plain info dict
+    """
+    __slots__ = ('_net', '_data')
+
+    def __init__(self, net):
+        self._net = net
+        self._data = None
+
+    def _dict(self):
+        if self._data is None:
+            self._data = {'places': dict(self._net.get_all_places())}
+        return self._data
+
+    def __getitem__(self, key):
+        if self._data is not None:
+            return self._data[key]
+        if key != 'places':
+            raise KeyError(key)
+        return self._net.get_all_places()
+
+    def __setitem__(self, key, value):
+        self._dict()[key] = value
+
+    def __delitem__(self, key):
+        del self._dict()[key]
+
+    def __iter__(self):
+        return iter(('places',) if self._data is None else self._data)
+
+    def __len__(self):
+        return 1 if self._data is None else len(self._data)
+
+    def __reduce__(self):
+        # pickle a plain copy of the marking rather than the net
+        return dict, (dict(self._dict()),)
 
 
 class PnpscEnv(ABC, gym.Env):
 
-    def __init__(self, player_name, net_path, max_tokens=10, max_rate=10):
+    def __init__(self, player_name, net_path, max_tokens=10, max_rate=10, seed=None, copy_obs=False):
         """
         Create a Gym environment that wraps for the PNPNSC simulator
         :param player_name: Name of the agent player, must match one of the players in the PNPSC net definition
         :param net_path: Path to the PNPSC net definition
         :param max_tokens: Maximum expected tokens at any place
         :param max_rate: Maximum expected rate for any transition
+        :param seed: seed or Generator of the simulation, None draws from the global np.random state
+        :param copy_obs: Return a new array for each observation of the player, by default the same buffer is
+            overwritten by every step and reset
         """
         self.player_name = player_name
+        self.copy_obs = copy_obs
+        self.rng = make_rng(seed)
         self.max_tokens = max_tokens
         self.max_rate = max_rate
 
@@ -27,10 +75,9 @@ class PnpscEnv(ABC, gym.Env):
 
         self.net_path = net_path
 
-        # Load the PNPSC definition from path provided
-        with open(os.getcwd() + '/nets/' + net_path) as f:
-            data = json.load(f)
-            self.net = PnpscNet(data)
+        # Load the PNPSC definition from path provided, the compiled definition is shared by all environments
+        compiled = load_net(os.getcwd() + '/nets/' + net_path)
+        self.net = PnpscNet(compiled.json, compiled)
 
         self.goal_places = self.net.get_goal_places(player_name)
         self.end_places = self.net.get_end_places(player_name)
@@ -51,6 +98,14 @@ class PnpscEnv(ABC, gym.Env):
         # Accumulated costs so far, used to find the current action cost
         self.last_cost = 0
 
+        # array indices of the observed places and rates of each player, and the reused observation of the player
+        self._visible = self.net.visible_index
+        self._controlled = self.net.controlled_index
+        self._goals = np.array([self.net.place_index[p] for p in self.goal_places], dtype=np.intp)
+        self._ends = np.array([self.net.place_index[p] for p in self.end_places], dtype=np.intp)
+        self._num_visible = places
+        self._obs = np.empty(places + rates)
+
     def c_change(self, a, cr):
         """
         An arbitrary cost function for testing
@@ -73,11 +128,17 @@ class PnpscEnv(ABC, gym.Env):
         Action to perform after the players rates are set
         :param action: player's rate updates
         """
+        for rates, player_name in self._other_updates():
+            self._update_simulator(rates, player_name)
+
+    def _other_updates(self):
+        """
+        Rate updates of the other players, shared with the environments that send the updates asynchronously
+        :return: generator of (rates, player name), each player acts on the net updated by the players before it
+        """
         # perform other player's actions
         for p in self.other_players:
-            state, _, _, _ = self.get_observation(p.player_name)
-            a = np.clip(p.act(self.net)[0], 0, self.max_rate)
-            self._update_simulator(a, p.player_name)
+            yield np.clip(p.act(self.net)[0], 0, self.max_rate), p.player_name
 
     @abstractmethod
     def _update_simulator(self, action, player_name):
@@ -100,7 +161,8 @@ class PnpscEnv(ABC, gym.Env):
         Step the environment with the player's action
         :param action: Player's rate updates
         :param step_sim: Allow the player to update rates without stepping the simulator
-        :return: environment observation and reward
+        :return: environment observation and reward, unless copy_obs is set the observation is the buffer of the
+            environment that the next step and reset overwrite, copy it to keep it
         """
         if action is not None:
             action = np.array(action)
@@ -112,48 +174,70 @@ class PnpscEnv(ABC, gym.Env):
             self._step_simulator()
         return self.get_observation(self.player_name)
 
+    def _state(self, player_name):
+        """
+        Observed places and controlled rates of a player
+        :param player_name: name of the player
+        :return: the observation of the player, the reused buffer for the learning player unless copy_obs is set
+        """
+        places, rates = self.net.place_values, self.net.rate_values
+        if player_name != self.player_name:
+            return np.concatenate([places[self._visible[player_name]], rates[self._controlled[player_name]]])
+        state = self._obs
+        state[:self._num_visible] = places[self._visible[player_name]]
+        state[self._num_visible:] = rates[self._controlled[player_name]]
+        return state.copy() if self.copy_obs else state
+
     def get_observation(self, player_name):
         """
         Generates the observation for a player
         :param player_name: name of the player for whom the observation is for
         :return: the observation and reward for the player
         """
-        state = np.concatenate([list(self.net.get_visible_places(player_name).values()),
-                                list(self.net.get_controlled_rates(player_name).values())])
+        state = self._state(player_name)
 
         reward = 0
         # Only tracking the current learning player right now
         if self.player_name == player_name:
-            reward = -(self.net.get_player_cost(player_name) - self.last_cost)
+            cost = self.net.get_player_cost(player_name)
+            reward = -(cost - self.last_cost)
             # Update the cost tracking variable
-            self.last_cost = self.net.get_player_cost(player_name)
+            self.last_cost = cost
 
-        all_places = self.net.get_all_places()
+        places = self.net.place_values
         done = self.net.done
-        for goal in self.goal_places:
-            if all_places[goal] > 0:
-                done = True
-                reward += 100
-        for end in self.end_places:
-            if all_places[end] > 0:
-                done = True
+        goals = np.count_nonzero(places[self._goals])
+        if goals > 0:
+            done = True
+            reward += GOAL_REWARD * goals
+        if np.count_nonzero(places[self._ends]) > 0:
+            done = True
+
+        return state, reward, done, _StepInfo(self.net)
 
-        return state, reward, done, {'places': self.net.get_all_places()}
+    def seed(self, seed=None):
+        """
+        Replace the random generator of the simulation, used from the next reset on,
+        reset takes no seed since stable baselines would then treat the environment as a gym 0.26 environment
+        :param seed: seed or Generator, None draws from the global np.random state
+        :return: list with the seed
+        """
+        self.rng = make_rng(seed)
+        return [seed]
 
     def reset(self, info=False):
         """
-        Reset the environment
+        Reset the environment, use seed() to seed the episodes
         :param info: Should the debugging info be returned?
         :return: the initial observation
         """
         self._reset_simulator()
         self.last_cost = 0
 
-        state = np.concatenate([list(self.net.get_visible_places(self.player_name).values()),
-                                list(self.net.get_controlled_rates(self.player_name).values())])
+        state = self._state(self.player_name)
 
         if info:
-            return state, {'places': self.net.get_all_places()}
+            return state, _StepInfo(self.net)
         else:
             return state
 
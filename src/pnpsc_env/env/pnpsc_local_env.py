@@ -1,26 +1,36 @@
+from collections import namedtuple
+
 import numpy as np
 
 from .pnpsc_env import PnpscEnv
 from ..simulator.simulator import Simulator
 
 
+# State of an episode returned by PnpscLocalEnv.snapshot()
+LocalEnvState = namedtuple('LocalEnvState', ['simulator', 'last_cost'])
+
+
 class PnpscLocalEnv(PnpscEnv):
     """
     Local implementation of the PnpscEnv abstract class
     """
 
-    def __init__(self, player_name, net_path, max_tokens=16, max_rate=10):
+    def __init__(self, player_name, net_path, max_tokens=16, max_rate=10, scheduler='race', seed=None,
+                 copy_obs=False):
         """
         Create a wrapper for the PNPNSC simulator
         :param player_name: Name of the agent player, must match one of the players in the PNPSC net definition
         :param net_path: Path to the PNPSC net definition
         :param max_tokens: Maximum expected tokens at any place
         :param max_rate: Maximum rate allowed a at any transition
+        :param scheduler: Simulator scheduling mode, 'race' or 'next_reaction'
+        :param seed: seed or Generator of the simulation, None draws from the global np.random state
+        :param copy_obs: Return a new array for each observation, by default the same buffer is reused
         """
-        super().__init__(player_name, net_path, max_tokens, max_rate)
+        super().__init__(player_name, net_path, max_tokens, max_rate, seed, copy_obs)
 
         # Load the PNPSC definition from path provided
-        self.simulator = Simulator(self.net)
+        self.simulator = Simulator(self.net, scheduler=scheduler, seed=self.rng)
 
     def _update_simulator(self, action, player_name):
         """
@@ -28,15 +38,11 @@ class PnpscLocalEnv(PnpscEnv):
         :param action: Player's rate updates
         :return: Next observation and reward from the environment
         """
-        current_rates = list(self.net.get_controlled_rates(player_name).values())
-        update_cost = self.c_change(np.array(action), np.array(current_rates))
+        current_rates = self.net.rate_values[self._controlled[player_name]]
+        update_cost = self.c_change(np.asarray(action), current_rates)
 
-        updates = {}
-        i = 0
-        for k, v in self.net.get_controlled_rates(player_name).items():
-            if v != action[i]:
-                updates[k] = action[i]
-            i += 1
+        updates = {k: a for k, v, a in zip(self.net.controlled_rates[player_name], current_rates.tolist(), action)
+                   if v != a}
 
         self.simulator.update_rates(updates)
         self.net.costs[player_name] += update_cost
@@ -51,7 +57,24 @@ class PnpscLocalEnv(PnpscEnv):
         """
         Reset the simulator
         """
-        self.simulator.reset()
+        self.simulator.reset(self.rng)
+
+    def snapshot(self):
+        """
+        Capture the state of the episode, the opponent agents are not included
+        :return: immutable LocalEnvState
+        """
+        return LocalEnvState(self.simulator.snapshot(), self.last_cost)
+
+    def restore(self, state, restore_rng=True):
+        """
+        Return the episode to a snapshot
+        :param state: LocalEnvState from snapshot()
+        :param restore_rng: also return the random generator to the snapshot, rollouts from the same state should
+            pass False so they draw different firing times
+        """
+        self.simulator.restore(state.simulator, restore_rng)
+        self.last_cost = state.last_cost
 
     def render(self):
         """
@@ -0,0 +1,228 @@
+import os
+
+import numpy as np
+from gymnasium import spaces
+from stable_baselines3.common.vec_env import VecEnv
+
+from .pnpsc_net import PnpscNet
+from ..simulator.batch_kernel import make_batch_kernel
+from ..simulator.compiled_net import load_net
+from ..simulator.rng import make_rng
+from ..simulator.simulator import GOAL_REWARD
+
+
+class PnpscLockstepVecEnv(VecEnv):
+    """
+    Vectorized environment that advances num_envs independent episodes of a PNPSC net together.
+    The markings and rates of all episodes are held in matrices and every step fires one transition in each episode
+    with the batch kernel, so the cost of a step barely grows with the number of episodes. Each episode follows the
+    rules of PnpscEnv: the player pays the cost of its rate changes, receives the goal reward for each of its marked
+    goal places, and the episode ends on a goal place, an end place or when no transition is enabled. Enabled
+    transitions with rate 0 fire LARGE_TIME after the current time, as in Simulator.
+    Finished episodes are reset automatically, their last observation is returned in the info under
+    'terminal_observation' as stable baselines expects.
+    The actions are continuous rates, or with options the discrete single rate updates of DiscretePnpscWrapper, so a
+    DqnAgent can learn from all the episodes at once.
+    """
+    def __init__(self, player_name, net_path, num_envs=64, max_tokens=10, max_rate=10, backend='auto', f=None,
+                 options=None, max_actions=1, seed=None):
+        """
+        :param player_name: Name of the agent player, must match one of the players in the PNPSC net definition
+        :param net_path: Path to the PNPSC net definition
+        :param num_envs: Number of episodes stepped together
+        :param max_tokens: Maximum expected tokens at any place
+        :param max_rate: Maximum expected rate for any transition
+        :param backend: Backend of the batch kernel, 'dense', 'sparse' or 'auto'
+        :param f: update function for rates applied with the discrete actions, f(rates, option) must accept an array
+            of rates, defaults to replacing the rate with the option
+        :param options: update options for f, None uses continuous actions that set all the controlled rates
+        :param max_actions: maximum discrete updates each simulator step
+        :param seed: seed or Generator of the simulation, None draws from the global np.random state
+        """
+        self.player_name = player_name
+        self.net_path = net_path
+        self.max_tokens = max_tokens
+        self.max_rate = max_rate
+        self.rng = make_rng(seed)
+
+        self.compiled = load_net(os.getcwd() + '/nets/' + net_path)
+        self.net = PnpscNet(self.compiled.json, self.compiled)
+        assert self.player_name in self.net.players, 'player_name must be part of PNPSC net definition'
+
+        self.kernel = make_batch_kernel(self.compiled, backend)
+        index = self.compiled.place_index
+        self.obs_places = np.array([index[p] for p in self.net.visible_places[player_name]], dtype=np.intp)
+        self.goal_places = np.array([index[p] for p in self.net.get_goal_places(player_name)], dtype=np.intp)
+        self.end_places = np.array([index[p] for p in self.net.get_end_places(player_name)], dtype=np.intp)
+        self.obs_rates = np.array([self.compiled.transition_index[t] for t in self.net.controlled_rates[player_name]],
+                                  dtype=np.intp)
+        self.initial_places = self.net.initial_places
+        self.initial_rates = self.net.initial_rates.astype(float)
+
+        self.places = np.repeat(self.initial_places[np.newaxis], num_envs, axis=0)
+        self.rates = np.repeat(self.initial_rates[np.newaxis], num_envs, axis=0)
+        self.t = np.zeros(num_envs)
+
+        num_obs = len(self.obs_places) + len(self.obs_rates)
+        high = np.concatenate([np.full(len(self.obs_places), max_tokens, dtype=np.float32),
+                               np.full(len(self.obs_rates), max_rate, dtype=np.float32)])
+        self.options = options
+        if options is None:
+            observation_space = spaces.Box(low=0, high=high, shape=(num_obs,), dtype=np.float32)
+            action_space = spaces.Box(low=0, high=max_rate, shape=(len(self.obs_rates),), dtype=np.float32)
+        else:
+            # the same action table as DiscretePnpscWrapper, the last action ends the turn
+            self.f = f if f is not None else lambda x, o: o
+            self.max_actions = max_actions
+            self.actions_table = [(t, o) for t in self.net.controlled_rates[player_name] for o in options]
+            self.actions_table.append(('end', 0))
+            self.action = np.zeros(num_envs, dtype=np.int64)
+            observation_space = spaces.Box(low=0, high=np.append(high, max_actions).astype(np.float32),
+                                           shape=(num_obs + 1,), dtype=np.float32)
+            action_space = spaces.Discrete(len(self.actions_table))
+
+        self.actions = None
+        self.render_mode = None
+        super().__init__(num_envs, observation_space, action_space)
+
+    def _observation(self, rows=slice(None)):
+        """
+        Observations of a set of episodes
+        :param rows: episodes to observe
+        :return: matrix with one observation per episode
+        """
+        obs = np.concatenate([self.places[rows][:, self.obs_places], self.rates[rows][:, self.obs_rates]], axis=1)
+        if self.options is not None:
+            obs = np.concatenate([obs, self.action[rows, np.newaxis]], axis=1)
+        return obs.astype(np.float32)
+
+    def _reset_rows(self, rows):
+        """
+        Return a set of episodes to the initial marking and rates
+        :param rows: episodes to reset
+        """
+        self.places[rows] = self.initial_places
+        self.rates[rows] = self.initial_rates
+        self.t[rows] = 0
+        if self.options is not None:
+            self.action[rows] = 0
+
+    def reset(self):
+        """
+        Reset all the episodes, a seed set with seed() replaces the random generator shared by the episodes
+        :return: matrix of initial observations
+        """
+        if self._seeds[0] is not None:
+            self.rng = make_rng(self._seeds[0])
+            self._reset_seeds()
+        self._reset_rows(slice(None))
+        return self._observation()
+
+    def step_async(self, actions):
+        self.actions = actions
+
+    def step_wait(self):
+        """
+        Apply the actions and fire one transition in every episode whose turn is over
+        :return: observations, rewards, dones and infos of the episodes
+        """
+        if self.options is None:
+            rewards, step_sim = self._apply_rates(np.asarray(self.actions, dtype=float))
+        else:
+            rewards, step_sim = self._apply_discrete(np.asarray(self.actions))
+
+        dones = np.zeros(self.num_envs, dtype=bool)
+        rows = np.flatnonzero(step_sim)
+        if len(rows) > 0:
+            dones[rows] = self._simulate(rows)
+            marked = self.places[rows][:, self.goal_places] > 0
+            rewards[rows] += GOAL_REWARD * np.count_nonzero(marked, axis=1)
+
+        obs = self._observation()
+        infos = [{} for _ in range(self.num_envs)]
+        finished = np.flatnonzero(dones)
+        if len(finished) > 0:
+            for i in finished:
+                infos[i]['terminal_observation'] = obs[i].copy()
+            self._reset_rows(finished)
+            obs[finished] = self._observation(finished)
+        return obs, rewards.astype(np.float32), dones, infos
+
+    def _apply_rates(self, actions):
+        """
+        Set the controlled rates of every episode
+        :param actions: matrix of the new controlled rates, one row per episode
+        :return: cost rewards and the episodes to simulate
+        """
+        actions = np.clip(actions.reshape(self.num_envs, -1), 0, self.max_rate)
+        rewards = -np.sum(np.abs(actions - self.rates[:, self.obs_rates]), axis=1) / 10
+        self.rates[:, self.obs_rates] = actions
+        return rewards, np.ones(self.num_envs, dtype=bool)
+
+    def _apply_discrete(self, actions):
+        """
+        Apply one discrete update to each episode, as DiscretePnpscWrapper does
+        :param actions: index in the action table for each episode
+        :return: cost rewards and the episodes to simulate
+        """
+        actions = actions.reshape(self.num_envs)
+        rewards = np.zeros(self.num_envs)
+        end = actions == len(self.actions_table) - 1
+        self.action = (self.action + 1) % self.max_actions
+        step_sim = end | (self.action == 0)
+        self.action[end] = 0
+        for a in np.unique(actions[~end]):
+            rows = np.flatnonzero(actions == a)
+            name, option = self.actions_table[a]
+            t = self.compiled.transition_index[name]
+            new = np.clip(self.f(self.rates[rows, t], option), 0, self.max_rate)
+            rewards[rows] = -np.abs(new - self.rates[rows, t]) / 10
+            self.rates[rows, t] = new
+        return rewards, step_sim
+
+    def _simulate(self, rows):
+        """
+        Fire the first transition of an exponential race in a set of episodes
+        :param rows: episodes to step
+        :return: flags of the episodes that are done
+        """
+        places = self.places[rows]
+        j, ft, running = self.kernel.race(places, self.rates[rows], self.rng)
+        done = ~running
+        self.t[rows] += np.where(done, 0, ft)
+        self.kernel.fire(places, j, running[:, np.newaxis])
+        self.places[rows] = places
+
+        if len(self.goal_places) > 0:
+            done |= np.any(places[:, self.goal_places] > 0, axis=1)
+        if len(self.end_places) > 0:
+            done |= np.any(places[:, self.end_places] > 0, axis=1)
+        return done
+
+    def generate_action(self, action, rates):
+        """
+        Applies a discrete action from the action table to the supplied rates, as DiscretePnpscWrapper does
+        :param action: desired action
+        :param rates: dictionary of rates to update
+        :return: the updated rates, or None for the end turn action
+        """
+        if action == len(self.actions_table) - 1:
+            return None
+        ti, to = self.actions_table[action]
+        rates[ti] = self.f(rates[ti], to)
+        return rates
+
+    def close(self):
+        pass
+
+    def get_attr(self, attr_name, indices=None):
+        return [getattr(self, attr_name) for _ in self._get_indices(indices)]
+
+    def set_attr(self, attr_name, value, indices=None):
+        setattr(self, attr_name, value)
+
+    def env_method(self, method_name, *method_args, indices=None, **method_kwargs):
+        return [getattr(self, method_name)(*method_args, **method_kwargs) for _ in self._get_indices(indices)]
+
+    def env_is_wrapped(self, wrapper_class, indices=None):
+        return [False for _ in self._get_indices(indices)]
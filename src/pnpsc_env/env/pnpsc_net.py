@@ -1,41 +1,122 @@
+from collections.abc import MutableMapping
+
 import numpy as np
 
+from ..simulator.compiled_net import CompiledNet
+
+
+class ArrayView(MutableMapping):
+    """
+    Name keyed view of an array held by PnpscNet, reads and writes go to the array
+    """
+    __slots__ = ('_names', '_index', '_values')
+
+    def __init__(self, names, index, values):
+        """
+        :param names: keys in array order
+        :param index: dictionary of key to array index
+        :param values: backing array
+        """
+        self._names = names
+        self._index = index
+        self._values = values
+
+    def __getitem__(self, key):
+        return self._values[self._index[key]].item()
+
+    def __setitem__(self, key, value):
+        self._values[self._index[key]] = value
+
+    def __delitem__(self, key):
+        raise TypeError('entries of the net cannot be removed')
+
+    def __iter__(self):
+        return iter(self._names)
+
+    def __len__(self):
+        return len(self._names)
+
+    def __contains__(self, key):
+        return key in self._index
+
+    def __repr__(self):
+        return repr(dict(zip(self._names, self._values.tolist())))
+
 
 class PnpscNet():
     """
-    Data class used to store all information associated with a PNPNSC net for all players
+    Data class used to store all information associated with a PNPNSC net for all players.
+    The marking, rates and costs are held in arrays in name order, places, rates and costs are name keyed views of
+    them, and assigning a mapping to one of them updates the listed entries.
     """
-    def __init__(self, json):
+    __slots__ = ('compiled', 'json', 'done', 'players', 'place_names', 'transition_names', 'place_index',
+                 'transition_index', 'place_values', 'rate_values', 'cost_values', 'initial_places', 'initial_rates',
+                 'visible_places', 'controlled_rates', 'goal_places', 'visible_index', 'controlled_index', '_places',
+                 '_rates', '_costs')
+
+    def __init__(self, json, compiled=None):
         """
         :param json: PNPSC net definition in json format
+        :param compiled: CompiledNet of the definition shared with other nets, compiled from json if not given
         """
+        self.compiled = compiled if compiled is not None else CompiledNet(json)
         self.json = json
         self.done = False
-        self.players = [item['name'] for item in json['players']]
-        self.costs = {p: 0 for p in self.players}
-
-        # Load the initial names and rates for transitions, ordered to allow for easy mapping later
-        self.rates = {t['name']: t['rate'] for t in sorted(json['transitions'], key=lambda x: x['name'])}
-
-        self.places = {p['name']: p['marking'] for p in sorted(json['places'], key=lambda x: x['name'])}
-
-        self.controlled_rates = {}
-        self.visible_places = {}
-        for player in self.players:
-            self.visible_places[player] = [p['name'] for p in sorted(json['places'], key=lambda x: x['name'])
-                                           if
-                                           p['player_observable'] is not None and player in p[
-                                               'player_observable'].split(
-                                               ',')]
-            self.controlled_rates[player] = [t['name'] for t in sorted(json['transitions'], key=lambda x: x['name'])
-                                             if
-                                             t['player_control'] == player]
-
-        self.goal_places = {p: [] for p in self.players}
-        for p in json['places']:
-            if 'goal' in p and p['goal'] in self.players:
-                self.goal_places[p['goal']].append(p['name'])
-
+        self.players = self.compiled.players
+
+        # the structure is shared with the compiled net, places and transitions are in name order
+        self.place_names = self.compiled.place_names
+        self.transition_names = self.compiled.transition_names
+        self.place_index = self.compiled.place_index
+        self.transition_index = self.compiled.transition_index
+        self.visible_places = self.compiled.visible_places
+        self.controlled_rates = self.compiled.controlled_rates
+        self.visible_index = self.compiled.visible_index
+        self.controlled_index = self.compiled.controlled_index
+        self.goal_places = self.compiled.goal_places
+
+        # the initial rates keep the type of the definition, the current rates are always floats
+        self.initial_places = self.compiled.initial_places
+        self.initial_rates = self.compiled.initial_rates
+        self.place_values = self.initial_places.copy()
+        self.rate_values = self.initial_rates.astype(float)
+        self.cost_values = np.zeros(len(self.players))
+        self._places = ArrayView(self.place_names, self.place_index, self.place_values)
+        self._rates = ArrayView(self.transition_names, self.transition_index, self.rate_values)
+        self._costs = ArrayView(self.players, {p: i for i, p in enumerate(self.players)}, self.cost_values)
+
+    @property
+    def places(self):
+        return self._places
+
+    @places.setter
+    def places(self, places):
+        self._places.update(places)
+
+    @property
+    def rates(self):
+        return self._rates
+
+    @rates.setter
+    def rates(self, rates):
+        self._rates.update(rates)
+
+    @property
+    def costs(self):
+        return self._costs
+
+    @costs.setter
+    def costs(self, costs):
+        self._costs.update(costs)
+
+    def reset(self):
+        """
+        Return the net to the initial marking and rates with no costs
+        """
+        self.done = False
+        self.place_values[:] = self.initial_places
+        self.rate_values[:] = self.initial_rates
+        self.cost_values[:] = 0
 
     def get_all_places(self):
         """
@@ -57,7 +138,7 @@ class PnpscNet():
         :param player_name: name of the player
         :return: the current visible marking for a player
         """
-        return {p: self.places[p] for p in self.visible_places[player_name]}
+        return dict(zip(self.visible_places[player_name], self.place_values[self.visible_index[player_name]].tolist()))
 
     def get_controlled_rates(self, player_name):
         """
@@ -65,7 +146,8 @@ class PnpscNet():
         :param player_name: name of the player
         :return: a list of transition rates visible to a player
         """
-        return {r: self.rates[r] for r in self.controlled_rates[player_name]}
+        return dict(zip(self.controlled_rates[player_name],
+                        self.rate_values[self.controlled_index[player_name]].tolist()))
 
     def get_player_cost(self, player_name):
         """
@@ -94,13 +176,16 @@ class PnpscNet():
         for p in json['players']:
             self.costs[p['name']] = p['cost']
 
+        # rates are only reported by the local simulator server
+        for t in json.get('transitions', ()):
+            self.rates[t['name']] = t['rate']
+
     def get_marked_places(self):
         """
         Get a list of all marked places, ideal for printing
         :return: list of places that contain at least one token
         """
-        return np.array(list(self.get_all_places().keys()))[
-                  np.where(np.array(list(self.get_all_places().values())) > 0)]
+        return np.array(self.place_names)[np.flatnonzero(self.place_values > 0)]
 
     def get_goal_places(self, player_name):
         """
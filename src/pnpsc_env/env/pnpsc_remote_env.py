@@ -1,16 +1,52 @@
+import time
+
 import numpy as np
 import requests
+from urllib3.exceptions import ConnectTimeoutError
 
 from .pnpsc_env import PnpscEnv
 
+# URL of the cloud simulator
+SIM_URL = 'http://pnpsc.net:8001/'
+
+# Header naming the simulator of a request on servers that host one simulator per session
+SESSION_HEADER = 'Session-Id'
+
+# Responses of overloaded or restarting servers, the request was not applied so it is sent again
+RETRY_STATUSES = (503,)
+
+# Gateway errors, the simulator may have applied the request before the gateway gave up on it, so only requests that
+# can be sent twice are sent again
+IDEMPOTENT_RETRY_STATUSES = (502, 504)
+
+
+class RemoteSimulatorError(RuntimeError):
+    """
+    A request to the remote simulator failed or was rejected
+    """
+    def __init__(self, message, endpoint, status_code=None):
+        """
+        :param message: description of the failure
+        :param endpoint: endpoint of the request
+        :param status_code: HTTP status of the response, None if no response was received
+        """
+        super().__init__(message + ' (' + endpoint + (', status ' + str(status_code) if status_code else '') + ')')
+        self.endpoint = endpoint
+        self.status_code = status_code
+
 
 class PnpscRemoteEnv(PnpscEnv):
     """
     Remote implementation of the PnpscEnv abstract class
     Uses the cloud simulator provided by Colvette
+    Requests go through one requests.Session so the connections are kept alive between steps. Requests that could not
+    connect and the statuses in RETRY_STATUSES are retried with exponential backoff. Other connection errors, read
+    timeouts and the statuses in IDEMPOTENT_RETRY_STATUSES may follow a request the simulator applied, so they are
+    only retried for requests that can be sent twice. Failures raise RemoteSimulatorError.
     """
 
-    def __init__(self, player_name, net_path, sim_url='http://pnpsc.net:8001/', max_tokens=16, max_rate=10):
+    def __init__(self, player_name, net_path, sim_url=SIM_URL, max_tokens=16, max_rate=10,
+                 timeout=(3.05, 30), max_retries=3, backoff=0.1, session=None, session_id=None):
         """
         Create a wrapper for the PNPNSC simulator
         :param player_name: Name of the agent player, must match one of the players in the PNPSC net definition
@@ -18,19 +54,154 @@ class PnpscRemoteEnv(PnpscEnv):
         :param sim_url: URL of the simulator
         :param max_tokens: Maximum expected tokens at any place
         :param max_rate: Maximum rate allowed a at any transition
+        :param timeout: seconds to wait for the server, a single value or a (connect, read) tuple
+        :param max_retries: number of times a failed request is sent again
+        :param backoff: seconds to wait before the first retry, doubled for each further retry
+        :param session: requests.Session to send the requests with, shared sessions are not closed by close(), by
+            default the environment opens its own
+        :param session_id: id of the simulator on servers that host one per session, sent in the SESSION_HEADER
+            header, None for servers with a single simulator
         """
-
+        assert max_retries >= 0, 'max_retries must not be negative'
         self.sim_url = sim_url
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.session_id = session_id
+        # the session id is sent with every request when the server hosts several simulators
+        self.headers = {SESSION_HEADER: session_id} if session_id is not None else None
+        self.owns_session = session is None
+        self.session = self._open_session() if session is None else session
+        # per endpoint counters of the requests, see latency_stats
+        self.latency = {}
         super().__init__(player_name, net_path, max_tokens, max_rate)
 
-    def _update_simulator(self, action, player_name):
+    def _open_session(self):
         """
-        Perform a transition rate update and step the simulator one step
-        :param action: Player's rate updates
-        :return: Next observation and reward from the environment
+        Open the session the environment sends its requests with
+        :return: a new requests.Session
+        """
+        session = requests.Session()
+        session.headers.update({'Accept': 'application/json'})
+        return session
+
+    def _counters(self, endpoint):
+        """
+        Request counters of an endpoint, created on the first request
+        :param endpoint: path of the endpoint
+        :return: dictionary of calls, retries, errors, total and max time
+        """
+        counters = self.latency.get(endpoint)
+        if counters is None:
+            counters = self.latency[endpoint] = {'calls': 0, 'retries': 0, 'errors': 0, 'total': 0.0, 'max': 0.0}
+        return counters
+
+    def _fail(self, counters, endpoint, message, error=None, status_code=None):
+        """
+        Count a failed request and raise its error
+        :param counters: counters of the endpoint
+        :param endpoint: path of the endpoint
+        :param message: description of the failure
+        :param error: exception that caused the failure
+        :param status_code: HTTP status of the response
+        """
+        counters['errors'] += 1
+        raise RemoteSimulatorError(message + (': ' + str(error) if error is not None else ''), endpoint,
+                                   status_code) from error
+
+    def _accept(self, res, counters, endpoint, attempt, idempotent):
+        """
+        Check the status of a response
+        :param res: response
+        :param counters: counters of the endpoint
+        :param endpoint: path of the endpoint
+        :param attempt: number of the attempt, from 0
+        :param idempotent: the request can be sent twice
+        :return: True if the response is accepted, False if the request should be sent again
+        """
+        retry = res.status_code in RETRY_STATUSES or (idempotent and res.status_code in IDEMPOTENT_RETRY_STATUSES)
+        if retry and attempt < self.max_retries:
+            return False
+        if res.status_code != 200:
+            self._fail(counters, endpoint, 'request rejected: ' + res.text[:200], status_code=res.status_code)
+        return True
+
+    def _retryable(self, error, idempotent):
+        """
+        Check if a failed request can be sent again
+        :param error: exception raised by the request
+        :param idempotent: the request can be sent twice
+        :return: True if the request is sent again
         """
-        headers = {'Content-type': 'application/json', 'Accept': 'application/json'}
+        if idempotent:
+            return isinstance(error, (requests.ConnectionError, requests.Timeout))
+        # only a request that never reached the server is known not to have changed the simulator
+        if isinstance(error, requests.ConnectTimeout):
+            return True
+        reason = getattr(error.args[0], 'reason', None) if error.args else None
+        return isinstance(error, requests.ConnectionError) and isinstance(reason, ConnectTimeoutError)
 
+    def _request(self, method, endpoint, json=None, idempotent=False):
+        """
+        Send a request to the simulator, retrying transient failures
+        :param method: HTTP method
+        :param endpoint: path of the endpoint relative to sim_url
+        :param json: json body of the request
+        :param idempotent: the request can be sent twice, so it is also retried after errors that may follow its
+            arrival at the simulator
+        :return: the response
+        """
+        counters = self._counters(endpoint)
+
+        counters['calls'] += 1
+        start = time.perf_counter()
+        try:
+            for attempt in range(self.max_retries + 1):
+                if attempt > 0:
+                    counters['retries'] += 1
+                    time.sleep(self.backoff * 2 ** (attempt - 1))
+                try:
+                    res = self.session.request(method, self.sim_url + endpoint, json=json, headers=self.headers,
+                                               timeout=self.timeout)
+                except requests.RequestException as e:
+                    if not self._retryable(e, idempotent):
+                        self._fail(counters, endpoint, 'request failed', e)
+                    if attempt < self.max_retries:
+                        continue
+                    self._fail(counters, endpoint, 'request failed after ' + str(attempt + 1) + ' attempts', e)
+                if self._accept(res, counters, endpoint, attempt, idempotent):
+                    return res
+        finally:
+            elapsed = time.perf_counter() - start
+            counters['total'] += elapsed
+            counters['max'] = max(counters['max'], elapsed)
+
+    def _json(self, res, endpoint):
+        """
+        Parse the json body of a response
+        :param res: response
+        :param endpoint: endpoint of the request, for the error message
+        :return: the parsed body
+        """
+        try:
+            return res.json()
+        except ValueError as e:
+            raise RemoteSimulatorError('invalid json response', endpoint, res.status_code) from e
+
+    def latency_stats(self):
+        """
+        Request counters of each endpoint, times are wall clock seconds including retries and backoff
+        :return: dictionary of calls, retries, errors, total, mean and max time per endpoint
+        """
+        return {endpoint: dict(c, mean=c['total'] / c['calls']) for endpoint, c in self.latency.items()}
+
+    def _rate_changes(self, action, player_name):
+        """
+        Build the body of a change_transitions/ request
+        :param action: Player's rate updates
+        :param player_name: player to update
+        :return: json update object with the new rates and the cost of the update
+        """
         current_rates = list(self.net.get_controlled_rates(player_name).values())
         update_cost = float(self.c_change(np.array(action), np.array(current_rates)))
 
@@ -43,43 +214,61 @@ class PnpscRemoteEnv(PnpscEnv):
 
         # Build the json update object
         costs = [{'name': player_name, 'transition_change_cost': update_cost}]
-        data = {'players': costs, 'transitions': updates}
+        return {'players': costs, 'transitions': updates}
 
+    def _apply_changes(self, res, data):
+        """
+        Check the simulator applied a rate update and apply it to the net, as the simulator does not report rates
+        :param res: response of the change_transitions/ request
+        :param data: json update object of the request
+        """
+        if not self._json(res, 'change_transitions/').get('changes_made'):
+            raise RemoteSimulatorError('rates were not updated', 'change_transitions/', res.status_code)
+        for t in data['transitions']:
+            self.net.rates[t['name']] = t['rate']
+
+    def _update_simulator(self, action, player_name):
+        """
+        Perform a transition rate update and step the simulator one step
+        :param action: Player's rate updates
+        :return: Next observation and reward from the environment
+        """
         # Send the update request
-        res = requests.post(self.sim_url + 'change_transitions/', json=data, headers=headers)
-        if res.status_code != 200 or not res.json()['changes_made']:
-            print('error updating rates')
+        data = self._rate_changes(action, player_name)
+        res = self._request('POST', 'change_transitions/', json=data)
+        self._apply_changes(res, data)
 
     def _step_simulator(self):
         """
         Step the simulator
         """
-        res = requests.get(self.sim_url + 'step/')
-        if res.status_code != 200:
-            print('error stepping net', res.json())
+        res = self._request('GET', 'step/')
 
         # Parse the results
-        self.net.update_net(res.json())
+        self.net.update_net(self._json(res, 'step/'))
 
     def _reset_simulator(self):
         """
         Reset the simulator
         """
         # Delete the old PNPSC net definition
-        res = requests.get(self.sim_url + 'delete/')
-        if res.status_code != 200:
-            print('failed deleting net', res)
+        self._request('GET', 'delete/', idempotent=True)
 
-        headers = {'Content-type': 'application/json', 'Accept': 'application/json'}
-
-        # Upload the provided PNPSC net definition
-        res = requests.post(self.sim_url + 'uploadpetrinet/', json=self.net.get_json(), headers=headers)
-        if res.status_code != 200:
-            print('failed uploading net', res)
+        # Upload the provided PNPSC net definition, uploading it again replaces the simulator
+        self._request('POST', 'uploadpetrinet/', json=self.net.get_json(), idempotent=True)
 
         # Get the initial state from the simulator
-        res = requests.get(self.sim_url + 'status/')
-        self.net.update_net(res.json())
+        res = self._request('GET', 'status/', idempotent=True)
+        # the simulator does not report the rates, restore the rates changed in the last episode
+        self.net.reset()
+        self.net.update_net(self._json(res, 'status/'))
+
+    def close(self):
+        """
+        Close the connections of the session opened by the environment
+        """
+        if self.owns_session:
+            self.session.close()
 
     def render(self):
         pass
@@ -0,0 +1,234 @@
+import multiprocessing as mp
+import os
+
+import gym
+import gymnasium
+import numpy as np
+from stable_baselines3.common.vec_env import VecEnv
+
+from ..simulator.rng import draw_seed
+
+
+def _to_gymnasium(space):
+    """
+    Convert a gym space to the equivalent gymnasium space expected by stable baselines
+    :param space: gym Box or Discrete space
+    :return: gymnasium space
+    """
+    if isinstance(space, gym.spaces.Discrete):
+        return gymnasium.spaces.Discrete(int(space.n))
+    assert isinstance(space, gym.spaces.Box), 'only Box and Discrete spaces are supported'
+    return gymnasium.spaces.Box(low=space.low, high=space.high, shape=space.shape, dtype=space.dtype)
+
+
+def _shared_array(ctx, shape, dtype):
+    """
+    Allocate an array in shared memory that forked workers write to in place
+    :param ctx: multiprocessing context
+    :param shape: array shape
+    :param dtype: array dtype
+    :return: numpy array backed by the shared memory
+    """
+    dtype = np.dtype(dtype)
+    size = int(np.prod(shape))
+    buffer = ctx.RawArray('b', max(1, size * dtype.itemsize))
+    return np.frombuffer(buffer, dtype=dtype, count=size).reshape(shape)
+
+
+def _worker(conn, envs, rows, buffers, seed):
+    """
+    Worker process loop, steps a block of environments and writes their results into the shared buffers
+    :param conn: pipe to the parent, carrying the commands and small replies only
+    :param envs: environments of this worker, inherited from the parent
+    :param rows: row of each environment in the shared buffers
+    :param buffers: shared actions, observations, terminal observations, rewards and dones
+    :param seed: SeedSequence for the global random state of this worker
+    """
+    actions, observations, terminal, rewards, dones = buffers
+    # forked workers start with a copy of the parent's global random state, give each its own stream
+    np.random.seed(seed.generate_state(4))
+    while True:
+        cmd, data = conn.recv()
+        if cmd == 'close':
+            for env in envs:
+                env.close()
+            conn.send((None, None))
+            break
+        try:
+            result = None
+            if cmd == 'step':
+                for i, env in zip(rows, envs):
+                    obs, reward, done, _ = env.step(actions[i])
+                    if done:
+                        terminal[i] = obs
+                        obs = env.reset()
+                    observations[i], rewards[i], dones[i] = obs, reward, done
+            elif cmd == 'reset':
+                for i, env, seed in zip(rows, envs, data):
+                    if seed is not None:
+                        env.seed(seed)
+                    observations[i] = env.reset()
+            elif cmd == 'get_attr':
+                name, indices = data
+                result = [getattr(envs[k], name) for k in indices]
+            elif cmd == 'set_attr':
+                name, indices, value = data
+                for k in indices:
+                    setattr(envs[k], name, value)
+            elif cmd == 'env_method':
+                name, indices, args, kwargs = data
+                result = [getattr(envs[k], name)(*args, **kwargs) for k in indices]
+            elif cmd == 'is_wrapped':
+                wrapper_class, indices = data
+                result = [isinstance(envs[k], wrapper_class) for k in indices]
+            else:
+                raise ValueError('unknown command ' + str(cmd))
+            conn.send((result, None))
+        except Exception as e:
+            conn.send((None, e))
+    conn.close()
+
+
+class PnpscSubprocVecEnv(VecEnv):
+    """
+    Vectorized environment that steps PNPSC environments in worker processes, for configurations the lockstep
+    environment cannot batch such as opponent agents acting in _post_step.
+    The environments are created in the parent, then the workers are forked so they share the parsed nets and agents
+    copy on write. Each worker owns a block of environments and writes their observations, rewards and dones into
+    arrays in shared memory sized from the spaces, the pipes only carry the commands.
+    Finished environments are reset automatically and their last observation is returned in the info under
+    'terminal_observation', the infos returned by the environments are not forwarded.
+    """
+    def __init__(self, env_fns, num_workers=None, start_method='fork'):
+        """
+        :param env_fns: functions that create the environments, called in the parent process
+        :param num_workers: number of worker processes, defaults to the number of CPUs
+        :param start_method: multiprocessing start method, the environments are passed to the workers without
+            pickling only with 'fork'
+        """
+        envs = [env_fn() for env_fn in env_fns]
+        num_envs = len(envs)
+        num_workers = min(num_envs, num_workers if num_workers is not None else os.cpu_count())
+        observation_space = _to_gymnasium(envs[0].observation_space)
+        action_space = _to_gymnasium(envs[0].action_space)
+
+        ctx = mp.get_context(start_method)
+        self.actions = _shared_array(ctx, (num_envs,) + action_space.shape, action_space.dtype)
+        self.observations = _shared_array(ctx, (num_envs,) + observation_space.shape, observation_space.dtype)
+        self.terminal = _shared_array(ctx, (num_envs,) + observation_space.shape, observation_space.dtype)
+        self.rewards = _shared_array(ctx, (num_envs,), np.float32)
+        self.dones = _shared_array(ctx, (num_envs,), bool)
+        buffers = (self.actions, self.observations, self.terminal, self.rewards, self.dones)
+
+        # contiguous blocks of environments, worker w holds rows blocks[w]
+        self.blocks = np.array_split(np.arange(num_envs), num_workers)
+        self.starts = np.array([rows[0] for rows in self.blocks])
+        seeds = np.random.SeedSequence(draw_seed(np.random)).spawn(num_workers)
+        self.remotes, self.processes = [], []
+        for rows, seed in zip(self.blocks, seeds):
+            remote, work_remote = ctx.Pipe()
+            process = ctx.Process(target=_worker, args=(work_remote, [envs[i] for i in rows], rows, buffers, seed),
+                                  daemon=True)
+            process.start()
+            work_remote.close()
+            self.remotes.append(remote)
+            self.processes.append(process)
+        self.closed = False
+
+        self.render_mode = None
+        super().__init__(num_envs, observation_space, action_space)
+
+    def _send(self, cmd, data=None, workers=None):
+        """
+        Send a command to a set of workers and wait for all of them to finish
+        :param cmd: command name
+        :param data: command data for each worker
+        :param workers: indices of the workers, defaults to all
+        :return: the reply of each worker
+        """
+        workers = range(len(self.remotes)) if workers is None else workers
+        for w in workers:
+            self.remotes[w].send((cmd, data[w] if data is not None else None))
+        results, error = [], None
+        for w in workers:
+            result, e = self.remotes[w].recv()
+            results.append(result)
+            error = error or e
+        if error is not None:
+            raise error
+        return results
+
+    def _call(self, cmd, indices, *data):
+        """
+        Run a command on a set of environments, grouped by the worker that holds them
+        :param cmd: command name
+        :param indices: environment indices, None for all
+        :param data: command data, the local indices of the environments on each worker are inserted after the first
+            item
+        :return: the results in the order of the indices
+        """
+        owners = []
+        groups = {}
+        for i in self._get_indices(indices):
+            w = int(np.searchsorted(self.starts, i, side='right')) - 1
+            owners.append(w)
+            groups.setdefault(w, []).append(i - self.starts[w])
+        workers = list(groups)
+        results = self._send(cmd, {w: (data[0], groups[w]) + data[1:] for w in workers}, workers)
+        results = {w: iter(r) for w, r in zip(workers, results) if r is not None}
+        return [next(results[w]) for w in owners] if results else None
+
+    def reset(self):
+        """
+        Reset all the environments, seeds set with seed() are passed to the environments
+        :return: matrix of initial observations
+        """
+        self._send('reset', [[self._seeds[i] for i in rows] for rows in self.blocks])
+        self._reset_seeds()
+        return self.observations.copy()
+
+    def step_async(self, actions):
+        self.actions[:] = np.reshape(actions, self.actions.shape)
+        for remote in self.remotes:
+            remote.send(('step', None))
+
+    def step_wait(self):
+        """
+        Wait for the workers to step their environments
+        :return: observations, rewards, dones and infos of the environments
+        """
+        error = None
+        for remote in self.remotes:
+            error = error or remote.recv()[1]
+        if error is not None:
+            raise error
+        dones = self.dones.copy()
+        infos = [{} for _ in range(self.num_envs)]
+        for i in np.flatnonzero(dones):
+            infos[i]['terminal_observation'] = self.terminal[i].copy()
+        return self.observations.copy(), self.rewards.copy(), dones, infos
+
+    def close(self):
+        """
+        Stop the worker processes
+        """
+        if self.closed:
+            return
+        self._send('close')
+        for process in self.processes:
+            process.join()
+        for remote in self.remotes:
+            remote.close()
+        self.closed = True
+
+    def get_attr(self, attr_name, indices=None):
+        return self._call('get_attr', indices, attr_name)
+
+    def set_attr(self, attr_name, value, indices=None):
+        self._call('set_attr', indices, attr_name, value)
+
+    def env_method(self, method_name, *method_args, indices=None, **method_kwargs):
+        return self._call('env_method', indices, method_name, method_args, method_kwargs)
+
+    def env_is_wrapped(self, wrapper_class, indices=None):
+        return self._call('is_wrapped', indices, wrapper_class)
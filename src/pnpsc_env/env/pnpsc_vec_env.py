@@ -1,15 +1,70 @@
+import os
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
 import gym
 import numpy as np
+import scipy.stats
 
+from .baseline_cache import BaselineCache
+from .baseline_store import BaselineStore
 from .pnpsc_env import PnpscEnv
 from .pnpsc_local_env import PnpscLocalEnv
+from ..simulator.batch_kernel import make_batch_kernel
+from ..simulator.exact_evaluator import ExactEvaluator, MAX_STATES
+from ..simulator.rng import draw_seed, get_state, make_rng, set_state, spawn
+
+# Sampling methods, draw a firing time for every transition or draw the fired transition directly from the rates
+SAMPLERS = ('race', 'direct')
+# Fraction of the available memory the automatic chunk size lets one chunk of executions use
+CHUNK_MEMORY_FRACTION = 0.25
+# Working set of one chunk for the automatic chunk size, larger chunks fall out of the CPU caches and run slower
+CHUNK_WORKING_SET = 32 << 20
+# Memory assumed to be available when the platform cannot report it
+DEFAULT_AVAILABLE_MEMORY = 1 << 30
+# Multiplier used to spread the counters hashed into the common random number streams
+_GOLDEN = np.uint64(0x9E3779B97F4A7C15)
+# Estimate the mean future reward by simulating the batch or by solving the absorbing Markov chain of the net
+BASELINES = ('monte_carlo', 'exact')
+
+# State of an episode returned by PnpscVecEnv.snapshot()
+VecEnvState = namedtuple('VecEnvState', ['places', 'rates', 't', 'last_mean_reward', 'crn_seed', 'rng'])
+
+
+def _available_memory():
+    """
+    Physical memory currently available, from sysconf where the platform provides it
+    :return: bytes of available memory
+    """
+    try:
+        return os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+    except (AttributeError, ValueError, OSError):
+        return DEFAULT_AVAILABLE_MEMORY
+
+
+def _splitmix64(x):
+    """
+    Hash 64 bit counters into 64 bit random values, the output function of the SplitMix64 generator
+    :param x: uint64 array
+    :return: uint64 array
+    """
+    # arithmetic is modulo 2 ** 64
+    with np.errstate(over='ignore'):
+        x = x + _GOLDEN
+        x = (x ^ (x >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+        x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return x ^ (x >> np.uint64(31))
 
 
 # TODO specialize for 1 env
 class PnpscVecEnv(PnpscEnv):
 
     def __init__(self, player_name, net_path, max_tokens=10, max_rate=10,
-                 num_envs=1):
+                 num_envs=1, sampler='race', compact_threshold=0.9, backend='auto', compact_state=False,
+                 baseline='monte_carlo', max_states=MAX_STATES, cache_size=0, rate_decimals=None, refine_samples=0,
+                 store_path=None, store_samples=None, common_random_numbers=False, antithetic=False,
+                 target_half_width=None, confidence=0.95, min_samples=None, max_samples=None, chunk_size='auto',
+                 num_threads=1, seed=None):
         """
         Create a wrapper for the PNPNSC simulator
         :param player_name: Name of the agent player, must match one of the players in the PNPSC net definition
@@ -17,10 +72,61 @@ class PnpscVecEnv(PnpscEnv):
         :param max_tokens: Maximum expected tokens at any place
         :param max_rate: Maximum expected rate for any transition
         :param num_envs: Number of parallel executions in each step
+        :param sampler: 'race' draws an exponential firing time for every transition, 'direct' uses the Gillespie
+            direct method and draws the fired transition with probability proportional to its rate
+        :param compact_threshold: Drop finished executions from the batch once the fraction still running falls
+            below this value, 0 never compacts and 1 compacts as soon as any execution finishes
+        :param backend: Net operations use dense place x transition masks ('dense'), gathers over the arcs of the net
+            ('sparse'), or 'auto' to pick sparse for nets with a low arc density
+        :param compact_state: Store markings in the smallest unsigned integer type that holds max_tokens and more
+            than the initial marking, and rates as float32, reducing the memory and bandwidth of large batches. A
+            marking that reaches the largest value of the integer type raises an OverflowError
+        :param baseline: 'monte_carlo' estimates the mean future reward from simulated executions, 'exact'
+            solves for the expected reward over the reachable markings and falls back to monte carlo when there are
+            more than max_states of them
+        :param max_states: Bound on the number of reachable markings explored by the exact baseline
+        :param cache_size: Number of baselines kept in a least recently used cache keyed by marking and rates, 0
+            disables the cache
+        :param rate_decimals: Round rates to this many decimals in the cache and store keys, None uses the exact rates
+        :param refine_samples: On a cache hit, simulate another batch and pool it into the cached estimate until it is
+            based on at least this many samples, 0 returns cached estimates as they are
+        :param store_path: Path of a SQLite database shared by runs and processes that pools the monte carlo baselines
+            of this net, None does not store them
+        :param store_samples: Stored baselines with at least this many samples are used without simulating, defaults
+            to num_envs
+        :param common_random_numbers: Drive every baseline of an episode with the same seeded random streams, so the
+            difference between consecutive baselines has a much lower variance. Each execution fires transitions with
+            the modified next reaction method, where the k-th firing of a transition always uses the same
+            exponential draw, whatever the sampler
+        :param antithetic: Pair the executions so the second half of the batch uses 1 - u for the uniforms u of the
+            first half
+        :param target_half_width: Run batches of num_envs executions until the confidence interval of the mean reward
+            is narrower than this half width, None always runs a single batch
+        :param confidence: Confidence level of the interval used with target_half_width
+        :param min_samples: Least number of executions before stopping early, defaults to num_envs
+        :param max_samples: Most number of executions for one baseline, defaults to 100 * num_envs
+        :param chunk_size: Run the num_envs executions of a batch in chunks of at most this many, so memory does not
+            grow with num_envs. 'auto' sizes the chunks to fit the CPU caches and a fraction of the available memory
+        :param num_threads: Run the chunks of a batch on this many threads, each with its own kernel and random
+            generator spawned from the random generator of the environment, so results are reproducible for a given
+            seed and number of threads
+        :param seed: seed or Generator of the simulation, None draws from the global np.random state
         """
-        super().__init__(player_name, net_path, max_tokens, max_rate)
+        super().__init__(player_name, net_path, max_tokens, max_rate, seed)
+        assert sampler in SAMPLERS, 'sampler must be one of ' + str(SAMPLERS)
+        assert baseline in BASELINES, 'baseline must be one of ' + str(BASELINES)
         self.penalty = None
         self.num_envs = num_envs
+        self.sampler = sampler
+        self.compact_threshold = compact_threshold
+        self.compact_state = compact_state
+        self.baseline = baseline
+        if compact_state:
+            self.place_dtype = np.min_scalar_type(max(max_tokens, int(self.net.initial_places.max(initial=0)) + 1))
+            self.rate_dtype = np.dtype(np.float32)
+        else:
+            self.place_dtype = None
+            self.rate_dtype = None
         self.net_path = net_path
 
         self.other_players = []
@@ -64,34 +170,36 @@ class PnpscVecEnv(PnpscEnv):
 
         self.t = 0
 
-        self.places = np.array([p for p in list(self.net.get_all_places().values())])
-        self.rates = np.array([r for r in list(self.net.get_all_rates().values())])
-
-        # build matrix for graph operations
-        enabled_mask = []
-        inhibitor_mask = []
-        input_mask = []
-        output_mask = []
-        control_rates = []
-
-        places_names = self.net.get_all_places().keys()
-        for t in sorted(self.net.json['transitions'], key=lambda x: x['name']):
-            input_places = t['input'].split(',')
-            output_places = t['output'].split(',')
-            inhibitor_places = t['inhibitor'].split(',')
-            cr = {r2[0]: float(r2[1]) for r2 in [r.split('=') for r in t['control_rate'].split(',')] if len(r2) > 1}
-            enabled_mask.append([1 if p in input_places else 0 for p in places_names])
-            inhibitor_mask.append([1 if p in inhibitor_places else 0 for p in places_names])
-            input_mask.append([1 if p in input_places else 0 for p in places_names])
-            output_mask.append([1 if p in output_places else 0 for p in places_names])
-            control_rates.append([cr[p] if p in cr else 0 for p in places_names])
-
-        self.enabled_mask = np.array(enabled_mask).T
-        self.inhibitor_mask = np.array(inhibitor_mask).T
-        self.num_in_transitions = np.sum(self.enabled_mask, 0)
-        self.input_mask = np.array(input_mask)
-        self.output_mask = np.array(output_mask)
-        self.control_rates = np.array(control_rates).T
+        self.places = self._to_places(self.net.initial_places)
+        self.rates = np.array(self.net.initial_rates, dtype=self.rate_dtype)
+
+        # build the kernel for batched net operations
+        self.compiled = self.net.compiled
+        self.kernel = make_batch_kernel(self.compiled, backend, float if self.rate_dtype is None else self.rate_dtype)
+        # kernels hold scratch buffers so each thread gets its own
+        self.num_threads = num_threads
+        self.kernels = [self.kernel] + [make_batch_kernel(self.compiled, self.kernel.backend, self.kernel.rate_dtype)
+                                        for _ in range(num_threads - 1)]
+        self._pool = ThreadPoolExecutor(num_threads) if num_threads > 1 else None
+        self.evaluator = ExactEvaluator(self.compiled, self.goal_places, self.end_places, max_states, backend) \
+            if baseline == 'exact' else None
+        self.cache = BaselineCache(cache_size, rate_decimals) if cache_size > 0 else None
+        self.refine_samples = refine_samples
+        self.store = BaselineStore(store_path, self.net.json, rate_decimals=rate_decimals) \
+            if store_path is not None else None
+        self.store_samples = num_envs if store_samples is None else store_samples
+        self.common_random_numbers = common_random_numbers
+        self.antithetic = antithetic
+        self.crn_seed = draw_seed(self.rng) if common_random_numbers else None
+        self.target_half_width = target_half_width
+        # two sided normal quantile of the confidence level
+        self.z = scipy.stats.norm.ppf(0.5 + confidence / 2)
+        self.min_samples = num_envs if min_samples is None else min_samples
+        self.max_samples = 100 * num_envs if max_samples is None else max_samples
+        self.chunk_size = self._auto_chunk_size() if chunk_size == 'auto' else min(chunk_size, num_envs)
+        # executions simulated by the last baseline and by all baselines
+        self.last_samples = 0
+        self.total_samples = 0
 
         self.last_mean_reward = None
 
@@ -101,12 +209,207 @@ class PnpscVecEnv(PnpscEnv):
     def render(self):
         pass
 
+    def close(self):
+        """
+        Stop the worker threads and close the baseline store
+        """
+        if self._pool is not None:
+            self._pool.shutdown()
+        if self.store is not None:
+            self.store.close()
+
     def _step_simulator(self):
         pass
 
     def _update_simulator(self, action, player_name):
         pass
 
+    def _sample_direct(self, rates, u=None, kernel=None, rng=None):
+        """
+        Select the transition to fire in each row with the Gillespie direct method, using a single uniform draw per
+        row against the cumulative rates. Rows with a total rate of 0 select transition 0 and must be masked.
+        :param rates: matrix of effective rates, one row per execution
+        :param u: column of uniforms to use, drawn from rng if None
+        :param kernel: kernel whose scratch buffers are used, defaults to the kernel of the environment
+        :param rng: random generator, defaults to the generator of the environment
+        :return: index of the selected transition for each row
+        """
+        cum_rates = (self.kernel if kernel is None else kernel)._buffer('cum_rates', rates.shape, rates.dtype)
+        np.cumsum(rates, axis=1, out=cum_rates)
+        if u is None:
+            u = (self.rng if rng is None else rng).random((rates.shape[0], 1))
+        u = u * cum_rates[:, -1:]
+        return np.argmax(cum_rates > u, axis=1)
+
+    def _auto_chunk_size(self):
+        """
+        Largest chunk of executions whose markings, clocks and kernel scratch buffers fit the working set and memory
+        budgets
+        :return: number of executions in a chunk
+        """
+        p, t = self.compiled.num_places, self.compiled.num_transitions
+        arcs = len(self.compiled.input_place) + len(self.compiled.inhibitor_place) + \
+            sum(len(cr) for cr in self.compiled.control_rates)
+        place_size = np.dtype(self.place_dtype if self.place_dtype is not None else int).itemsize
+        # marking and its flags, a handful of rate sized temporaries, gathered arcs, and the next reaction clocks
+        per_execution = p * (place_size + 5) + t * 48 + arcs * 9 + (t * 24 if self.common_random_numbers else 0)
+        budget = min(CHUNK_WORKING_SET, CHUNK_MEMORY_FRACTION * _available_memory() / self.num_threads)
+        # at least one chunk for every thread
+        return int(max(1, min(-(-self.num_envs // self.num_threads), budget // per_execution)))
+
+    def _antithetic_uniforms(self, rows, width, size, rng):
+        """
+        Uniforms for one iteration of the chunk where the second half of the executions uses 1 - u
+        :param rows: executions still in the chunk
+        :param width: number of uniforms for each execution
+        :param size: number of executions in the chunk
+        :param rng: random generator
+        :return: matrix of uniforms for the rows
+        """
+        u = rng.random(((size + 1) // 2, width))
+        return np.concatenate([u, 1 - u])[:size][rows]
+
+    def _unit_exponentials(self, streams, flips, transitions, counts):
+        """
+        Common random numbers for the modified next reaction method, a unit exponential for each firing of each
+        transition in each execution, fixed by the episode seed
+        :param streams: random stream of each execution, numbered across the chunks of a baseline
+        :param flips: use 1 - u for the antithetic executions
+        :param transitions: transition indices
+        :param counts: number of earlier firings of the transitions
+        :return: array of unit exponentials
+        """
+        # hash the seed first, xor of a small seed with the rows would only permute the rows between seeds
+        h = _splitmix64(_splitmix64(np.uint64(self.crn_seed)) ^ np.asarray(streams, dtype=np.uint64))
+        h = _splitmix64(h ^ np.asarray(transitions, dtype=np.uint64))
+        h = _splitmix64(h ^ np.asarray(counts, dtype=np.uint64))
+        # 53 random bits centred in their interval so u is never 0 or 1
+        u = ((h >> np.uint64(11)).astype(float) + 0.5) * 2.0 ** -53
+        return -np.log(np.where(flips, 1 - u, u))
+
+    def _next_reaction(self, rates, streams, flips, clocks):
+        """
+        Select the transition to fire in each row with the modified next reaction method. Each transition advances an
+        internal clock at its rate and fires when the clock reaches its next unit exponential jump.
+        :param rates: matrix of effective rates, one row per execution
+        :param streams: random stream of each row
+        :param flips: antithetic flag of each row
+        :param clocks: internal clocks, next jumps and firing counts of the executions, updated in place. The next jump
+            of a transition that has fired k times uses the exponential for counter k
+        :return: index of the selected transition for each row and column of flags for the rows that fire
+        """
+        internal, next_jump, counts = clocks
+        with np.errstate(divide='ignore', invalid='ignore'):
+            wait = (next_jump - internal) / rates
+        wait[rates == 0] = np.inf
+        j = np.argmin(wait, axis=1)
+        r = np.arange(len(j))
+        dt = wait[r, j]
+        fired = np.isfinite(dt)
+        internal += rates * np.where(fired, dt, 0)[:, np.newaxis]
+
+        r, j_fired = r[fired], j[fired]
+        # set the clock of the fired transition exactly to avoid drift from rounding
+        internal[r, j_fired] = next_jump[r, j_fired]
+        counts[r, j_fired] += 1
+        next_jump[r, j_fired] += self._unit_exponentials(streams[r], flips[r], j_fired, counts[r, j_fired])
+        return j, fired.reshape(-1, 1)
+
+    def _check_overflow(self, places, bound=None):
+        """
+        Raise once a compact marking reaches the largest value of its type, before a later firing wraps it
+        :param places: marking vector or matrix
+        :param bound: bound on the largest count before the last firing, the places are only scanned once it could
+            reach the largest value, None always scans them
+        :return: bound on the largest count after the last firing
+        """
+        if not self.compact_state:
+            return bound
+        # the places of a transition's arcs are unique, so a firing adds at most one token to any place
+        if bound is not None and bound + 1 < np.iinfo(self.place_dtype).max:
+            return bound + 1
+        bound = int(places.max(initial=0))
+        if bound >= np.iinfo(self.place_dtype).max:
+            raise OverflowError('marking reached the largest ' + str(self.place_dtype) + ' value, increase max_tokens '
+                                'or disable compact_state')
+        return bound
+
+    def _to_places(self, places):
+        """
+        Convert a marking to the place dtype, compact markings the type cannot hold raise instead of wrapping
+        :param places: marking
+        :return: marking array
+        """
+        places = np.asarray(places)
+        if self.compact_state:
+            self._check_overflow(places)
+        return np.array(places, dtype=self.place_dtype)
+
+    def _opponent_rates(self, rates):
+        """
+        Apply the evaluated opponent strategies to the rates
+        :param rates: current rates
+        :return: array of rates
+        """
+        rates = np.array(rates, dtype=self.rate_dtype)
+        for i, k in enumerate(self.net.get_all_rates()):
+            if k in self.other_strategies:
+                rates[i] = self.other_strategies[k]
+        return rates
+
+    def _mean_reward(self, places, rates):
+        """
+        Mean reward of running the current net definition to completion (with no further action by any players)
+        :param places: current marking
+        :param rates: current rates
+        :return: the mean reward
+        """
+        self.last_samples = 0
+        if self.cache is not None:
+            key = self.cache.key(places, rates)
+            entry = self.cache.get(key)
+            if entry is not None:
+                mean, samples = entry
+                if samples >= self.refine_samples:
+                    return mean
+                if self.store is None:
+                    mean = self._run_batch_until_complete(places, rates)
+                    return self.cache.pool(key, mean, self.last_samples)
+                # the stored estimate already pools every batch, so it replaces the cached one
+                mean, samples = self._monte_carlo(places, rates, refine=True)
+                self.cache.put(key, mean, samples)
+                return mean
+
+        reward = self.evaluator.evaluate(places, self._opponent_rates(rates)) if self.evaluator is not None else None
+        # exact baselines are stored with infinite samples so they are never refined
+        samples = np.inf
+        if reward is None:
+            reward, samples = self._monte_carlo(places, rates)
+
+        if self.cache is not None:
+            self.cache.put(key, reward, samples)
+        return reward
+
+    def _monte_carlo(self, places, rates, refine=False):
+        """
+        Monte carlo estimate of the mean reward, pooled with the baseline store when there is one
+        :param places: current marking
+        :param rates: current rates
+        :param refine: simulate another batch even if the stored estimate has enough samples
+        :return: the mean reward and the number of samples it is based on
+        """
+        if self.store is None:
+            return self._run_batch_until_complete(places, rates), self.last_samples
+        if not refine:
+            entry = self.store.get(places, rates, self.other_strategies)
+            if entry is not None and entry[0] >= self.store_samples:
+                return entry[1], entry[0]
+        total, total_sq, samples = self._run_sequential(places, rates)
+        mean = total / samples
+        samples, mean, _ = self.store.add(places, rates, self.other_strategies, samples, mean,
+                                          max(0.0, total_sq - total * mean))
+        return mean, samples
+
     #@cache
     def _run_batch_until_complete(self, places, rates):
         """
@@ -115,34 +418,141 @@ class PnpscVecEnv(PnpscEnv):
         :param rates: current rates
         :return: the mean reward
         """
-        places = np.repeat(np.array(places)[:, np.newaxis], self.num_envs, axis=1).T
-        rates = np.array(rates)
+        total, _, samples = self._run_sequential(places, rates)
+        return total / samples
 
-        # apply opponent strategy
-        for i, k in enumerate(self.net.get_all_rates()):
-            if k in self.other_strategies:
-                rates[i] = self.other_strategies[k]
-        rewards = np.zeros(self.num_envs).reshape(-1, 1)
-
-        dones = [False]
-        while not all(dones):
-            enabled = np.matmul(np.clip(places, 0, 1), self.enabled_mask) // self.num_in_transitions
-            enabled &= np.invert(np.matmul(np.clip(places, 0, 1), self.inhibitor_mask))
+    def _run_sequential(self, places, rates):
+        """
+        Run batches of executions until the confidence interval of the mean reward reaches the target half width,
+        or a single batch without a target
+        :param places: current marking
+        :param rates: current rates
+        :return: sum of the rewards, sum of the squared rewards and number of executions
+        """
+        total, total_sq, samples = 0, 0, 0
+        while True:
+            batch, batch_sq = self._run_chunks(places, rates, samples)
+            total, total_sq = total + batch, total_sq + batch_sq
+            samples += self.num_envs
+            if self.target_half_width is None or samples >= self.max_samples:
+                break
+            if samples >= self.min_samples:
+                variance = max(0.0, (total_sq - total * total / samples) / max(1, samples - 1))
+                if self.z * np.sqrt(variance / samples) <= self.target_half_width:
+                    break
+        self.last_samples = samples
+        self.total_samples += samples
+        return total, total_sq, samples
+
+    def _run_chunks(self, places, rates, offset):
+        """
+        Stream a batch of num_envs executions through chunks of bounded size, spread over the threads
+        :param places: current marking
+        :param rates: current rates
+        :param offset: number of executions in earlier batches of the same baseline
+        :return: sum of the rewards and sum of the squared rewards of the executions
+        """
+        chunks = [(offset + start, min(self.chunk_size, self.num_envs - start))
+                  for start in range(0, self.num_envs, self.chunk_size)]
+        if self._pool is None:
+            return self._run_worker(places, rates, chunks, self.kernel, self.rng)
+
+        # chunk k runs on thread k % num_threads with that thread's kernel and random stream, and the sums are merged
+        # in thread order, so the result only depends on the seed and the number of threads
+        rngs = spawn(self.rng, self.num_threads)
+        futures = [self._pool.submit(self._run_worker, places, rates, chunks[i::self.num_threads], self.kernels[i],
+                                     rngs[i]) for i in range(self.num_threads)]
+        total, total_sq = 0, 0
+        for future in futures:
+            worker, worker_sq = future.result()
+            total, total_sq = total + worker, total_sq + worker_sq
+        return total, total_sq
+
+    def _run_worker(self, places, rates, chunks, kernel, rng):
+        """
+        Run a sequence of chunks, only the reward sums are kept
+        :param places: current marking
+        :param rates: current rates
+        :param chunks: list of (offset, size) of the chunks
+        :param kernel: batch kernel used by this worker
+        :param rng: random generator used by this worker
+        :return: sum of the rewards and sum of the squared rewards of the executions
+        """
+        total, total_sq = 0, 0
+        for offset, size in chunks:
+            chunk, chunk_sq = self._run_batch(places, rates, offset, size, kernel, rng)
+            total, total_sq = total + chunk, total_sq + chunk_sq
+        return total, total_sq
 
-            temp_rates = (np.matmul(np.clip(places, 0, 1), self.control_rates) + rates) * enabled * np.invert(dones)
+    def _run_batch(self, places, rates, offset=0, size=None, kernel=None, rng=None):
+        """
+        Run a chunk of executions of the current net definition to completion
+        :param places: current marking
+        :param rates: current rates
+        :param offset: number of executions in earlier chunks of the same baseline, so common random numbers give
+            each chunk its own streams
+        :param size: number of executions, defaults to num_envs
+        :param kernel: batch kernel, defaults to the kernel of the environment
+        :param rng: random generator, defaults to the generator of the environment
+        :return: sum of the rewards and sum of the squared rewards of the executions
+        """
+        size = self.num_envs if size is None else size
+        kernel = self.kernel if kernel is None else kernel
+        rng = self.rng if rng is None else rng
+        places = np.repeat(self._to_places(places)[np.newaxis], size, axis=0)
+        # bound on the largest count of the batch, so the overflow check only runs once it could fail
+        bound = int(places.max(initial=0))
+        rates = self._opponent_rates(rates)
+        rewards = np.zeros(size).reshape(-1, 1)
+        # reward of finished executions removed from the batch
+        finished_reward = 0
+        finished_sq = 0
+
+        # executions still in the chunk, and their common random number streams with antithetic pairs sharing one
+        rows = np.arange(size)
+        flips = rows >= (size + 1) // 2 if self.antithetic else np.zeros(size, dtype=bool)
+        streams = offset + np.where(flips, rows - (size + 1) // 2, rows)
+        if self.common_random_numbers:
+            t = self.compiled.num_transitions
+            clocks = [np.zeros((size, t)),
+                      self._unit_exponentials(streams[:, np.newaxis], flips[:, np.newaxis], np.arange(t)[np.newaxis],
+                                              0),
+                      np.zeros((size, t), dtype=np.int64)]
+
+        dones = np.zeros((size, 1), dtype=bool)
+        while not np.all(dones):
+            # scratch matrix of the kernel, only valid until the next call
+            temp_rates = kernel.effective_rates(places, rates)
+            temp_rates *= np.invert(dones)
 
             # If only player transitions are enabled and they all have rate 0, we end the episode
             dones = np.invert(np.any(temp_rates, axis=1).reshape(-1, 1))
 
-            with np.errstate(divide='ignore'):
-                ft = np.random.exponential(1 / temp_rates)
-
-            j = np.argmin(ft, axis=1)
-            # selected transition to fire
-
-            all_disabled = np.invert(np.all(np.isinf(ft), axis=1).reshape(-1, 1))
-            places -= self.input_mask[j] * np.invert(dones) * all_disabled
-            places += self.output_mask[j] * np.invert(dones) * all_disabled
+            if self.common_random_numbers:
+                j, all_disabled = self._next_reaction(temp_rates, streams, flips, clocks)
+            elif self.sampler == 'direct':
+                # selected transition to fire, the holding time is not needed as only the final reward is used
+                u = self._antithetic_uniforms(rows, 1, size, rng) if self.antithetic else None
+                j = self._sample_direct(temp_rates, u, kernel, rng)
+                all_disabled = True
+            else:
+                scale = kernel._buffer('scale', temp_rates.shape, temp_rates.dtype)
+                with np.errstate(divide='ignore'):
+                    np.divide(1, temp_rates, out=scale)
+                if self.antithetic:
+                    # inverse transform of the uniforms
+                    ft = -np.log1p(-self._antithetic_uniforms(rows, temp_rates.shape[1], size, rng))
+                else:
+                    # same draws as np.random.exponential(scale) without allocating the scale matrix each iteration
+                    ft = rng.standard_exponential(temp_rates.shape)
+                ft *= scale
+
+                j = np.argmin(ft, axis=1)
+                # selected transition to fire
+
+                all_disabled = np.invert(np.all(np.isinf(ft), axis=1).reshape(-1, 1))
+            kernel.fire(places, j, np.invert(dones) & all_disabled)
+            bound = self._check_overflow(places, bound)
 
             if len(self.goal_places > 0):
                 rewards += 100 * np.clip(np.sum(np.take(places, self.goal_places, axis=1), axis=1), 0, 1).reshape(-1,
@@ -154,7 +564,17 @@ class PnpscVecEnv(PnpscEnv):
             if len(self.end_places > 0):
                 dones |= np.any(np.take(places, self.end_places, axis=1), axis=1).reshape(-1, 1)
 
-        return np.mean(rewards)
+            # compact the batch to the running executions so the slowest ones do not keep the full batch alive
+            running = np.invert(dones[:, 0])
+            if np.count_nonzero(running) < self.compact_threshold * len(running):
+                finished_reward += np.sum(rewards[dones])
+                finished_sq += np.sum(np.square(rewards[dones]))
+                places, rewards, dones, rows = places[running], rewards[running], dones[running], rows[running]
+                streams, flips = streams[running], flips[running]
+                if self.common_random_numbers:
+                    clocks = [c[running] for c in clocks]
+
+        return finished_reward + np.sum(rewards), finished_sq + np.sum(np.square(rewards))
 
     def step(self, action, step_sim=True):
         """
@@ -164,7 +584,7 @@ class PnpscVecEnv(PnpscEnv):
         :return: environment observation and reward
         """
         if self.last_mean_reward is None:
-            self.last_mean_reward = self._run_batch_until_complete(tuple(self.places), tuple(self.rates))
+            self.last_mean_reward = self._mean_reward(tuple(self.places), tuple(self.rates))
         # Update the rates if provided
         if action is not None:
             action = np.array(action)
@@ -177,25 +597,27 @@ class PnpscVecEnv(PnpscEnv):
 
         # Only step the sim if requested, used to allow multi-action players
         if step_sim:
-            enabled = np.matmul(np.clip(self.places, 0, 1), self.enabled_mask) // self.num_in_transitions
-            enabled &= np.invert(np.matmul(np.clip(self.places, 0, 1), self.inhibitor_mask))
-            # dones = np.invert(np.any(enabled))
-
-            temp_rates = (np.matmul(np.clip(self.places, 0, 1), self.control_rates) + self.rates) * enabled
+            temp_rates = self.kernel.effective_rates(self.places.reshape(1, -1), self.rates)[0]
 
             # If only player transitions are enabled and they all have rate 0, we end the episode
             done = np.invert(np.any(temp_rates))
 
-            with np.errstate(divide='ignore'):
-                ft = np.random.exponential(1 / temp_rates)
+            if self.sampler == 'direct':
+                j = self._sample_direct(temp_rates.reshape(1, -1))[0]
+                # holding time drawn from the total exit rate
+                self.t += self.rng.exponential(1 / np.sum(temp_rates)) if not done else 0
+                all_disabled = True
+            else:
+                with np.errstate(divide='ignore'):
+                    ft = self.rng.exponential(1 / temp_rates)
 
-            j = np.argmin(ft)
-            # selected transition to fire
-            self.t += np.min(ft) if not done else 0
+                j = np.argmin(ft)
+                # selected transition to fire
+                self.t += np.min(ft) if not done else 0
 
-            all_disabled = np.invert(np.all(np.isinf(ft)))
-            self.places -= self.input_mask[j] * np.invert(done) * all_disabled
-            self.places += self.output_mask[j] * np.invert(done) * all_disabled
+                all_disabled = np.invert(np.all(np.isinf(ft)))
+            self.kernel.fire(self.places.reshape(1, -1), j, np.invert(done) & all_disabled)
+            self._check_overflow(self.places)
 
             if len(self.goal_places > 0):
                 reward += 100 * np.clip(np.sum(np.take(self.places, self.goal_places)), 0, 1)
@@ -219,36 +641,61 @@ class PnpscVecEnv(PnpscEnv):
             done = False
 
         if not done:
-            current_mean_reward = self._run_batch_until_complete(tuple(self.places), tuple(self.rates))
+            current_mean_reward = self._mean_reward(tuple(self.places), tuple(self.rates))
 
             reward += current_mean_reward - self.last_mean_reward
             self.last_mean_reward = current_mean_reward
 
-        for i, k in enumerate(self.net.places.keys()):
-            self.net.places[k] = self.places[i]
-        for i, k in enumerate(self.net.rates.keys()):
-            self.net.rates[k] = self.rates[i]
+        self.net.place_values[:] = self.places
+        self.net.rate_values[:] = self.rates
 
         return self.get_observation(self.player_name), reward, done, {}
 
     def reset(self, info=False):
         """
-        Reset the environment
+        Reset the environment, use seed() to seed the episodes
         :param info: Should the debugging info be returned?
         :return: the initial observation
         """
         self.last_mean_reward = None
         self.t = 0
+        if self.common_random_numbers:
+            self.crn_seed = draw_seed(self.rng)
 
-        self.net.costs = {p: 0 for p in self.net.players}
-        self.net.places = {p['name']: p['marking'] for p in sorted(self.net.json['places'], key=lambda x: x['name'])}
-        self.net.rates = {t['name']: t['rate'] for t in sorted(self.net.json['transitions'], key=lambda x: x['name'])}
+        self.net.reset()
 
-        self.places = np.array([p for p in list(self.net.get_all_places().values())])
-        self.rates = np.array([r for r in list(self.net.get_all_rates().values())])
+        self.places = self._to_places(self.net.initial_places)
+        self.rates = np.array(self.net.initial_rates, dtype=self.rate_dtype)
 
         return self.get_observation(self.player_name)
 
+    def snapshot(self):
+        """
+        Capture the state of the episode, the baselines cached or stored so far are kept on restore
+        :return: immutable VecEnvState
+        """
+        places, rates = self.places.copy(), self.rates.copy()
+        places.setflags(write=False)
+        rates.setflags(write=False)
+        return VecEnvState(places, rates, self.t, self.last_mean_reward, self.crn_seed, get_state(self.rng))
+
+    def restore(self, state, restore_rng=True):
+        """
+        Return the episode to a snapshot
+        :param state: VecEnvState from snapshot()
+        :param restore_rng: also return the random generator to the snapshot, rollouts from the same state should
+            pass False so they draw different firing times
+        """
+        self.places[:] = state.places
+        self.rates[:] = state.rates
+        self.net.place_values[:] = state.places
+        self.net.rate_values[:] = state.rates
+        self.t = state.t
+        self.last_mean_reward = state.last_mean_reward
+        self.crn_seed = state.crn_seed
+        if restore_rng:
+            set_state(self.rng, state.rng)
+
     def get_observation(self, player_name):
         """
         Generates the observation for a player
@@ -280,6 +727,9 @@ class PnpscVecEnv(PnpscEnv):
     def update_strategies(self):
         for p in self.other_players:
             self.other_strategies.update(self._eval_strategy(p, num_runs=10_000))
+        # cached baselines were computed with the old strategies
+        if self.cache is not None:
+            self.cache.clear()
 
     def _eval_strategy(self, agent, num_runs=10_000):
         """
@@ -294,9 +744,9 @@ class PnpscVecEnv(PnpscEnv):
             if i in self.goal_places or i in self.end_places:
                 end_places.append(k)
         print("evaluating strategy for:", agent.player_name)
-        env = PnpscLocalEnv(agent.player_name, self.net_path, max_tokens=self.max_tokens)
+        env = PnpscLocalEnv(agent.player_name, self.net_path, max_tokens=self.max_tokens, seed=self.rng)
 
-        start_rates = dict.copy(env.net.rates)
+        start_rates = dict(env.net.rates)
         end_rates = {}
         for k in env.net.rates:
             end_rates[k] = []
@@ -3,38 +3,53 @@ import gym
 import numpy as np
 
 from .marking_recorder import FrozenDict
+from ..baseline_store import BaselineStore
 
 
 class MeanWrapper(gym.Wrapper):
     """
     """
-    def __init__(self, env, num_runs=100):
+    def __init__(self, env, num_runs=100, store_path=None):
         """
         DEPRECATED
         Create a wrapper for the PNPSC environment
         :param env: PNPSC environment to wrap
+        :param store_path: Path of a SQLite database that pools the mean rewards of this net across runs and processes,
+            stored means with at least num_runs samples are used without simulating
         """
         super().__init__(env)
         self.env = env
         self.num_runs = num_runs
+        self.store = BaselineStore(store_path, env.net.json) if store_path is not None else None
         self.places = None
         self.rates = None
         self.last_mean_reward = None
 
+    def _strategy(self):
+        """
+        Describe the other players for the baseline store key
+        :return: dictionary of player name to agent type
+        """
+        return {p.player_name: type(p).__name__ for p in self.env.other_players}
+
     @lru_cache(maxsize=None)
     def calc_mean_reward(self, places, rates):
+        if self.store is not None:
+            entry = self.store.get(places.values(), rates.values(), self._strategy())
+            if entry is not None and entry[0] >= self.num_runs:
+                return entry[1]
+
         rewards = []
-        costs = FrozenDict(self.env.net.costs)
+        state = self.env.snapshot()
         for i in range(self.num_runs):
             rewards.append(self.env.run_until_complete())
-            # reset net state
-            for k in self.env.net.places.keys():
-                self.env.net.places[k] = places[k]
-            #for k in self.env.net.rates.keys():
-            #    self.env.net.rates[k] = rates[k]
-            for k in self.env.net.costs.keys():
-                self.env.net.costs[k] = costs[k]
-            self.env.net.done = False
+            # return to the current state, each run draws new firing times
+            self.env.restore(state, restore_rng=False)
+
+        if self.store is not None:
+            mean = np.mean(rewards)
+            return self.store.add(places.values(), rates.values(), self._strategy(), len(rewards), mean,
+                                  np.sum(np.square(np.array(rewards) - mean)))[1]
         return np.mean(rewards)
 
     def step(self, action, step_sim=True):
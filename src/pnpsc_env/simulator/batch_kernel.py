@@ -0,0 +1,311 @@
+from abc import ABC, abstractmethod
+
+import numpy as np
+
+from .simulator import LARGE_TIME
+
+# Backends for batched net operations
+BACKENDS = ('auto', 'dense', 'sparse')
+# The auto backend uses the sparse kernel when the fraction of non zero entries in the place x transition masks is
+# below this value
+SPARSE_DENSITY = 0.1
+
+
+def _segments(transitions, num_transitions):
+    """
+    Group arcs that are sorted by transition into contiguous segments
+    :param transitions: transition index of each arc
+    :param num_transitions: number of transitions in the net
+    :return: transitions with at least one arc, the first arc of each of their segments, and the CSR index pointer
+    """
+    indptr = np.zeros(num_transitions + 1, dtype=np.intp)
+    np.cumsum(np.bincount(transitions, minlength=num_transitions), out=indptr[1:])
+    has_arcs = np.flatnonzero(np.diff(indptr))
+    return has_arcs, indptr[has_arcs], indptr
+
+
+def density(compiled):
+    """
+    Fraction of non zero entries in the place x transition masks of a net
+    :param compiled: compiled net
+    :return: arc density
+    """
+    arcs = len(compiled.input_place) + len(compiled.output_place) + len(compiled.inhibitor_place) + \
+        sum(len(cr) for cr in compiled.control_rates)
+    return arcs / max(1, compiled.num_places * compiled.num_transitions)
+
+
+def make_batch_kernel(compiled, backend='auto', rate_dtype=float):
+    """
+    Create the kernel used for batched net operations
+    :param compiled: compiled net
+    :param backend: 'dense', 'sparse' or 'auto' to pick sparse for nets with few arcs per place x transition
+    :param rate_dtype: dtype of the effective rates
+    :return: a batch kernel
+    """
+    assert backend in BACKENDS, 'backend must be one of ' + str(BACKENDS)
+    if backend == 'auto':
+        backend = 'sparse' if density(compiled) < SPARSE_DENSITY else 'dense'
+    return SparseBatchKernel(compiled, rate_dtype) if backend == 'sparse' else DenseBatchKernel(compiled, rate_dtype)
+
+
+class BatchKernel(ABC):
+    """
+    Base class for batched net operations. Markings are matrices with one row per execution and one column per
+    place, in name order. Intermediate results are written to scratch buffers that are reused across calls, so the
+    matrices returned by enabled and effective_rates are only valid until the next call of the same method.
+    """
+    def __init__(self, compiled, rate_dtype=float):
+        """
+        :param compiled: compiled net
+        :param rate_dtype: dtype of the effective rates
+        """
+        self.num_places = compiled.num_places
+        self.num_transitions = compiled.num_transitions
+        self.rate_dtype = np.dtype(rate_dtype)
+        self._buffers = {}
+
+    def _buffer(self, name, shape, dtype):
+        """
+        Returns a scratch buffer, reusing the memory of earlier calls when it is large enough
+        :param name: name of the buffer
+        :param shape: shape of the buffer
+        :param dtype: dtype of the buffer
+        :return: uninitialised array
+        """
+        size = int(np.prod(shape))
+        buffer = self._buffers.get(name)
+        if buffer is None or buffer.size < size or buffer.dtype != dtype:
+            buffer = self._buffers[name] = np.empty(size, dtype=dtype)
+        return buffer[:size].reshape(shape)
+
+    @abstractmethod
+    def enabled(self, places):
+        """
+        Enabled transitions for a batch of markings, a transition is enabled when all of its input places are marked
+        and none of its inhibitor places are marked
+        :param places: marking matrix
+        :return: boolean matrix of the enabled transitions
+        """
+        pass
+
+    @abstractmethod
+    def effective_rates(self, places, rates):
+        """
+        Effective rates of the enabled transitions for a batch of markings
+        :param places: marking matrix
+        :param rates: transition rates, shared by all executions or one row per execution
+        :return: matrix of rates including control rates, 0 for disabled transitions
+        """
+        pass
+
+    def race(self, places, rates, rng):
+        """
+        Select the next transition of each execution by an exponential race, enabled transitions with rate 0 fire
+        LARGE_TIME after the current time as in Simulator
+        :param places: marking matrix
+        :param rates: transition rates, shared by all executions or one row per execution
+        :param rng: Generator of the firing times
+        :return: index of the transition to fire in each execution, its firing time relative to the current time, and
+            the flags of the executions with an enabled transition
+        """
+        effective = self.effective_rates(places, rates)
+        enabled = self.enabled(places)
+        with np.errstate(divide='ignore'):
+            ft = rng.standard_exponential(effective.shape) / effective
+        ft[enabled & (effective == 0)] = LARGE_TIME
+        ft[~enabled] = np.inf
+        j = np.argmin(ft, axis=1)
+        return j, ft[np.arange(len(j)), j], np.any(enabled, axis=1)
+
+    @abstractmethod
+    def fire(self, places, j, running):
+        """
+        Fire one transition in each running execution, updating the markings in place
+        :param places: marking matrix
+        :param j: index of the transition fired in each execution
+        :param running: column of flags for the executions that fire
+        """
+        pass
+
+
+class DenseBatchKernel(BatchKernel):
+    """
+    Batched net operations using dense place x transition matrices.
+    The masks are float32 so the products go through BLAS, integer and boolean products fall back to much slower
+    loops. Counts and the integer control rates are exact in float32.
+    """
+    def __init__(self, compiled, rate_dtype=float):
+        """
+        :param compiled: compiled net
+        :param rate_dtype: dtype of the effective rates
+        """
+        super().__init__(compiled, rate_dtype)
+        self.backend = 'dense'
+        p, t = compiled.num_places, compiled.num_transitions
+
+        self.input_mask = np.zeros((p, t), dtype=np.float32)
+        self.input_mask[compiled.input_place, compiled.input_transition] = 1
+        self.inhibitor_mask = np.zeros((p, t), dtype=np.float32)
+        self.inhibitor_mask[compiled.inhibitor_place, compiled.inhibitor_transition] = 1
+        self.num_inputs = compiled.num_inputs.astype(np.float32)
+
+        self.control_rates = np.zeros((p, t), dtype=np.float32)
+        for transitions, places, values in compiled.control_rate_slots:
+            np.add.at(self.control_rates, (places, transitions), values)
+
+        # change in marking when each transition fires
+        self.delta = np.zeros((t, p), dtype=np.int8)
+        np.add.at(self.delta, (compiled.input_transition, compiled.input_place), -1)
+        np.add.at(self.delta, (compiled.output_transition, compiled.output_place), 1)
+
+    def _enabled(self, places):
+        """
+        Marked places and enabled transitions of a batch of markings
+        :return: float32 matrix of the marked places and boolean matrix of the enabled transitions
+        """
+        n = places.shape[0]
+        marked = self._buffer('marked', (n, self.num_places), np.float32)
+        np.greater(places, 0, out=marked)
+        counts = self._buffer('counts', (n, self.num_transitions), np.float32)
+        enabled = self._buffer('enabled', (n, self.num_transitions), bool)
+        inhibited = self._buffer('inhibited', (n, self.num_transitions), bool)
+
+        np.matmul(marked, self.input_mask, out=counts)
+        np.equal(counts, self.num_inputs, out=enabled)
+        np.matmul(marked, self.inhibitor_mask, out=counts)
+        np.logical_not(counts, out=inhibited)
+        enabled &= inhibited
+        return marked, enabled
+
+    def enabled(self, places):
+        return self._enabled(places)[1]
+
+    def effective_rates(self, places, rates):
+        n = places.shape[0]
+        marked, enabled = self._enabled(places)
+        counts = self._buffer('counts', (n, self.num_transitions), np.float32)
+
+        result = self._buffer('rates', (n, self.num_transitions), self.rate_dtype)
+        np.matmul(marked, self.control_rates, out=counts)
+        np.add(counts, rates, out=result)
+        result *= enabled
+        return result
+
+    def fire(self, places, j, running):
+        delta = self._buffer('delta', places.shape, self.delta.dtype)
+        np.take(self.delta, np.atleast_1d(j), axis=0, out=delta)
+        delta *= running
+        # unsigned markings wrap on the negative deltas, giving the same result as signed arithmetic
+        np.add(places, delta, out=places, casting='unsafe')
+
+
+class SparseBatchKernel(BatchKernel):
+    """
+    Batched net operations using index gathers over the arcs of the net, so memory and work scale with the number of
+    arcs rather than places x transitions.
+    """
+    def __init__(self, compiled, rate_dtype=float):
+        """
+        :param compiled: compiled net
+        :param rate_dtype: dtype of the effective rates
+        """
+        super().__init__(compiled, rate_dtype)
+        self.backend = 'sparse'
+
+        self.input_place = compiled.input_place
+        self.input_transitions, self.input_starts, self.input_indptr = \
+            _segments(compiled.input_transition, compiled.num_transitions)
+        self.output_place = compiled.output_place
+        _, _, self.output_indptr = _segments(compiled.output_transition, compiled.num_transitions)
+        self.inhibitor_place = compiled.inhibitor_place
+        self.inhibitor_transitions, self.inhibitor_starts, _ = \
+            _segments(compiled.inhibitor_transition, compiled.num_transitions)
+
+        self.control_rate_place = np.array([p for cr in compiled.control_rates for p, _ in cr], dtype=np.intp)
+        self.control_rate_value = np.array([r for cr in compiled.control_rates for _, r in cr], dtype=self.rate_dtype)
+        self.control_rate_transitions, self.control_rate_starts, _ = \
+            _segments(np.array([i for i, cr in enumerate(compiled.control_rates) for _ in cr], dtype=np.intp),
+                      compiled.num_transitions)
+
+    def _reduce(self, ufunc, name, marked, arc_place, starts, dtype):
+        """
+        Gather the marked flags along arcs and reduce them for each transition with at least one arc
+        :return: matrix with one column for each transition that has arcs
+        """
+        n = marked.shape[0]
+        gathered = self._buffer(name + '_gather', (n, len(arc_place)), bool)
+        np.take(marked, arc_place, axis=1, out=gathered)
+        if dtype != bool:
+            values = self._buffer(name + '_values', (n, len(arc_place)), dtype)
+            np.multiply(gathered, self.control_rate_value, out=values)
+            gathered = values
+        reduced = self._buffer(name + '_reduced', (n, len(starts)), dtype)
+        return ufunc.reduceat(gathered, starts, axis=1, out=reduced)
+
+    def _update(self, result, transitions, values, ufunc):
+        """
+        Combine per transition values into the effective rates, avoiding a fancy index when every transition
+        has arcs
+        """
+        if len(transitions) == self.num_transitions:
+            ufunc(result, values, out=result)
+        else:
+            result[:, transitions] = ufunc(result[:, transitions], values)
+
+    def enabled(self, places):
+        marked = self._buffer('marked', places.shape, bool)
+        np.greater(places, 0, out=marked)
+        result = self._buffer('enabled', (places.shape[0], self.num_transitions), bool)
+        result[:] = True
+
+        if len(self.input_place) > 0:
+            self._update(result, self.input_transitions,
+                         self._reduce(np.logical_and, 'input', marked, self.input_place, self.input_starts, bool),
+                         np.logical_and)
+        if len(self.inhibitor_place) > 0:
+            inhibited = self._reduce(np.logical_or, 'inhibitor', marked, self.inhibitor_place,
+                                     self.inhibitor_starts, bool)
+            self._update(result, self.inhibitor_transitions, np.logical_not(inhibited, out=inhibited),
+                         np.logical_and)
+        return result
+
+    def effective_rates(self, places, rates):
+        n = places.shape[0]
+        marked = self._buffer('marked', (n, self.num_places), bool)
+        np.greater(places, 0, out=marked)
+        result = self._buffer('rates', (n, self.num_transitions), self.rate_dtype)
+        result[:] = rates
+
+        if len(self.control_rate_place) > 0:
+            self._update(result, self.control_rate_transitions,
+                         self._reduce(np.add, 'control', marked, self.control_rate_place, self.control_rate_starts,
+                                      self.rate_dtype), np.add)
+        if len(self.input_place) > 0:
+            self._update(result, self.input_transitions,
+                         self._reduce(np.logical_and, 'input', marked, self.input_place, self.input_starts, bool),
+                         np.multiply)
+        if len(self.inhibitor_place) > 0:
+            inhibited = self._reduce(np.logical_or, 'inhibitor', marked, self.inhibitor_place,
+                                     self.inhibitor_starts, bool)
+            self._update(result, self.inhibitor_transitions, np.logical_not(inhibited, out=inhibited), np.multiply)
+        return result
+
+    def fire(self, places, j, running):
+        rows = np.flatnonzero(np.broadcast_to(running, (places.shape[0], 1))[:, 0])
+        j = np.broadcast_to(j, (places.shape[0],))[rows]
+        places[self._arcs(rows, j, self.input_place, self.input_indptr)] -= 1
+        places[self._arcs(rows, j, self.output_place, self.output_indptr)] += 1
+
+    @staticmethod
+    def _arcs(rows, j, arc_place, indptr):
+        """
+        Index of the places on the arcs of the fired transitions
+        :return: row and place index arrays
+        """
+        counts = indptr[j + 1] - indptr[j]
+        # index of every arc of every fired transition, built without a python loop over the rows
+        first = np.repeat(indptr[j] - (np.cumsum(counts) - counts), counts)
+        arcs = first + np.arange(first.shape[0])
+        # places are unique within the arcs of a transition so the fancy indexed update is safe
+        return np.repeat(rows, counts), arc_place[arcs]
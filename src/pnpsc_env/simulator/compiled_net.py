@@ -0,0 +1,191 @@
+import hashlib
+import json
+import os
+import threading
+
+import numpy as np
+
+# compiled nets shared by the whole process, the latest content hash and CompiledNet of each resolved path
+_registry = {}
+_registry_lock = threading.Lock()
+
+
+def _split(names):
+    """
+    Split a comma separated list of place names from the net definition, ignoring empty entries
+    :param names: comma separated place names
+    :return: list of place names in definition order without duplicates
+    """
+    result = []
+    for n in names.split(','):
+        if n != '' and n not in result:
+            result.append(n)
+    return result
+
+
+def _arcs(per_transition):
+    """
+    Flatten per transition place lists into parallel (place, transition) index arrays
+    :param per_transition: list of place index tuples, one for each transition
+    :return: place index array and transition index array
+    """
+    places = [p for ps in per_transition for p in ps]
+    transitions = [i for i, ps in enumerate(per_transition) for _ in ps]
+    return np.array(places, dtype=np.intp), np.array(transitions, dtype=np.intp)
+
+
+def compile_control_rates(control_rates):
+    """
+    Compile control rate arcs into slots that can be applied with vectorised additions.
+    Slot k holds the k-th control rate arc of every transition that has at least k + 1 arcs, so applying the slots
+    in order adds the control rates of each transition in the same order as the net definition.
+    :param control_rates: list with one list of (place index, rate) pairs for each transition
+    :return: list of (transition indices, place indices, rate values) array tuples
+    """
+    slots = []
+    for k in range(max([len(cr) for cr in control_rates], default=0)):
+        transitions = [i for i, cr in enumerate(control_rates) if len(cr) > k]
+        slots.append((np.array(transitions, dtype=np.intp),
+                      np.array([control_rates[i][k][0] for i in transitions], dtype=np.intp),
+                      np.array([control_rates[i][k][1] for i in transitions], dtype=float)))
+    return slots
+
+
+def load_net(path):
+    """
+    Load and compile a PNPSC net definition file through the process wide registry. The file is parsed once for each
+    content, later calls for the same resolved path and content return the same CompiledNet.
+    :param path: path to the PNPSC net definition
+    :return: the shared CompiledNet
+    """
+    path = os.path.realpath(path)
+    with open(path, 'rb') as f:
+        data = f.read()
+    digest = hashlib.sha256(data).hexdigest()
+    with _registry_lock:
+        entry = _registry.get(path)
+        if entry is None or entry[0] != digest:
+            entry = _registry[path] = (digest, CompiledNet(json.loads(data)))
+    return entry[1]
+
+
+class CompiledNet():
+    """
+    Integer indexed representation of the structure of a PNPSC net definition.
+    Places and transitions are indexed in name order, the same ordering used by PnpscNet for its marking and rates,
+    so the arrays built here line up with the values returned by get_all_places() and get_all_rates().
+    A CompiledNet is shared by every net, simulator and environment built from the same definition and must not be
+    modified after construction, its arrays are read only.
+    """
+    def __init__(self, json):
+        """
+        :param json: PNPSC net definition in json format
+        """
+        self.json = json
+
+        places = sorted(json['places'], key=lambda x: x['name'])
+        transitions = sorted(json['transitions'], key=lambda x: x['name'])
+
+        self.place_names = [p['name'] for p in places]
+        self.transition_names = [t['name'] for t in transitions]
+        self.place_index = {p: i for i, p in enumerate(self.place_names)}
+        self.transition_index = {t: i for i, t in enumerate(self.transition_names)}
+        self.num_places = len(self.place_names)
+        self.num_transitions = len(self.transition_names)
+
+        # per transition place indices, used when firing a single transition
+        self.inputs = []
+        self.outputs = []
+        self.inhibitors = []
+        self.control_rates = []
+        self.fire_cost = []
+        for t in transitions:
+            inhibitors = _split(t['inhibitor'])
+            # an inhibitor arc replaces an input arc between the same place and transition
+            self.inputs.append(tuple(self.place_index[p] for p in _split(t['input']) if p not in inhibitors))
+            self.outputs.append(tuple(self.place_index[p] for p in _split(t['output'])))
+            self.inhibitors.append(tuple(self.place_index[p] for p in inhibitors))
+            control_rates = []
+            for cr in t['control_rate'].split(','):
+                if cr != '':
+                    p, r = cr.split('=')
+                    control_rates.append((self.place_index[p], int(r)))
+            self.control_rates.append(control_rates)
+            self.fire_cost.append((t['player_control'], t['fire_cost']))
+
+        # initial state, the rates keep the type of the definition
+        self.initial_places = np.array([p['marking'] for p in places], dtype=np.int64)
+        self.initial_rates = np.array([t['rate'] for t in transitions])
+
+        # places observed, transitions controlled and goal places of each player
+        self.players = [p['name'] for p in json['players']]
+        self.visible_places = {}
+        self.controlled_rates = {}
+        for player in self.players:
+            self.visible_places[player] = [p['name'] for p in places if p['player_observable'] is not None and
+                                           player in p['player_observable'].split(',')]
+            self.controlled_rates[player] = [t['name'] for t in transitions if t['player_control'] == player]
+        self.visible_index = {player: np.array([self.place_index[p] for p in names], dtype=np.intp)
+                              for player, names in self.visible_places.items()}
+        self.controlled_index = {player: np.array([self.transition_index[t] for t in names], dtype=np.intp)
+                                 for player, names in self.controlled_rates.items()}
+        self.goal_places = {player: [p['name'] for p in json['places'] if p.get('goal') == player]
+                            for player in self.players}
+
+        # arc lists used for vectorised operations over all transitions
+        self.input_place, self.input_transition = _arcs(self.inputs)
+        self.output_place, self.output_transition = _arcs(self.outputs)
+        self.inhibitor_place, self.inhibitor_transition = _arcs(self.inhibitors)
+        self.num_inputs = np.bincount(self.input_transition, minlength=self.num_transitions)
+        self.control_rate_slots = compile_control_rates(self.control_rates)
+
+        arrays = [self.initial_places, self.initial_rates, self.input_place, self.input_transition,
+                  self.output_place, self.output_transition, self.inhibitor_place, self.inhibitor_transition,
+                  self.num_inputs] + list(self.visible_index.values()) + list(self.controlled_index.values()) + \
+            [a for slot in self.control_rate_slots for a in slot]
+        for a in arrays:
+            a.setflags(write=False)
+
+    def dependents(self, control_rates=None):
+        """
+        Build the place to transition dependency index. A transition depends on a place when the place is one of its
+        input, inhibitor or control rate places, so a change in the marking of the place can change whether the
+        transition is enabled or its effective rate.
+        :param control_rates: optional replacement for the control rates of the net definition
+        :return: list with a sorted array of dependent transition indices for each place
+        """
+        dependents = [set() for _ in range(self.num_places)]
+        for i in range(self.num_transitions):
+            for p in self.inputs[i] + self.inhibitors[i]:
+                dependents[p].add(i)
+            for p, _ in (self.control_rates if control_rates is None else control_rates)[i]:
+                dependents[p].add(i)
+        return [np.array(sorted(d), dtype=np.intp) for d in dependents]
+
+    def enabled(self, marking):
+        """
+        Find the enabled transitions for a marking. A transition is enabled when all of its input places are marked
+        and none of its inhibitor places are marked.
+        :param marking: array of place markings in name order
+        :return: boolean array of enabled transitions in name order
+        """
+        marked = marking > 0
+        inputs = np.bincount(self.input_transition, weights=marked[self.input_place], minlength=self.num_transitions)
+        inhibited = np.bincount(self.inhibitor_transition, weights=marked[self.inhibitor_place],
+                                minlength=self.num_transitions)
+        return (inputs == self.num_inputs) & (inhibited == 0)
+
+    def effective_rates(self, marking, rates, control_rate_slots=None):
+        """
+        Add the control rates of marked places to the transition rates
+        :param marking: array of place markings in name order
+        :param rates: array of transition rates in name order
+        :param control_rate_slots: optional replacement for the control rates of the net definition
+        :return: array of effective transition rates
+        """
+        rates = np.array(rates, dtype=float)
+        marked = marking > 0
+        for transitions, places, values in (self.control_rate_slots if control_rate_slots is None
+                                            else control_rate_slots):
+            rates[transitions] += values * marked[places]
+        return rates
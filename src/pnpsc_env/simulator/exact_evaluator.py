@@ -0,0 +1,99 @@
+import numpy as np
+import scipy.sparse
+import scipy.sparse.linalg
+
+from .batch_kernel import make_batch_kernel
+from .simulator import GOAL_REWARD
+
+# Default bound on the number of transient markings explored before giving up
+MAX_STATES = 10_000
+
+
+class ExactEvaluator():
+    """
+    Computes the expected goal reward of a net run to completion from a marking with fixed rates, by exploring the
+    reachable markings and solving the absorbing Markov chain of the embedded jump chain.
+    Each marking fires transition j with probability rate_j / sum(rates), the same choice made by the race and the
+    direct method. Markings with a goal place marked absorb with the goal reward, markings with an end place marked
+    absorb with no reward, and markings with no enabled transitions absorb with no reward.
+    """
+    def __init__(self, compiled, goal_places, end_places, max_states=MAX_STATES, backend='auto'):
+        """
+        :param compiled: compiled net
+        :param goal_places: indices of the goal places
+        :param end_places: indices of the end places
+        :param max_states: give up once more than this many transient markings are reachable
+        :param backend: backend of the batch kernel used to expand the markings
+        """
+        self.compiled = compiled
+        self.goal_places = np.asarray(goal_places, dtype=np.intp)
+        self.end_places = np.asarray(end_places, dtype=np.intp)
+        self.max_states = max_states
+        self.kernel = make_batch_kernel(compiled, backend)
+        self.num_states = 0
+
+    def _explore(self, marking, rates):
+        """
+        Breadth first search of the markings reachable from a marking, one layer of markings at a time
+        :param marking: initial marking
+        :param rates: transition rates
+        :return: transition probability matrix between transient markings and the probability of moving from each
+            transient marking into a goal marking, or None if the bound on the number of markings is exceeded
+        """
+        index = {marking.tobytes(): 0}
+        frontier = marking[np.newaxis].copy()
+        rows, cols, probs = [], [], []
+        goal = [0.0]
+
+        while len(frontier) > 0:
+            first = len(index) - len(frontier)
+            effective = self.kernel.effective_rates(frontier, rates)
+            totals = effective.sum(axis=1)
+            parents, fired = np.nonzero(effective)
+            p = effective[parents, fired] / totals[parents]
+
+            children = frontier[parents]
+            self.kernel.fire(children, fired, True)
+            at_goal = np.any(children[:, self.goal_places] > 0, axis=1) if len(self.goal_places) > 0 \
+                else np.zeros(len(children), dtype=bool)
+            at_end = np.any(children[:, self.end_places] > 0, axis=1) if len(self.end_places) > 0 \
+                else np.zeros(len(children), dtype=bool)
+
+            next_frontier = []
+            for parent, child, prob, g, e in zip((parents + first).tolist(), children, p.tolist(), at_goal.tolist(),
+                                                 at_end.tolist()):
+                if g:
+                    goal[parent] += prob
+                elif not e:
+                    key = child.tobytes()
+                    i = index.get(key)
+                    if i is None:
+                        i = index[key] = len(index)
+                        goal.append(0.0)
+                        next_frontier.append(child)
+                        if len(index) > self.max_states:
+                            return None
+                    rows.append(parent)
+                    cols.append(i)
+                    probs.append(prob)
+            frontier = np.array(next_frontier, dtype=marking.dtype).reshape(-1, len(marking))
+
+        self.num_states = len(index)
+        transitions = scipy.sparse.csr_matrix((probs, (rows, cols)), shape=(len(index), len(index)))
+        return transitions, np.array(goal)
+
+    def evaluate(self, marking, rates):
+        """
+        Expected goal reward of running the net to completion
+        :param marking: initial marking in place name order
+        :param rates: transition rates in transition name order
+        :return: the expected reward, or None if the reachable marking space exceeds max_states
+        """
+        chain = self._explore(np.array(marking, dtype=np.int64), np.array(rates, dtype=float))
+        if chain is None:
+            return None
+        transitions, goal = chain
+        # expected reward v satisfies v = P v + GOAL_REWARD * g over the transient markings
+        system = scipy.sparse.identity(transitions.shape[0], format='csc') - transitions.tocsc()
+        values = np.atleast_1d(scipy.sparse.linalg.spsolve(system, GOAL_REWARD * goal))
+        return float(values[0])
@@ -0,0 +1,148 @@
+import numpy as np
+
+
+class IndexedPriorityQueue():
+    """
+    Binary min heap over the items 0..n-1 where the key of an item already in the queue can be changed in place.
+    Ties between equal keys are broken by item index, matching np.argmin over an array of keys.
+    """
+    def __init__(self, n):
+        """
+        :param n: number of items that can be held in the queue
+        """
+        self.keys = [np.inf] * n
+        self.pos = [-1] * n
+        self.heap = []
+
+    def __len__(self):
+        return len(self.heap)
+
+    def __contains__(self, i):
+        return self.pos[i] >= 0
+
+    def clear(self):
+        """
+        Remove all items from the queue
+        """
+        for i in self.heap:
+            self.pos[i] = -1
+            self.keys[i] = np.inf
+        self.heap = []
+
+    def snapshot(self):
+        """
+        Capture the contents of the queue
+        :return: tuples of the heap and the keys
+        """
+        return tuple(self.heap), tuple(self.keys)
+
+    def restore(self, state):
+        """
+        Replace the contents of the queue with a snapshot
+        :param state: snapshot from snapshot()
+        """
+        heap, keys = state
+        self.heap = list(heap)
+        self.keys = list(keys)
+        self.pos = [-1] * len(self.keys)
+        for p, i in enumerate(self.heap):
+            self.pos[i] = p
+
+    def build(self, items, keys):
+        """
+        Replace the contents of the queue, faster than pushing the items one at a time
+        :param items: array of items
+        :param keys: array of keys for the items
+        """
+        self.clear()
+        # a sorted array satisfies the heap property
+        order = np.lexsort((items, keys))
+        self.heap = np.asarray(items)[order].tolist()
+        for p, i in enumerate(self.heap):
+            self.pos[i] = p
+        for i, key in zip(np.asarray(items).tolist(), np.asarray(keys).tolist()):
+            self.keys[i] = key
+
+    def top(self):
+        """
+        Returns the item with the smallest key without removing it
+        :return: item and its key
+        """
+        i = self.heap[0]
+        return i, self.keys[i]
+
+    def push(self, i, key):
+        """
+        Add an item to the queue, or change its key if it is already queued
+        :param i: item to add
+        :param key: key of the item
+        """
+        if self.pos[i] < 0:
+            self.keys[i] = key
+            self.pos[i] = len(self.heap)
+            self.heap.append(i)
+            self._sift_up(self.pos[i])
+        else:
+            self.keys[i] = key
+            self._sift_up(self.pos[i])
+            self._sift_down(self.pos[i])
+
+    def remove(self, i):
+        """
+        Remove an item from the queue if it is queued
+        :param i: item to remove
+        """
+        p = self.pos[i]
+        if p < 0:
+            return
+        last = self.heap.pop()
+        self.pos[i] = -1
+        self.keys[i] = np.inf
+        if last != i:
+            self.heap[p] = last
+            self.pos[last] = p
+            self._sift_up(p)
+            self._sift_down(self.pos[last])
+
+    def pop(self):
+        """
+        Remove the item with the smallest key
+        :return: item and its key
+        """
+        i, key = self.top()
+        self.remove(i)
+        return i, key
+
+    def _less(self, a, b):
+        return self.keys[a] < self.keys[b] or (self.keys[a] == self.keys[b] and a < b)
+
+    def _sift_up(self, p):
+        heap, pos = self.heap, self.pos
+        i = heap[p]
+        while p > 0:
+            parent = (p - 1) >> 1
+            if not self._less(i, heap[parent]):
+                break
+            heap[p] = heap[parent]
+            pos[heap[p]] = p
+            p = parent
+        heap[p] = i
+        pos[i] = p
+
+    def _sift_down(self, p):
+        heap, pos = self.heap, self.pos
+        n = len(heap)
+        i = heap[p]
+        while True:
+            child = 2 * p + 1
+            if child >= n:
+                break
+            if child + 1 < n and self._less(heap[child + 1], heap[child]):
+                child += 1
+            if not self._less(heap[child], i):
+                break
+            heap[p] = heap[child]
+            pos[heap[p]] = p
+            p = child
+        heap[p] = i
+        pos[i] = p
@@ -0,0 +1,69 @@
+import numpy as np
+
+
+def make_rng(seed=None):
+    """
+    Build the random generator used by a simulator, environment or agent
+    :param seed: None to draw from the global np.random state, an int or SeedSequence to create a new Generator, or
+        an existing Generator, RandomState or np.random to share its stream
+    :return: object providing the numpy random sampling methods
+    """
+    if seed is None:
+        return np.random
+    if seed is np.random or isinstance(seed, (np.random.Generator, np.random.RandomState)):
+        return seed
+    return np.random.default_rng(seed)
+
+
+def draw_seed(rng):
+    """
+    Draw a 32 bit seed from a random generator
+    :param rng: Generator, RandomState or np.random
+    :return: integer seed
+    """
+    if isinstance(rng, np.random.Generator):
+        return int(rng.integers(2 ** 32))
+    return int(rng.randint(2 ** 32))
+
+
+def spawn(seed, n):
+    """
+    Create independent child generators for parallel workers, SeedSequence style, so each worker has its own
+    reproducible stream
+    :param seed: int, SeedSequence, Generator, RandomState, np.random or None for the global np.random state
+    :param n: number of children
+    :return: list of Generators
+    """
+    if isinstance(seed, np.random.SeedSequence):
+        sequence = seed
+    elif isinstance(seed, (int, np.integer)):
+        sequence = np.random.SeedSequence(seed)
+    else:
+        rng = make_rng(seed)
+        if isinstance(rng, np.random.Generator):
+            return rng.spawn(n)
+        sequence = np.random.SeedSequence(draw_seed(rng))
+    return [np.random.default_rng(s) for s in sequence.spawn(n)]
+
+
+def get_state(rng):
+    """
+    Capture the state of a random generator
+    :param rng: Generator, RandomState or np.random
+    :return: state that set_state restores
+    """
+    if isinstance(rng, np.random.Generator):
+        return rng.bit_generator.state
+    return rng.get_state()
+
+
+def set_state(rng, state):
+    """
+    Return a random generator to a state captured by get_state
+    :param rng: Generator, RandomState or np.random
+    :param state: state from get_state
+    """
+    if isinstance(rng, np.random.Generator):
+        rng.bit_generator.state = state
+    else:
+        rng.set_state(state)
@@ -1,8 +1,12 @@
+from collections import namedtuple
+
 import networkx as nx
 import matplotlib.pyplot as plt
 import numpy as np
 
-from ..env.pnpsc_net import PnpscNet
+from .compiled_net import compile_control_rates
+from .indexed_priority_queue import IndexedPriorityQueue
+from .rng import get_state, make_rng, set_state
 
 # Flag from the PNPSC specification
 RESET = True
@@ -12,136 +16,340 @@ USE_FIRE_COST = False
 RESET_CONTROL_RATE = False
 # Large time in the future for disabled rates
 LARGE_TIME = 100
+# Reward of a player for each of its marked goal places, paid by the environments
+GOAL_REWARD = 100
+# Scheduling modes, redraw the firing times of all enabled transitions each step or only the changed ones
+SCHEDULERS = ('race', 'next_reaction')
+
+# State of a running simulation returned by Simulator.snapshot(). The arrays are read only copies, cache holds the
+# cached enabled transitions and rates or None, queue and zero_rate the next reaction queues.
+SimulatorState = namedtuple('SimulatorState', ['places', 'rates', 'costs', 'done', 't', 'fired', 'updated', 'ft',
+                                               'cache', 'queue', 'zero_rate', 'queued_rates', 'rng'])
+
+
+def _frozen(a):
+    """
+    Read only copy of an array
+    :param a: array to copy
+    :return: the copy
+    """
+    a = a.copy()
+    a.setflags(write=False)
+    return a
+
+
+class _ControlRates(dict):
+    """
+    Control rate arcs of a simulator keyed by transition name. Replacing the arcs of a transition invalidates the
+    compiled control rates and cached rates of the owning simulator so they are rebuilt on the next step.
+    """
+    def __init__(self, simulator, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._simulator = simulator
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        self._simulator._control_rate_arcs = None
+
 
 class Simulator():
     """
-    Local implementation of the PNPSC net simulator using NetworkX
+    Local implementation of the PNPSC net simulator.
+    The net structure is compiled into integer indexed arrays once, NetworkX is only used for rendering and export
     """
-    def __init__(self, net):
+    def __init__(self, net, scheduler='race', seed=None):
         """
         Create a PNPSC net simulator
         :param net: PNPSC net object
+        :param scheduler: 'race' draws a firing time for every enabled transition each step, 'next_reaction' keeps
+            the firing times in a priority queue and only draws or rescales the times of changed transitions
+        :param seed: seed or Generator of the firing times, None draws from the global np.random state
         """
+        assert scheduler in SCHEDULERS, 'scheduler must be one of ' + str(SCHEDULERS)
         self.net = net
-        self.g = nx.DiGraph()
+        self.scheduler = scheduler
+        self.rng = make_rng(seed)
+        self.compiled = self.net.compiled
+        self._g = None
 
         # used for rendering
         self.places = [p['name'] for p in self.net.json['places']]
         self.transitions = [t['name'] for t in self.net.json['transitions']]
         self.inhibitors = [(t['inhibitor'], t['name']) for t in self.net.json['transitions'] if t['inhibitor'] != '']
 
-        self.control_rates = {t['name']: [] for t in self.net.json['transitions']}
-
-        self.fire_cost = {t['name']: (t['player_control'], t['fire_cost']) for t in sorted(self.net.json['transitions'],
-                                                                                  key=lambda x: x['name'])}
-
-        for p in self.net.json['places']:
-            self.g.add_node(p['name'], type='place', control=p['player_observable'],
-                            explanation=p['description'] if 'description' in p else '')
-
-        for t in self.net.json['transitions']:
-            self.g.add_node(t['name'], type='transition', control=t['player_control'],
-                            explanation=t['description'] if 'description' in t else '')
-            for ti in t['input'].split(','):
-                self.g.add_edge(ti, t['name'], weight=1)
-            for to in t['output'].split(','):
-                self.g.add_edge(t['name'], to, weight=1)
-            if t['inhibitor'] != '':
-                for ia in t['inhibitor'].split(','):
-                    self.g.add_edge(ia, t['name'], weight=-1)
-            for cr in t['control_rate'].split(','):
-                if cr != '':
-                    p, r = cr.split('=')
-                    self.control_rates[t['name']].append((p, int(r)))
+        self.control_rates = _ControlRates(self, {t: [(self.compiled.place_names[p], r) for p, r in cr]
+                                                  for t, cr in zip(self.compiled.transition_names,
+                                                                   self.compiled.control_rates)})
+        self._control_rate_arcs = None
+
+        self.fire_cost = {t: c for t, c in zip(self.compiled.transition_names, self.compiled.fire_cost)}
 
         self.t = 0
         self.fired = None
-        self.ft = np.full(len(self.net.rates.keys()), np.inf)
+        self.ft = np.full(self.compiled.num_transitions, np.inf)
         self.updated = []
+        # cached enabled transitions and effective rates along with the marking and rates they were computed from
+        self._enabled = None
+        self._rates = None
+        self._marking = None
+        self._base_rates = None
+        # firing times of enabled transitions with a non zero rate, and enabled transitions with a zero rate
+        self._queue = IndexedPriorityQueue(self.compiled.num_transitions)
+        self._zero_rate = IndexedPriorityQueue(self.compiled.num_transitions)
+        self._queued_rates = [0.0] * self.compiled.num_transitions
         self.reset()
 
-    def reset(self):
+    def reset(self, seed=None):
         """
         Reset the simulator to the original marking and rates
+        :param seed: if given, seed or Generator that replaces the random generator of the firing times
         """
-        self.net.done = False
-        self.net.costs = {p: 0 for p in self.net.players}
-        self.net.places = {p['name']: p['marking'] for p in sorted(self.net.json['places'], key=lambda x: x['name'])}
-        self.net.rates = {t['name']: t['rate'] for t in sorted(self.net.json['transitions'], key=lambda x: x['name'])}
+        if seed is not None:
+            self.rng = make_rng(seed)
+        self.net.reset()
         self.t = 0
         self.fired = None
-        self.ft = np.full(len(self.net.rates.keys()), np.inf)
+        self.ft = np.full(self.compiled.num_transitions, np.inf)
         self.updated = []
+        self._enabled = None
+
+    @property
+    def g(self):
+        """
+        NetworkX graph of the net, built the first time it is rendered or exported
+        """
+        if self._g is None:
+            self._g = nx.DiGraph()
+            for p in self.net.json['places']:
+                self._g.add_node(p['name'], type='place', control=p['player_observable'],
+                                 explanation=p['description'] if 'description' in p else '')
+
+            for t in self.net.json['transitions']:
+                self._g.add_node(t['name'], type='transition', control=t['player_control'],
+                                 explanation=t['description'] if 'description' in t else '')
+                for ti in t['input'].split(','):
+                    self._g.add_edge(ti, t['name'], weight=1)
+                for to in t['output'].split(','):
+                    self._g.add_edge(t['name'], to, weight=1)
+                if t['inhibitor'] != '':
+                    for ia in t['inhibitor'].split(','):
+                        self._g.add_edge(ia, t['name'], weight=-1)
+        return self._g
+
+    def snapshot(self):
+        """
+        Capture the state of the simulation, the marking, rates, costs, time, pending firing times and random state,
+        so it can be returned to with restore()
+        :return: immutable SimulatorState
+        """
+        net = self.net
+        cache = None
+        if self._enabled is not None:
+            cache = (_frozen(self._enabled), _frozen(self._rates), _frozen(self._marking), _frozen(self._base_rates))
+        return SimulatorState(_frozen(net.place_values), _frozen(net.rate_values), _frozen(net.cost_values),
+                              net.done, self.t, self.fired, tuple(self.updated), _frozen(self.ft), cache,
+                              self._queue.snapshot(), self._zero_rate.snapshot(), tuple(self._queued_rates),
+                              get_state(self.rng))
+
+    def restore(self, state, restore_rng=True):
+        """
+        Return the simulation to a snapshot, the state can be restored any number of times
+        :param state: SimulatorState from snapshot()
+        :param restore_rng: also return the random generator to the snapshot, rollouts from the same state should
+            pass False so they draw different firing times
+        """
+        net = self.net
+        net.place_values[:] = state.places
+        net.rate_values[:] = state.rates
+        net.cost_values[:] = state.costs
+        net.done = state.done
+        self.t = state.t
+        self.fired = state.fired
+        self.updated = list(state.updated)
+        self.ft = state.ft.copy()
+        if state.cache is None:
+            self._enabled = None
+        else:
+            self._enabled, self._rates, self._marking, self._base_rates = (a.copy() for a in state.cache)
+        self._queue.restore(state.queue)
+        self._zero_rate.restore(state.zero_rate)
+        self._queued_rates = list(state.queued_rates)
+        if restore_rng:
+            set_state(self.rng, state.rng)
 
     def update_rates(self, rates):
         """
         Update the transition rates
         :param rates: Dictionary of rates to update
         """
-        self.updated = []
+        self.updated = list(rates)
+        index, values = self.net.transition_index, self.net.rate_values
         for k, v in rates.items():
-            self.updated.append(k)
-            self.net.rates[k] = v
+            values[index[k]] = v
+
+    def _get_marking(self):
+        """
+        Returns the current marking of the net as an array in place name order
+        :return: array of place markings
+        """
+        return self.net.place_values.astype(float)
+
+    def _compile_control_rates(self):
+        """
+        Compile the control rates of the simulator and rebuild the place to transition dependency index
+        """
+        self._control_rate_arcs = [[(self.compiled.place_index[p], r) for p, r in self.control_rates[t]]
+                                   for t in self.compiled.transition_names]
+        self._control_rate_slots = compile_control_rates(self._control_rate_arcs)
+        self._dependents = self.compiled.dependents(self._control_rate_arcs)
+        self._enabled = None
+
+    def _update_enabled(self):
+        """
+        Bring the cached enabled transitions and effective rates up to date with the current marking and rates.
+        Only transitions whose rate changed, or that depend on a place whose marking changed, since the last step are
+        re-evaluated, the changes are found by comparing the arrays of the net with the cached copies.
+        :return: the re-evaluated transitions, or None if all transitions were re-evaluated
+        """
+        if self._control_rate_arcs is None:
+            self._compile_control_rates()
+
+        if self._enabled is None:
+            self._marking = self._get_marking()
+            self._base_rates = self.net.rate_values.copy()
+            self._enabled = self.compiled.enabled(self._marking)
+            self._rates = self.compiled.effective_rates(self._marking, self._base_rates, self._control_rate_slots)
+            return None
+
+        changed = []
+        places = np.flatnonzero(self.net.place_values != self._marking)
+        if len(places) > 0:
+            self._marking[places] = self.net.place_values[places]
+            changed.extend(self._dependents[p] for p in places)
+        rates = np.flatnonzero(self.net.rate_values != self._base_rates)
+        if len(rates) > 0:
+            self._base_rates[rates] = self.net.rate_values[rates]
+            changed.append(rates)
+        if not changed:
+            return []
+
+        marking = self._marking
+        updated = np.unique(np.concatenate(changed)).tolist()
+        for i in updated:
+            self._enabled[i] = all(marking[p] > 0 for p in self.compiled.inputs[i]) and \
+                not any(marking[p] > 0 for p in self.compiled.inhibitors[i])
+            rate = self._base_rates[i]
+            for p, r in self._control_rate_arcs[i]:
+                if marking[p] > 0:
+                    rate += r
+            self._rates[i] = rate
+        return updated
 
     def _check_enabled(self):
         """
         Returns the enabled transition for the current marking
         :return: A list of enabled transitions
         """
-        enabled = [True for t in self.net.get_all_rates().keys()]
-        for i, t in enumerate(self.net.get_all_rates().keys()):
-            for e in self.g.in_edges(t, data=True):
-                if e[2]['weight'] == -1:
-                    # inhibitor
-                    if self.net.places[e[0]] > 0:
-                        enabled[i] = False
-                elif self.net.places[e[0]] <= 0:
-                    enabled[i] = False
-        return enabled
+        return self.compiled.enabled(self._get_marking()).tolist()
+
+    def _race(self):
+        """
+        Select the next transition by drawing a firing time for the enabled transitions and taking the earliest
+        :return: index of the transition to fire, or None if no transition is enabled
+        """
+        enabled, rates = self._enabled, self._rates
+        if not enabled.any():
+            return None
+
+        # update firing times, exponential draws are made in transition order
+        update = enabled if RESET else enabled & (self.ft == np.inf)
+        # to mimic the cloud sim, if the rate is 0 pick a time far into the future
+        self.ft[update & (rates == 0)] = LARGE_TIME + self.t
+        draw = update & (rates != 0)
+        self.ft[draw] = self.rng.exponential(1 / rates[draw]) + self.t
+        # not enabled
+        self.ft[~enabled] = np.inf
+
+        if RESET_CONTROL_RATE:
+            self.net.rate_values[:] = rates
+
+        # to mimic the cloud sim, pick the first transition if all are the same
+        j = np.argmin(self.ft)
+        # selected transition to fire
+        self.t = self.ft[j]
+        self.ft[j] = np.inf
+        return j
+
+    def _next_reaction(self, updated):
+        """
+        Select the next transition using the next reaction method of Gibson and Bruck. Firing times stay valid while
+        a transition remains enabled because the exponential distribution is memoryless, so only the re-evaluated
+        transitions and the last fired transition are given new times, rescaling the time left when only the rate
+        changed. This is statistically equivalent to the race with RESET.
+        :param updated: transitions re-evaluated since the last step, or None if all were re-evaluated
+        :return: index of the transition to fire, or None if no transition is enabled
+        """
+        queue, zero_rate = self._queue, self._zero_rate
+        if updated is None:
+            enabled, rates = self._enabled, self._rates
+            draw = np.flatnonzero(enabled & (rates != 0))
+            queue.build(draw, self.rng.exponential(1 / rates[draw]) + self.t)
+            zero = np.flatnonzero(enabled & (rates == 0))
+            zero_rate.build(zero, zero)
+            self._queued_rates = rates.tolist()
+            updated = []
+        elif self.fired is not None:
+            updated = set(updated)
+            updated.add(self.fired)
+
+        for i in updated:
+            rate = float(self._rates[i])
+            if not self._enabled[i]:
+                queue.remove(i)
+                zero_rate.remove(i)
+            elif rate == 0:
+                queue.remove(i)
+                zero_rate.push(i, i)
+            else:
+                zero_rate.remove(i)
+                if i not in queue:
+                    queue.push(i, self.rng.exponential(1 / rate) + self.t)
+                elif rate != self._queued_rates[i]:
+                    queue.push(i, self.t + self._queued_rates[i] / rate * (queue.keys[i] - self.t))
+                self._queued_rates[i] = rate
+
+        if RESET_CONTROL_RATE:
+            self.net.rate_values[:] = self._rates
+
+        # zero rate transitions fire far into the future, the first one is picked to mimic the cloud sim
+        if len(zero_rate) > 0 and (len(queue) == 0 or queue.top()[1] > LARGE_TIME + self.t):
+            j, _ = zero_rate.pop()
+            self.t = LARGE_TIME + self.t
+        elif len(queue) > 0:
+            j, self.t = queue.pop()
+        else:
+            return None
+        return j
 
     def step(self):
         """
         Step the PNPSC net simulator
         """
-        enabled = self._check_enabled()
-
-        rates = self.net.get_all_rates()
-        if any(enabled):
-            for i, t in enumerate(rates):
-                rate = rates[t]
-                # set control rates
-                for p, rv in self.control_rates[t]:
-                    if self.net.places[p] > 0:
-                        rate += rv
-
-                if enabled[i]:
-                    if RESET or self.ft[i] == np.inf:
-                        if rate == 0:
-                            # to mimic the cloud sim, if the rate is 0 pick a time far into the future
-                            self.ft[i] = LARGE_TIME + self.t
-                        else:
-                            # update firing time
-                            self.ft[i] = np.random.exponential(1 / rate) + self.t
-                else:
-                    # not enabled
-                    self.ft[i] = np.inf
-                if RESET_CONTROL_RATE:
-                    rates[t] = rate
-
-            # to mimic the cloud sim, pick the first transition if all are the same
-            j = np.argmin(self.ft)
-            # selected transition to fire
-            self.t = self.ft[j]
+        updated = self._update_enabled()
+        if self.scheduler == 'next_reaction':
+            j = self._next_reaction(updated)
+        else:
+            j = self._race()
+
+        if j is not None:
             self.fired = j
-            self.ft[j] = np.inf
-            fired_named = list(self.net.rates.keys())[j]
-            for e in self.g.in_edges(fired_named, data=True):
-                if e[2]['weight'] >= 1:
-                    self.net.places[e[0]] -= 1
-            for e in self.g.out_edges(fired_named):
-                self.net.places[e[1]] += 1
-
-            player, cost = self.fire_cost[fired_named]
+            marking = self.net.place_values
+            for p in self.compiled.inputs[j]:
+                marking[p] -= 1
+            for p in self.compiled.outputs[j]:
+                marking[p] += 1
+
+            player, cost = self.compiled.fire_cost[j]
 
             if player is not None and player != 'None' and player != '':
                 self.net.costs[player] += cost if cost is not None and USE_FIRE_COST else 0
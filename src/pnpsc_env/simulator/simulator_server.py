@@ -0,0 +1,277 @@
+"""
+Local HTTP server implementing the API of the cloud PNPSC simulator on top of Simulator, so PnpscRemoteEnv and
+PnpscAsyncRemoteEnv can run without the public service.
+Start one server process per port with: python -m src.pnpsc_env.simulator.simulator_server --port 8001 --processes 4
+"""
+import argparse
+import hashlib
+import json
+import multiprocessing as mp
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from .compiled_net import CompiledNet
+from .rng import draw_seed, make_rng
+from .simulator import Simulator
+from ..env.pnpsc_net import PnpscNet
+
+# Header naming the simulator of a request, matches pnpsc_remote_env.SESSION_HEADER
+SESSION_HEADER = 'Session-Id'
+
+# Session of the requests without a session id, so single simulator clients share one session
+DEFAULT_SESSION = ''
+
+# Seconds without requests after which a session and its simulator are removed
+SESSION_TIMEOUT = 600
+
+
+class _Session():
+    """
+    Simulator of one session, requests of the same session are handled one at a time
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.last_used = time.monotonic()
+        self.simulator = None
+        # player_observable of each place in name order, for the status responses
+        self.observable = None
+
+
+class SimulatorServer(ThreadingHTTPServer):
+    """
+    HTTP server hosting one Simulator per session, with the endpoints of the cloud simulator: uploadpetrinet/,
+    change_transitions/, step/, status/ and delete/.
+    Sessions are named by the SESSION_HEADER header, requests without it share the default session as with the cloud
+    simulator. Sessions without requests for session_timeout seconds are removed, so clients that never delete their
+    sessions do not keep simulators on a long running server. Each connection is served by its own thread and
+    connections are kept alive. Uploaded definitions are compiled once per distinct definition, so resetting an
+    episode by deleting and uploading the net again is cheap.
+    """
+    daemon_threads = True
+
+    def __init__(self, address=('127.0.0.1', 8001), scheduler='race', seed=None, latency=0,
+                 session_timeout=SESSION_TIMEOUT):
+        """
+        :param address: (host, port) to listen on, port 0 picks a free port
+        :param scheduler: scheduler of the simulators, 'race' or 'next_reaction'
+        :param seed: seed or Generator the seeds of the simulators are drawn from, None draws the firing times from
+            the global np.random state
+        :param latency: seconds every request waits before it is handled, to emulate a distant server
+        :param session_timeout: seconds without requests after which a session is removed, None keeps the sessions
+            until they are deleted
+        """
+        super().__init__(address, _Handler)
+        self.scheduler = scheduler
+        self.rng = None if seed is None else make_rng(seed)
+        self.latency = latency
+        self.session_timeout = session_timeout
+        self.sessions = {}
+        self._last_expiry = time.monotonic()
+        # compiled definitions and the player_observable of their places, keyed by the digest of the uploaded json
+        self.compiled = {}
+        self.lock = threading.Lock()
+
+    @property
+    def url(self):
+        return 'http://%s:%d/' % self.server_address[:2]
+
+    def start(self):
+        """
+        Serve requests from a daemon thread, stop with shutdown()
+        :return: the serving thread
+        """
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return thread
+
+    def session(self, session_id):
+        """
+        Get the session with an id, created on the first request
+        :param session_id: session id
+        :return: the session
+        """
+        now = time.monotonic()
+        with self.lock:
+            self._expire(now)
+            session = self.sessions.get(session_id)
+            if session is None:
+                session = self.sessions[session_id] = _Session()
+            session.last_used = now
+            return session
+
+    def _expire(self, now):
+        """
+        Remove the sessions idle for longer than session_timeout, at most twice per timeout, called with the lock held
+        :param now: current time.monotonic()
+        """
+        if self.session_timeout is None or now - self._last_expiry < self.session_timeout / 2:
+            return
+        self._last_expiry = now
+        for session_id in [k for k, v in self.sessions.items() if now - v.last_used > self.session_timeout]:
+            del self.sessions[session_id]
+
+    def upload(self, session, body):
+        """
+        Start a simulator for an uploaded net definition
+        :param session: session of the request
+        :param body: json definition of the net
+        """
+        digest = hashlib.sha256(body).hexdigest()
+        with self.lock:
+            entry = self.compiled.get(digest)
+            if entry is None:
+                compiled = CompiledNet(json.loads(body))
+                places = {p['name']: p.get('player_observable') for p in compiled.json['places']}
+                entry = self.compiled[digest] = (compiled, [places[p] for p in compiled.place_names])
+            seed = None if self.rng is None else draw_seed(self.rng)
+        compiled, session.observable = entry
+        session.simulator = Simulator(PnpscNet(compiled.json, compiled), self.scheduler, seed)
+
+    def delete(self, session_id):
+        """
+        Remove the simulator of a session
+        :param session_id: session id
+        """
+        with self.lock:
+            self.sessions.pop(session_id, None)
+
+
+def status(session):
+    """
+    Build the status response of a session, in the format of the cloud simulator
+    :param session: session with a simulator
+    :return: json status with the end of run flag, the marking and the player costs, and the rates which the cloud
+        simulator does not report
+    """
+    net = session.simulator.net
+    places = [{'name': p, 'marking': m, 'player_observable': o}
+              for p, m, o in zip(net.place_names, net.place_values.tolist(), session.observable)]
+    players = [{'name': p, 'cost': c} for p, c in zip(net.players, net.cost_values.tolist())]
+    transitions = [{'name': t, 'rate': r} for t, r in zip(net.transition_names, net.rate_values.tolist())]
+    return {'end_of_run': bool(net.done), 'places': places, 'players': players, 'transitions': transitions}
+
+
+def change_transitions(simulator, data):
+    """
+    Apply a rate update to a simulator
+    :param simulator: simulator of the session
+    :param data: json update object with the new rates and the cost of each player
+    :return: json response
+    """
+    net = simulator.net
+    rates = {t['name']: float(t['rate']) for t in data['transitions']}
+    for name in rates:
+        if name not in net.transition_index:
+            raise ValueError('unknown transition ' + str(name))
+    for p in data['players']:
+        if p['name'] not in net.players:
+            raise ValueError('unknown player ' + str(p['name']))
+    simulator.update_rates(rates)
+    for p in data['players']:
+        net.costs[p['name']] += p['transition_change_cost']
+    return {'changes_made': True}
+
+
+class _Handler(BaseHTTPRequestHandler):
+    """
+    Request handler of SimulatorServer
+    """
+    protocol_version = 'HTTP/1.1'
+    # the headers and the body are written separately, without this the body waits for the delayed ack of the client
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self, status_code, body):
+        """
+        Send a json response
+        :param status_code: HTTP status
+        :param body: json body
+        """
+        data = json.dumps(body).encode()
+        self.send_response(status_code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _handle(self):
+        """
+        Dispatch a request to its endpoint
+        """
+        server = self.server
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if server.latency > 0:
+            time.sleep(server.latency)
+        endpoint = self.path.strip('/')
+        session_id = self.headers.get(SESSION_HEADER, DEFAULT_SESSION)
+
+        if endpoint == 'delete':
+            server.delete(session_id)
+            return self._reply(200, {'deleted': True})
+        if endpoint not in ('uploadpetrinet', 'change_transitions', 'step', 'status'):
+            return self._reply(404, {'error': 'unknown endpoint ' + self.path})
+
+        session = server.session(session_id)
+        with session.lock:
+            try:
+                if endpoint == 'uploadpetrinet':
+                    server.upload(session, body)
+                    return self._reply(200, {'uploaded': True})
+                if session.simulator is None:
+                    return self._reply(400, {'error': 'no net uploaded'})
+                if endpoint == 'change_transitions':
+                    return self._reply(200, change_transitions(session.simulator, json.loads(body)))
+                if endpoint == 'step':
+                    session.simulator.step()
+                return self._reply(200, status(session))
+            except (ValueError, KeyError, TypeError) as e:
+                return self._reply(400, {'error': repr(e)})
+
+    do_GET = _handle
+    do_POST = _handle
+
+
+def serve(host, port, scheduler='race', seed=None, latency=0, session_timeout=SESSION_TIMEOUT):
+    """
+    Run a server until interrupted
+    :param host: host to listen on
+    :param port: port to listen on
+    :param scheduler: scheduler of the simulators
+    :param seed: seed of the server, None for the global np.random state
+    :param latency: seconds every request waits before it is handled
+    :param session_timeout: seconds without requests after which a session is removed, None keeps them
+    """
+    server = SimulatorServer((host, port), scheduler, seed, latency, session_timeout)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Local PNPSC simulator server')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8001)
+    parser.add_argument('--processes', type=int, default=1, help='server processes, on consecutive ports')
+    parser.add_argument('--scheduler', default='race', choices=['race', 'next_reaction'])
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--latency', type=float, default=0, help='seconds added to every request')
+    parser.add_argument('--session-timeout', type=float, default=SESSION_TIMEOUT,
+                        help='seconds without requests after which a session is removed, 0 keeps them')
+    args = parser.parse_args()
+
+    session_timeout = args.session_timeout if args.session_timeout > 0 else None
+    processes = []
+    for i in range(args.processes):
+        seed = None if args.seed is None else args.seed + i
+        processes.append(mp.Process(target=serve, args=(args.host, args.port + i, args.scheduler, seed, args.latency,
+                                                        session_timeout)))
+        processes[-1].start()
+        print('serving on http://%s:%d/' % (args.host, args.port + i))
+    for process in processes:
+        process.join()
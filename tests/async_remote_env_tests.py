@@ -0,0 +1,211 @@
+import json
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+from src.pnpsc_env.env.async_http_client import AsyncHttpClient
+from src.pnpsc_env.env.pnpsc_async_remote_env import PnpscAsyncRemoteEnv
+from src.pnpsc_env.env.pnpsc_async_vec_env import PnpscAsyncVecEnv
+from src.pnpsc_env.env.pnpsc_remote_env import SESSION_HEADER, RemoteSimulatorError
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    """
+    Stand-in for the simulator API that answers every request after the latency of the server. Each session counts
+    its steps and ends its run after episode_length steps, the marking is always the one of test_response.json.
+    The requests counted in the failures of their endpoint are rejected with 503, those counted in the drops are
+    applied and their connection is closed without a response, and those counted in the timeouts are applied and
+    answered with 504 as by a gateway that gave up waiting.
+    """
+    protocol_version = 'HTTP/1.1'
+    # the headers and the body are written separately, without this the body waits for the delayed ack of the client
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self):
+        server = self.server
+        time.sleep(server.latency)
+        session = self.headers.get(SESSION_HEADER)
+        endpoint = self.path.lstrip('/')
+        server.requests.append((session, endpoint))
+        length = int(self.headers.get('Content-Length', 0))
+        self.rfile.read(length)
+
+        with server.lock:
+            drops = server.drops.get(endpoint, 0)
+            server.drops[endpoint] = max(0, drops - 1)
+            timeouts = server.timeouts.get(endpoint, 0)
+            server.timeouts[endpoint] = max(0, timeouts - 1)
+            failures = server.failures.get(endpoint, 0)
+            server.failures[endpoint] = max(0, failures - 1)
+            if endpoint == 'delete/' and failures == 0:
+                server.steps[session] = 0
+            elif endpoint == 'step/' and failures == 0:
+                server.steps[session] += 1
+            steps = server.steps.get(session, 0)
+        if drops > 0:
+            # close the connection after applying the request, without a response
+            self.close_connection = True
+            return
+        if failures > 0:
+            status, body = 503, {}
+        elif timeouts > 0:
+            status, body = 504, {}
+        elif endpoint == 'change_transitions/':
+            status, body = 200, {'changes_made': True}
+        else:
+            status, body = 200, dict(server.status, end_of_run=steps >= server.episode_length)
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    do_GET = _reply
+    do_POST = _reply
+
+
+class TestAsyncRemoteEnv(unittest.TestCase):
+
+    def setUp(self):
+        with open('test_response.json') as f:
+            status = json.load(f)
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), StandInHandler)
+        self.server.daemon_threads = True
+        self.server.status, self.server.latency, self.server.episode_length = status, 0.02, 3
+        self.server.steps, self.server.requests, self.server.failures, self.server.drops = {}, [], {}, {}
+        self.server.timeouts = {}
+        self.server.lock = threading.Lock()
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = 'http://127.0.0.1:%d/' % self.server.server_address[1]
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_env(self):
+        """
+        Test the blocking methods of the async environment play an episode and reuse one connection
+        """
+        env = PnpscAsyncRemoteEnv(player_name='Attacker', net_path='../../nets/example_net.json', sim_url=self.url,
+                                  backoff=0)
+        self.server.failures['status/'] = 1
+        state, done = env.reset(), False
+        i = 0
+        while not done and i < 100:
+            state, reward, done, info = env.step([5])
+            i += 1
+
+        self.assertEqual(3, i)
+        self.assertEqual({'aP1': 9, 'aP2': 1, 'aP3': 1, 'aP4': 0, 'aP5': 0}, env.net.get_all_places())
+        self.assertEqual(1, env.latency_stats()['status/']['retries'])
+        self.assertEqual({env.session_id}, {session for session, endpoint in self.server.requests})
+        self.assertEqual(1, sum(len(c) for c in env.session._idle.values()))
+        env.close()
+        self.assertEqual((env.session_id, 'delete/'), self.server.requests[-1])
+
+        # sessions named by the caller are left on the server
+        env = PnpscAsyncRemoteEnv(player_name='Attacker', net_path='../../nets/example_net.json', sim_url=self.url,
+                                  session_id='shared')
+        env.reset()
+        env.close()
+        self.assertEqual(('shared', 'status/'), self.server.requests[-1])
+
+    def test_idle_timeout(self):
+        """
+        Test a request on a pooled connection the server closed while idle is sent again on a new connection
+        """
+        self.server.RequestHandlerClass = type('IdleTimeoutHandler', (StandInHandler,), {'timeout': 0.1})
+        self.server.latency = 0
+        env = PnpscAsyncRemoteEnv(player_name='Attacker', net_path='../../nets/example_net.json', sim_url=self.url)
+        env.reset()
+        time.sleep(0.3)
+        env.step(None)
+        self.assertEqual(1, self.server.steps[env.session_id])
+        self.assertEqual(0, env.latency_stats()['step/']['retries'])
+        env.close()
+
+    def test_vec_env(self):
+        """
+        Test the vectorized environment overlaps the round trips of independent sessions
+        """
+        num_envs = 8
+        env = PnpscAsyncVecEnv('Attacker', '../../nets/example_net.json', num_envs=num_envs, sim_url=self.url)
+        obs = env.reset()
+        self.assertEqual((num_envs, 2), obs.shape)
+
+        start = time.perf_counter()
+        for i in range(3):
+            obs, rewards, dones, infos = env.step(np.full((num_envs, 1), 5.0))
+        elapsed = time.perf_counter() - start
+
+        # the episodes end together and restart, each step is two round trips and the reset three
+        self.assertTrue(np.all(dones))
+        self.assertIn('terminal_observation', infos[0])
+        self.assertLess(elapsed, 0.5 * num_envs * 9 * self.server.latency)
+
+        # every environment drives its own session
+        sessions = set(env.get_attr('session_id'))
+        self.assertEqual(num_envs, len(sessions))
+        self.assertEqual(sessions, {session for session, endpoint in self.server.requests})
+        self.assertEqual(num_envs * 3, env.latency_stats()['step/']['calls'])
+        env.close()
+
+    def test_errors(self):
+        """
+        Test rejected and failed requests raise after the other environments finish their requests
+        """
+        env = PnpscAsyncVecEnv('Attacker', '../../nets/example_net.json', num_envs=4, sim_url=self.url,
+                               max_retries=0)
+        self.server.failures['uploadpetrinet/'] = 1
+        with self.assertRaises(RemoteSimulatorError) as e:
+            env.reset()
+        self.assertEqual((e.exception.endpoint, e.exception.status_code), ('uploadpetrinet/', 503))
+        # the other sessions finished their resets
+        self.assertEqual(3, env.latency_stats()['status/']['calls'])
+        env.close()
+
+        client = AsyncHttpClient()
+        env = PnpscAsyncRemoteEnv(player_name='Attacker', net_path='../../nets/example_net.json', session=client,
+                                  sim_url='http://127.0.0.1:1/', max_retries=1, backoff=0)
+        with self.assertRaises(RemoteSimulatorError):
+            env.reset()
+        self.assertEqual(1, env.latency_stats()['delete/']['retries'])
+        # failures to connect are retried for steps too
+        with self.assertRaises(RemoteSimulatorError):
+            env.step([5])
+        self.assertEqual(1, env.latency_stats()['change_transitions/']['retries'])
+        client.close()
+
+        # a step whose connection drops after the simulator applied it is not sent again
+        env = PnpscAsyncRemoteEnv(player_name='Attacker', net_path='../../nets/example_net.json', sim_url=self.url,
+                                  backoff=0)
+        env.reset()
+        self.server.drops['step/'] = 1
+        with self.assertRaises(RemoteSimulatorError) as e:
+            env.step(None)
+        self.assertEqual('step/', e.exception.endpoint)
+        self.assertEqual(0, env.latency_stats()['step/']['retries'])
+        self.assertEqual(1, self.server.steps[env.session_id])
+
+        # so is a step the gateway timed out on, while requests that can be sent twice are retried
+        self.server.timeouts['step/'] = 1
+        self.server.timeouts['status/'] = 1
+        with self.assertRaises(RemoteSimulatorError) as e:
+            env.step(None)
+        self.assertEqual(('step/', 504), (e.exception.endpoint, e.exception.status_code))
+        self.assertEqual(0, env.latency_stats()['step/']['retries'])
+        self.assertEqual(2, self.server.steps[env.session_id])
+        env.reset()
+        self.assertEqual(1, env.latency_stats()['status/']['retries'])
+        env.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
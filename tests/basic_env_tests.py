@@ -1,13 +1,19 @@
 import json
+import pickle
 import unittest
 
 import numpy as np
+from shimmy import GymV21CompatibilityV0
+from stable_baselines3.common.env_util import make_vec_env
+from stable_baselines3.common.vec_env.patch_gym import _patch_env
 
 from src.pnpsc_env.env.pnpsc_vec_env import PnpscVecEnv
+from src.pnpsc_env.agents.random_agent import RandomAgent
 from src.pnpsc_env.agents.static_agent import StaticAgent
 from src.pnpsc_env.env.pnpsc_local_env import PnpscLocalEnv
 from src.pnpsc_env.env.pnpsc_net import PnpscNet
 from src.pnpsc_env.env.pnpsc_remote_env import PnpscRemoteEnv
+from src.pnpsc_env.simulator.simulator_server import SimulatorServer
 
 
 class TestEnvMethods(unittest.TestCase):
@@ -29,9 +35,11 @@ class TestEnvMethods(unittest.TestCase):
 
     def test_remote_env(self):
         """
-        Test the basic functionality of the remote environment
+        Test the basic functionality of the remote environment, against a local simulator server
         """
-        env = PnpscRemoteEnv(player_name='Attacker', net_path='../../nets/example_net.json')
+        server = SimulatorServer(('127.0.0.1', 0))
+        server.start()
+        env = PnpscRemoteEnv(player_name='Attacker', net_path='../../nets/example_net.json', sim_url=server.url)
         agent = StaticAgent(player_name='Attacker')
 
         state, done = env.reset(), False
@@ -41,6 +49,84 @@ class TestEnvMethods(unittest.TestCase):
             i += 1
 
         self.assertTrue(done)
+        env.close()
+        server.shutdown()
+        server.server_close()
+
+    def test_seeded_reset(self):
+        """
+        Test an episode is replayed by resetting with the same seed
+        """
+        env = PnpscLocalEnv(player_name='Attacker', net_path='../../nets/example_net.json', seed=1)
+        episodes = []
+        for _ in range(2):
+            agent = RandomAgent(player_name='Attacker', seed=2)
+            env.seed(3)
+            state, done = env.reset(), False
+            episode = [state.tolist()]
+            while not done and len(episode) < 100:
+                state, reward, done, info = env.step(agent.act(env.net)[0])
+                episode.append((state.tolist(), reward, done))
+            episodes.append(episode)
+        self.assertEqual(episodes[0], episodes[1])
+
+    def test_stable_baselines_patch(self):
+        """
+        Test stable baselines wraps the environment as a gym 0.21 environment and seeds it through seed()
+        """
+        observations = []
+        for _ in range(2):
+            env = _patch_env(PnpscLocalEnv(player_name='Attacker', net_path='../../nets/example_net.json'))
+            self.assertIsInstance(env, GymV21CompatibilityV0)
+            obs, info = env.reset(seed=3)
+            self.assertEqual({}, info)
+            observations.append((obs.tolist(), env.unwrapped.rng.random()))
+        self.assertEqual(observations[0], observations[1])
+
+    def test_observation_buffer(self):
+        """
+        Test observations reuse one buffer unless copies are requested, and the info reads the current marking
+        """
+        env = PnpscLocalEnv(player_name='Attacker', net_path='../../nets/example_net.json')
+        state = env.reset()
+        next_state, reward, done, info = env.step([10])
+        self.assertIs(state, next_state)
+        self.assertEqual(list(env.net.get_visible_places('Attacker').values()) + [10], next_state.tolist())
+        self.assertEqual(env.net.get_all_places(), info['places'])
+        self.assertEqual({'places': env.net.get_all_places()}, pickle.loads(pickle.dumps(info)))
+
+        env = PnpscLocalEnv(player_name='Attacker', net_path='../../nets/example_net.json', copy_obs=True)
+        state = env.reset()
+        self.assertIsNot(state, env.step([10])[0])
+
+    def test_info_writes(self):
+        """
+        Test wrappers can write to the info, which then keeps the marking of its step
+        """
+        env = PnpscLocalEnv(player_name='Attacker', net_path='../../nets/example_net.json')
+        env.reset()
+        info = env.step([10])[3]
+        self.assertFalse(info.pop('TimeLimit.truncated', False))
+        places = dict(env.net.get_all_places())
+        info['terminal_observation'] = np.zeros(2)
+        self.assertEqual({'places', 'terminal_observation'}, set(info))
+        del info['terminal_observation']
+        self.assertEqual({'places': places}, pickle.loads(pickle.dumps(info)))
+
+        # the next step returns a fresh info
+        next_info = env.step([10])[3]
+        self.assertEqual(['places'], list(next_info))
+        self.assertEqual(places, info['places'])
+
+        venv = make_vec_env(lambda: PnpscLocalEnv('Attacker', '../../nets/example_net.json'), n_envs=2, seed=0)
+        venv.reset()
+        dones = 0
+        for _ in range(50):
+            obs, rewards, done, infos = venv.step(np.full((2, 1), 5.0))
+            for i in np.flatnonzero(done):
+                self.assertEqual((2,), infos[i]['terminal_observation'].shape)
+                dones += 1
+        self.assertGreater(dones, 0)
 
     def test_vec_env(self):
         """
@@ -92,6 +178,29 @@ class TestEnvMethods(unittest.TestCase):
             self.assertEqual(net.get_all_places(), {'aP1': 9, 'aP2': 1, 'aP3': 1, 'aP4': 0, 'aP5': 0})
             self.assertEqual(net.get_player_cost('Attacker'), 10)
 
+    def test_reset_net(self):
+        """
+        Test the places and rates views write to the arrays of the net and reset restores the initial state
+        """
+        with open('../nets/example_net.json') as f:
+            net = PnpscNet(json.load(f))
+
+            places = net.get_all_places()
+            net.places['aP1'] = 3
+            net.rates = {'aT2': 0.5}
+            net.costs['Attacker'] += 2
+            self.assertEqual(places['aP1'], 3)
+            self.assertEqual(net.place_values[net.place_index['aP1']], 3)
+            self.assertEqual(net.get_all_rates(), {'aT1': 10, 'aT2': 0.5, 'aT3': 10, 'aT4': 2})
+            self.assertEqual(net.get_player_cost('Attacker'), 2)
+
+            net.done = True
+            net.reset()
+            self.assertFalse(net.done)
+            self.assertEqual(places, {'aP1': 10, 'aP2': 0, 'aP3': 0, 'aP4': 0, 'aP5': 0})
+            self.assertEqual(net.get_all_rates(), {'aT1': 10, 'aT2': 5, 'aT3': 10, 'aT4': 2})
+            self.assertEqual(net.get_player_cost('Attacker'), 0)
+
     def test_action(self):
         """
         Test a single action from an agent
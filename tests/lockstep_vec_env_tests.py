@@ -0,0 +1,103 @@
+import unittest
+
+import numpy as np
+
+from src.pnpsc_env.agents.static_agent import StaticAgent
+from src.pnpsc_env.env.pnpsc_local_env import PnpscLocalEnv
+from src.pnpsc_env.env.pnpsc_lockstep_vec_env import PnpscLockstepVecEnv
+
+
+class TestLockstepVecEnvMethods(unittest.TestCase):
+
+    def test_auto_reset(self):
+        """
+        Test finished episodes report their last observation and restart from the initial marking
+        """
+        env = PnpscLockstepVecEnv(player_name='Attacker', net_path='../../nets/example_net.json', num_envs=100, seed=0)
+        initial = env.reset()
+        self.assertEqual((100, 2), initial.shape)
+
+        finished = 0
+        for _ in range(50):
+            obs, rewards, dones, infos = env.step(initial[:, 1:])
+            self.assertEqual((100,), rewards.shape)
+            for i in np.flatnonzero(dones):
+                self.assertIn('terminal_observation', infos[i])
+                np.testing.assert_array_equal(initial[i], obs[i])
+            finished += np.sum(dones)
+        self.assertGreater(finished, 0)
+
+    def test_matches_local_env(self):
+        """
+        Test the episodes have the same mean return as the local environment
+        """
+        env = PnpscLockstepVecEnv(player_name='Attacker', net_path='../../nets/example_net.json', num_envs=5_000,
+                                  seed=1)
+        env.reset()
+        # the first episode of every row, later episodes would favour the short ones
+        returns, finished = np.zeros(env.num_envs), np.zeros(env.num_envs, dtype=bool)
+        while not np.all(finished):
+            obs, rewards, dones, infos = env.step(np.full((env.num_envs, 1), 10))
+            returns += np.where(finished, 0, rewards)
+            finished |= dones
+
+        local = PnpscLocalEnv(player_name='Attacker', net_path='../../nets/example_net.json', seed=2)
+        agent = StaticAgent(player_name='Attacker')
+        local_totals = []
+        for _ in range(2_000):
+            local.reset()
+            done, total = False, 0
+            while not done:
+                _, reward, done, _ = local.step(agent.act(local.net)[0])
+                total += reward
+            local_totals.append(total)
+        self.assertAlmostEqual(np.mean(local_totals), np.mean(returns), delta=5)
+
+    def test_zero_rates(self):
+        """
+        Test enabled transitions with rate 0 still fire and every marked goal place is rewarded, as in the local
+        environment
+        """
+        for backend in ['dense', 'sparse']:
+            env = PnpscLockstepVecEnv(player_name='Attacker', net_path='../../nets/zero_rate_net.json', num_envs=4,
+                                      backend=backend, seed=0)
+            env.reset()
+            obs, rewards, dones, infos = env.step(np.array([[0], [0], [10], [10]]))
+
+            for i, rate in enumerate([0, 0, 10, 10]):
+                local = PnpscLocalEnv(player_name='Attacker', net_path='../../nets/zero_rate_net.json', seed=i)
+                local.reset()
+                _, reward, done, _ = local.step([rate])
+                self.assertTrue(done)
+                self.assertEqual(reward, rewards[i])
+                self.assertTrue(dones[i])
+                np.testing.assert_array_equal([0, rate], infos[i]['terminal_observation'])
+            self.assertEqual([199, 199, 200, 200], rewards.tolist())
+
+    def test_discrete_actions(self):
+        """
+        Test the discrete actions follow DiscretePnpscWrapper and seeded resets replay the episodes
+        """
+        env = PnpscLockstepVecEnv(player_name='Attacker', net_path='../../nets/example_net.json', num_envs=10,
+                                  options=(0, 10), max_actions=2)
+        self.assertEqual(3, env.action_space.n)
+        self.assertEqual((10, 3), env.reset().shape)
+
+        # the first update only changes the rate, the end turn action steps the simulator
+        obs, rewards, dones, infos = env.step(np.zeros(10, dtype=int))
+        np.testing.assert_array_equal(np.tile([10, 0, 1], (10, 1)), obs)
+        np.testing.assert_allclose(-1, rewards)
+        obs, rewards, dones, infos = env.step(np.full(10, 2))
+        np.testing.assert_array_equal(0, obs[:, 2])
+        np.testing.assert_array_equal(9, obs[:, 0])
+
+        runs = []
+        for _ in range(2):
+            env.seed(3)
+            env.reset()
+            runs.append([env.step(np.ones(10, dtype=int))[0] for _ in range(20)])
+        np.testing.assert_array_equal(runs[0], runs[1])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,93 @@
+import unittest
+
+import numpy as np
+
+from src.pnpsc_env.agents.mcts_agent import MctsAgent
+from src.pnpsc_env.env.pnpsc_local_env import PnpscLocalEnv
+
+
+class TestMctsAgent(unittest.TestCase):
+
+    def test_episode(self):
+        """
+        Test the agent plays an episode of the local environment with rates from the options
+        """
+        env = PnpscLocalEnv(player_name='Attacker', net_path='../../nets/example_net.json', seed=0)
+        agent = MctsAgent(player_name='Attacker', num_samples=256, batch_size=64, seed=1)
+
+        state, done = env.reset(), False
+        i = 0
+        while not done and i < 100:
+            rates = agent.act(env.net)[0]
+            self.assertIn(rates[0], (0, 10))
+            self.assertLessEqual(agent.last_samples, 256)
+            state, reward, done, info = env.step(rates)
+            i += 1
+
+        self.assertTrue(done)
+
+    def test_seeded_decisions(self):
+        """
+        Test agents with the same seed make the same decisions and the estimates are reused for a repeated state
+        """
+        env = PnpscLocalEnv(player_name='Attacker', net_path='../../nets/capec63.json')
+        decisions = []
+        for _ in range(2):
+            agent = MctsAgent(player_name='Attacker', num_samples=512, batch_size=128, seed=2)
+            decisions.append(agent.act(env.net)[0])
+            estimates = dict(agent.cache.entries)
+        self.assertEqual(decisions[0], decisions[1])
+
+        # estimates of the same marking and rates are pooled
+        agent.act(env.net)
+        for key, (mean, samples) in estimates.items():
+            self.assertGreaterEqual(agent.cache.entries[key][1], samples)
+        self.assertGreater(sum(agent.cache.entries[key][1] for key in estimates),
+                           sum(samples for mean, samples in estimates.values()))
+
+        # candidates estimated from enough samples are not simulated again
+        agent.max_samples = 1
+        agent.act(env.net)
+        self.assertEqual(0, agent.last_samples)
+
+    def test_rollout_rewards(self):
+        """
+        Test the rollouts follow the environment, zero rates still fire and every marked goal place is rewarded
+        """
+        env = PnpscLocalEnv(player_name='Attacker', net_path='../../nets/zero_rate_net.json')
+        agent = MctsAgent(player_name='Attacker', seed=0)
+        agent._compile(env.net)
+        for rate in [0, 10]:
+            env.reset()
+            rates = env.net.rate_values.copy()
+            rates[agent.controlled] = rate
+            rewards = agent._rollout(np.repeat(env.net.place_values[np.newaxis], 8, axis=0),
+                                     np.repeat(rates[np.newaxis], 8, axis=0))
+            self.assertEqual([200] * 8, rewards.tolist())
+            # the environment pays the same goal reward after the cost of the rate change
+            self.assertEqual(200 - abs(rate - 10) / 10, env.step([rate])[1])
+
+    def test_small_cache(self):
+        """
+        Test a cache smaller than the number of candidates only limits the estimates kept between decisions
+        """
+        env = PnpscLocalEnv(player_name='Attacker', net_path='../../nets/example_net.json')
+        agent = MctsAgent(player_name='Attacker', num_samples=256, batch_size=64, cache_size=1, seed=0)
+        for _ in range(2):
+            self.assertIn(agent.act(env.net)[0][0], (0, 10))
+        self.assertEqual(1, len(agent.cache))
+        self.assertGreater(agent.cache.stats()['evictions'], 0)
+
+    def test_time_budget(self):
+        """
+        Test the search stops starting rounds once the time budget is spent
+        """
+        env = PnpscLocalEnv(player_name='Attacker', net_path='../../nets/capec63.json')
+        agent = MctsAgent(player_name='Attacker', num_samples=10 ** 9, batch_size=64, time_budget=0, seed=0)
+        rates = agent.act(env.net)[0]
+        self.assertEqual(0, agent.last_samples)
+        self.assertEqual(list(env.get_controlled_rates().values()), rates)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,133 @@
+import json
+import unittest
+from urllib.parse import urlparse
+
+import requests
+
+from src.pnpsc_env.env.pnpsc_remote_env import PnpscRemoteEnv, RemoteSimulatorError
+
+
+class ScriptedAdapter(requests.adapters.BaseAdapter):
+    """
+    Transport adapter that answers the requests of a session with scripted responses instead of sending them
+    """
+    def __init__(self, replies, script=None):
+        """
+        :param replies: default (status, body) of each endpoint
+        :param script: list of replies or exceptions of each endpoint, used before the defaults
+        """
+        super().__init__()
+        self.replies = replies
+        self.script = script if script is not None else {}
+        self.sent = []
+
+    def send(self, request, **kwargs):
+        endpoint = urlparse(request.url).path.lstrip('/')
+        self.sent.append(endpoint)
+        script = self.script.get(endpoint)
+        reply = script.pop(0) if script else self.replies[endpoint]
+        if isinstance(reply, Exception):
+            raise reply
+        res = requests.Response()
+        res.status_code, res._content = reply[0], json.dumps(reply[1]).encode()
+        res.url, res.request = request.url, request
+        return res
+
+    def close(self):
+        pass
+
+
+class TestRemoteEnv(unittest.TestCase):
+
+    def make_env(self, script=None, **kwargs):
+        with open('test_response.json') as f:
+            status = json.load(f)
+        adapter = ScriptedAdapter({'delete/': (200, {}), 'uploadpetrinet/': (200, {}), 'status/': (200, status),
+                                   'step/': (200, status), 'change_transitions/': (200, {'changes_made': True})},
+                                  script)
+        session = requests.Session()
+        session.mount('http://', adapter)
+        env = PnpscRemoteEnv(player_name='Attacker', net_path='../../nets/example_net.json', sim_url='http://sim/',
+                             backoff=0, session=session, **kwargs)
+        return env, adapter
+
+    def test_session(self):
+        """
+        Test all the requests go through the session and are counted per endpoint
+        """
+        env, adapter = self.make_env()
+        env.reset()
+        env.step([5])
+        self.assertEqual(['delete/', 'uploadpetrinet/', 'status/', 'change_transitions/', 'step/'], adapter.sent)
+        self.assertEqual(env.net.get_all_places(), {'aP1': 9, 'aP2': 1, 'aP3': 1, 'aP4': 0, 'aP5': 0})
+
+        stats = env.latency_stats()
+        self.assertEqual(set(adapter.sent), set(stats))
+        self.assertEqual(1, stats['step/']['calls'])
+        self.assertEqual(0, stats['step/']['retries'])
+        self.assertGreaterEqual(stats['step/']['max'], stats['step/']['mean'])
+
+        # a shared session is left open
+        env.close()
+        self.assertIn('http://', env.session.adapters)
+
+    def test_retries(self):
+        """
+        Test transient failures are retried and persistent failures raise
+        """
+        env, adapter = self.make_env({'status/': [requests.ConnectionError('reset'), (503, {})],
+                                      'step/': [requests.ReadTimeout('slow')]})
+        env.reset()
+        self.assertEqual(2, env.latency_stats()['status/']['retries'])
+
+        # reads that may have stepped the simulator are not sent again
+        with self.assertRaises(RemoteSimulatorError) as e:
+            env.step(None)
+        self.assertEqual('step/', e.exception.endpoint)
+        self.assertEqual(1, env.latency_stats()['step/']['errors'])
+
+        # a dropped connection may follow a step the simulator applied, failures to connect are sent again
+        env, adapter = self.make_env({'step/': [requests.ConnectionError('reset'), requests.ConnectTimeout('slow')]},
+                                     max_retries=2)
+        with self.assertRaises(RemoteSimulatorError):
+            env.step(None)
+        self.assertEqual(['step/'], adapter.sent)
+        env.step(None)
+        self.assertEqual(['step/'] * 3, adapter.sent)
+
+        # a gateway error may follow a step the simulator applied, only requests that can be sent twice are sent again
+        env, adapter = self.make_env({'status/': [(504, {}), (502, {})], 'step/': [(504, {}), (503, {})]})
+        env.reset()
+        self.assertEqual(2, env.latency_stats()['status/']['retries'])
+        with self.assertRaises(RemoteSimulatorError) as e:
+            env.step(None)
+        self.assertEqual(('step/', 504), (e.exception.endpoint, e.exception.status_code))
+        env.step(None)
+        self.assertEqual(1, env.latency_stats()['step/']['retries'])
+
+        env = PnpscRemoteEnv(player_name='Attacker', net_path='../../nets/example_net.json',
+                             sim_url='http://127.0.0.1:1/', max_retries=2, backoff=0)
+        with self.assertRaises(RemoteSimulatorError) as e:
+            env.step([5])
+        self.assertEqual('change_transitions/', e.exception.endpoint)
+        self.assertEqual(2, env.latency_stats()['change_transitions/']['retries'])
+        env.close()
+
+    def test_rejected(self):
+        """
+        Test error statuses and refused updates raise with the endpoint and status
+        """
+        env, adapter = self.make_env({'uploadpetrinet/': [(400, {'error': 'invalid net'})],
+                                      'change_transitions/': [(200, {'changes_made': False})]})
+        with self.assertRaises(RemoteSimulatorError) as e:
+            env.reset()
+        self.assertEqual(('uploadpetrinet/', 400), (e.exception.endpoint, e.exception.status_code))
+        self.assertEqual(1, adapter.sent.count('uploadpetrinet/'))
+
+        with self.assertRaises(RemoteSimulatorError) as e:
+            env.step([5])
+        self.assertEqual('change_transitions/', e.exception.endpoint)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,117 @@
+import time
+import unittest
+
+import numpy as np
+
+from src.pnpsc_env.env.pnpsc_async_vec_env import PnpscAsyncVecEnv
+from src.pnpsc_env.env.pnpsc_local_env import PnpscLocalEnv
+from src.pnpsc_env.env.pnpsc_remote_env import PnpscRemoteEnv, RemoteSimulatorError
+from src.pnpsc_env.simulator.simulator_server import SimulatorServer
+
+
+class TestSimulatorServer(unittest.TestCase):
+
+    def setUp(self):
+        self.servers = []
+
+    def tearDown(self):
+        for server in self.servers:
+            server.shutdown()
+            server.server_close()
+
+    def start(self, **kwargs):
+        server = SimulatorServer(('127.0.0.1', 0), **kwargs)
+        server.start()
+        self.servers.append(server)
+        return server
+
+    def test_episode(self):
+        """
+        Test a seeded server replays the episodes of a local environment seeded with the same simulator seed
+        """
+        def episode(env):
+            state, done = env.reset(), False
+            trace = [state.tolist()]
+            action = [5] * len(env.get_controlled_rates())
+            while not done and len(trace) < 100:
+                state, reward, done, info = env.step(action)
+                trace.append((state.tolist(), reward, done, env.net.get_player_cost('Attacker')))
+            return trace
+
+        traces = []
+        for _ in range(2):
+            server = self.start(seed=0)
+            env = PnpscRemoteEnv(player_name='Attacker', net_path='../../nets/capec63.json', sim_url=server.url)
+            traces.append(episode(env))
+            env.close()
+        self.assertEqual(traces[0], traces[1])
+
+        # the server seeds the simulator with the first seed drawn from the server seed
+        local = PnpscLocalEnv(player_name='Attacker', net_path='../../nets/capec63.json',
+                              seed=int(np.random.default_rng(0).integers(2 ** 32)))
+        self.assertEqual(traces[0], episode(local))
+
+    def test_sessions(self):
+        """
+        Test sessions keep their own simulators
+        """
+        server = self.start()
+        envs = [PnpscRemoteEnv(player_name='Attacker', net_path='../../nets/example_net.json', sim_url=server.url,
+                               session_id=str(i)) for i in range(2)]
+        for env in envs:
+            env.reset()
+        envs[0].step([0])
+        envs[0].step([0])
+        envs[1].step([8])
+        self.assertEqual(1.0, envs[0].net.get_player_cost('Attacker'))
+        self.assertEqual(0.2, envs[1].net.get_player_cost('Attacker'))
+        self.assertEqual([0, 8], [env.net.rates['aT1'] for env in envs])
+        self.assertEqual({'0', '1'}, set(server.sessions))
+
+        # a deleted session has no net until the next upload
+        envs[1]._request('GET', 'delete/')
+        with self.assertRaises(RemoteSimulatorError) as e:
+            envs[1].step(None)
+        self.assertEqual(400, e.exception.status_code)
+        envs[0].step(None)
+        envs[1].reset()
+        self.assertEqual(10, envs[1].net.rates['aT1'])
+        self.assertEqual(0, envs[1].net.get_player_cost('Attacker'))
+
+    def test_session_timeout(self):
+        """
+        Test sessions without requests for the session timeout are removed
+        """
+        server = self.start(session_timeout=0.2)
+        idle, active = [PnpscRemoteEnv(player_name='Attacker', net_path='../../nets/example_net.json',
+                                       sim_url=server.url, session_id=str(i)) for i in range(2)]
+        idle.reset()
+        active.reset()
+        for _ in range(3):
+            time.sleep(0.1)
+            active.step(None)
+        self.assertEqual({'1'}, set(server.sessions))
+        idle.close()
+        active.close()
+
+    def test_async_vec_env(self):
+        """
+        Test the async vectorized environment plays episodes spread over several servers
+        """
+        servers = [self.start(), self.start()]
+        env = PnpscAsyncVecEnv('Attacker', '../../nets/example_net.json', num_envs=6,
+                               sim_url=[server.url for server in servers])
+        env.reset()
+        dones = 0
+        for _ in range(50):
+            obs, rewards, done, infos = env.step(np.full((6, 1), 10.0))
+            dones += np.count_nonzero(done)
+        self.assertGreater(dones, 6)
+        self.assertEqual([3, 3], [len(server.sessions) for server in servers])
+        # the sessions created by the environments are deleted on close
+        env.close()
+        self.assertEqual([0, 0], [len(server.sessions) for server in servers])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,7 +1,14 @@
 import json
 import unittest
 
+import numpy as np
+
 from src.pnpsc_env.env.pnpsc_net import PnpscNet
+from src.pnpsc_env.env.pnpsc_local_env import PnpscLocalEnv
+from src.pnpsc_env.simulator.batch_kernel import make_batch_kernel
+from src.pnpsc_env.simulator.compiled_net import CompiledNet, load_net
+from src.pnpsc_env.simulator.indexed_priority_queue import IndexedPriorityQueue
+from src.pnpsc_env.simulator.rng import spawn
 from src.pnpsc_env.simulator.simulator import Simulator
 
 
@@ -54,6 +61,164 @@ class TestSimulator(unittest.TestCase):
             self.assertEqual({'aP1': 7, 'aP2': 1, 'aP3': 1, 'aP4': 1, 'aP5': 1}, s.net.get_all_places())
 
 
+    def test_compiled_net(self):
+        with open('../nets/example_net.json') as f:
+            data = json.load(f)
+            c = CompiledNet(data)
+
+            self.assertEqual(['aP1', 'aP2', 'aP3', 'aP4', 'aP5'], c.place_names)
+            self.assertEqual(['aT1', 'aT2', 'aT3', 'aT4'], c.transition_names)
+            self.assertEqual([(0,), (0,), (2,), (2,)], c.inputs)
+            self.assertEqual([(2,), (1, 2), (3,), (4,)], c.outputs)
+            self.assertEqual([(), (4,), (), ()], c.inhibitors)
+
+            marking = np.array([8, 1, 1, 0, 1])
+            self.assertEqual([True, False, True, True], c.enabled(marking).tolist())
+            # aT3 gains the control rate of aP1
+            self.assertEqual([10, 5, 65, 2], c.effective_rates(marking, [10, 5, 10, 2]).tolist())
+            self.assertEqual([10, 5, 10, 2], c.effective_rates(np.zeros(5), [10, 5, 10, 2]).tolist())
+
+    def test_batch_kernel_enabled(self):
+        c = load_net('../nets/capec63.json')
+        rng = np.random.default_rng(0)
+        places = rng.integers(0, 2, size=(50, c.num_places))
+        expected = [c.enabled(p).tolist() for p in places]
+        for backend in ['dense', 'sparse']:
+            kernel = make_batch_kernel(c, backend)
+            self.assertEqual(expected, kernel.enabled(places).tolist())
+
+    def test_load_net(self):
+        c = load_net('../nets/example_net.json')
+        self.assertIs(c, load_net('../tests/../nets/example_net.json'))
+        self.assertFalse(c.initial_places.flags.writeable)
+
+        # environments share the compiled net but not the marking
+        a = PnpscLocalEnv('Attacker', '../../nets/example_net.json')
+        b = PnpscLocalEnv('Attacker', '../../nets/example_net.json')
+        self.assertIs(c, a.net.compiled)
+        self.assertIs(c, b.simulator.compiled)
+        a.net.places['aP1'] = 1
+        self.assertEqual(10, b.net.places['aP1'])
+
+    def test_incremental_enabled(self):
+        with open('../nets/capec63.json') as f:
+            data = json.load(f)
+            net = PnpscNet(data)
+            s = Simulator(net)
+
+            np.random.seed(0)
+            for i in range(500):
+                if net.done:
+                    s.reset()
+                s.step()
+                s._update_enabled()
+                self.assertEqual(s._check_enabled(), s._enabled.tolist())
+
+            # in place updates to the marking and rates are picked up on the next step
+            s.reset()
+            s.step()
+            net.places['aP1'] = 1
+            net.rates['aT1'] = 0
+            s._update_enabled()
+            self.assertEqual(s._check_enabled(), s._enabled.tolist())
+            self.assertEqual(0, s._rates[s.compiled.transition_index['aT1']])
+
+    def test_indexed_priority_queue(self):
+        rng = np.random.RandomState(0)
+        keys = rng.randint(0, 20, 50).astype(float)
+        q = IndexedPriorityQueue(50)
+        for i, k in enumerate(keys):
+            q.push(i, k)
+        # change keys in place and remove a few items
+        for i in range(0, 50, 3):
+            keys[i] = rng.randint(0, 20)
+            q.push(i, keys[i])
+        for i in range(1, 50, 7):
+            q.remove(i)
+            keys[i] = np.inf
+
+        popped = [q.pop() for _ in range(len(q))]
+        expected = sorted([(k, i) for i, k in enumerate(keys) if k != np.inf])
+        self.assertEqual([(i, k) for k, i in expected], popped)
+
+    def test_next_reaction(self):
+        with open('../nets/example_net.json') as f:
+            data = json.load(f)
+            net = PnpscNet(data)
+            s = Simulator(net, scheduler='next_reaction')
+
+            s.update_rates({'aT1': 0, 'aT2': 10, 'aT3': 0, 'aT4': 0})
+            s.step()
+            self.assertEqual({'aP1': 9, 'aP2': 1, 'aP3': 1, 'aP4': 0, 'aP5': 0}, s.net.get_all_places())
+
+            # the goal is reached with the same probability as the race
+            np.random.seed(0)
+            wins = {}
+            for scheduler in ['race', 'next_reaction']:
+                s = Simulator(net, scheduler=scheduler)
+                wins[scheduler] = 0
+                for i in range(5000):
+                    s.reset()
+                    while not s.net.done and s.net.places['aP5'] == 0:
+                        s.step()
+                    wins[scheduler] += s.net.places['aP5'] > 0
+            self.assertAlmostEqual(wins['race'] / 5000, wins['next_reaction'] / 5000, delta=0.03)
+
+    def test_seed(self):
+        with open('../nets/example_net.json') as f:
+            data = json.load(f)
+
+        def trace(seed):
+            s = Simulator(PnpscNet(data), scheduler='next_reaction', seed=seed)
+            times = []
+            for _ in range(3):
+                s.reset()
+                while not s.net.done and s.net.places['aP5'] == 0:
+                    s.step()
+                    times.append(s.t)
+            return times
+
+        # the same seed replays the same executions whatever the global state, and spawned streams differ
+        np.random.seed(0)
+        first = trace(5)
+        np.random.seed(1)
+        self.assertEqual(first, trace(5))
+        children = spawn(5, 2)
+        self.assertEqual(trace(spawn(5, 2)[0]), trace(children[0]))
+        self.assertNotEqual(trace(children[0]), trace(children[1]))
+
+        # a seed given to reset replaces the generator
+        s = Simulator(PnpscNet(data))
+        s.reset(seed=5)
+        self.assertEqual(np.random.default_rng(5).random(), s.rng.random())
+
+    def test_snapshot(self):
+        with open('../nets/capec63.json') as f:
+            data = json.load(f)
+
+        for scheduler, seed in [('race', 1), ('next_reaction', 3)]:
+            s = Simulator(PnpscNet(data), scheduler=scheduler, seed=seed)
+            for _ in range(5):
+                s.step()
+            state = s.snapshot()
+
+            def rollout():
+                trace = []
+                for i in range(20):
+                    s.update_rates({'aT2': i % 3})
+                    s.step()
+                    trace.append((s.t, s.fired, s.net.place_values.tolist()))
+                return trace
+
+            # restoring replays the same steps, without the random state the rollouts differ
+            first = rollout()
+            s.restore(state)
+            self.assertEqual(first, rollout())
+            s.restore(state, restore_rng=False)
+            self.assertNotEqual(first, rollout())
+            s.restore(state)
+            self.assertEqual(first, rollout())
+
     def test_simulator_full(self):
         """
         Test the basic functionality of the local environment
@@ -0,0 +1,62 @@
+import unittest
+
+import numpy as np
+
+from src.pnpsc_env.agents.capec63_agent import Capec63Agent
+from src.pnpsc_env.env.pnpsc_local_env import PnpscLocalEnv
+from src.pnpsc_env.env.pnpsc_subproc_vec_env import PnpscSubprocVecEnv
+
+
+def make_env():
+    env = PnpscLocalEnv(player_name='Attacker', net_path='../../nets/capec63.json')
+    env.add_other_player(Capec63Agent(player_name='Defender'))
+    return env
+
+
+class TestSubprocVecEnvMethods(unittest.TestCase):
+
+    def test_step(self):
+        """
+        Test the workers step their environments with an opponent and reset finished ones
+        """
+        env = PnpscSubprocVecEnv([make_env] * 6, num_workers=4)
+        try:
+            initial = env.reset()
+            self.assertEqual((6,) + env.observation_space.shape, initial.shape)
+            actions = np.tile(env.get_attr('original_rates', [0])[0], (6, 1))
+
+            finished = 0
+            for _ in range(200):
+                obs, rewards, dones, infos = env.step(actions)
+                for i in np.flatnonzero(dones):
+                    self.assertIn('terminal_observation', infos[i])
+                    np.testing.assert_array_equal(initial[i], obs[i])
+                finished += np.sum(dones)
+            self.assertGreater(finished, 0)
+
+            env.set_attr('max_rate', 5, [4])
+            self.assertEqual([10, 5, 10], env.get_attr('max_rate', [3, 4, 5]))
+            self.assertEqual([16, 16], [len(r) for r in env.env_method('get_controlled_rates', indices=[5, 0])])
+            self.assertRaises(AttributeError, env.get_attr, 'missing')
+        finally:
+            env.close()
+
+    def test_seed(self):
+        """
+        Test seeded resets replay the episodes
+        """
+        env = PnpscSubprocVecEnv([make_env] * 4, num_workers=2)
+        try:
+            actions = np.tile(env.get_attr('original_rates', [0])[0], (4, 1))
+            runs = []
+            for _ in range(2):
+                env.seed(1)
+                env.reset()
+                runs.append([env.step(actions)[0] for _ in range(30)])
+            np.testing.assert_array_equal(runs[0], runs[1])
+        finally:
+            env.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
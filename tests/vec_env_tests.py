@@ -0,0 +1,315 @@
+import json
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from src.pnpsc_env.env.baseline_cache import BaselineCache
+from src.pnpsc_env.env.baseline_store import BaselineStore, merge_moments
+from src.pnpsc_env.env.pnpsc_local_env import PnpscLocalEnv
+from src.pnpsc_env.env.pnpsc_vec_env import PnpscVecEnv
+from src.pnpsc_env.env.wrappers.mean_wrapper import MeanWrapper
+
+
+class TestVecEnvMethods(unittest.TestCase):
+
+    def test_direct_sampler(self):
+        """
+        Test the direct method estimates the same mean reward as the race
+        """
+        means = {}
+        for sampler in ['race', 'direct']:
+            env = PnpscVecEnv(player_name='Attacker', net_path='../../nets/example_net.json', num_envs=20_000,
+                              sampler=sampler)
+            np.random.seed(0)
+            means[sampler] = env._run_batch_until_complete(tuple(env.places), tuple(env.rates))
+        self.assertAlmostEqual(means['race'], means['direct'], delta=2.5)
+
+        env = PnpscVecEnv(player_name='Attacker', net_path='../../nets/example_net.json', sampler='direct')
+        state, done = env.reset(), False
+        while not done:
+            state, reward, done, info = env.step(None)
+        self.assertGreater(env.t, 0)
+
+    def test_compaction(self):
+        """
+        Test compacting the batch to the running executions does not change the estimate
+        """
+        means = {}
+        for threshold in [0, 1]:
+            env = PnpscVecEnv(player_name='Attacker', net_path='../../nets/example_net.json', num_envs=20_000,
+                              compact_threshold=threshold)
+            np.random.seed(0)
+            means[threshold] = env._run_batch_until_complete(tuple(env.places), tuple(env.rates))
+        self.assertAlmostEqual(means[0], means[1], delta=2.5)
+
+    def test_sparse_backend(self):
+        """
+        Test the sparse backend follows the same trajectories as the dense backend
+        """
+        means = {}
+        for backend in ['dense', 'sparse']:
+            env = PnpscVecEnv(player_name='Attacker', net_path='../../nets/capec63.json', num_envs=1_000,
+                              backend=backend)
+            self.assertEqual(backend, env.kernel.backend)
+            np.random.seed(0)
+            means[backend] = env._run_batch_until_complete(tuple(env.places), tuple(env.rates))
+        self.assertEqual(means['dense'], means['sparse'])
+
+    def test_compact_state(self):
+        """
+        Test compact markings and rates give the same estimate and detect markings the type cannot hold
+        """
+        means = {}
+        for compact_state in [False, True]:
+            env = PnpscVecEnv(player_name='Attacker', net_path='../../nets/example_net.json', num_envs=20_000,
+                              compact_state=compact_state)
+            np.random.seed(0)
+            means[compact_state] = env._run_batch_until_complete(tuple(env.places), tuple(env.rates))
+        self.assertEqual(np.uint8, env.places.dtype)
+        self.assertEqual(np.float32, env.rates.dtype)
+        self.assertAlmostEqual(means[False], means[True], delta=2.5)
+
+        places = env.places.copy()
+        places[0] = 255
+        with self.assertRaises(OverflowError):
+            env._run_batch_until_complete(tuple(places), tuple(env.rates))
+        # markings are checked when they are converted, rather than wrapping
+        places = env.places.tolist()
+        places[0] = 300
+        with self.assertRaises(OverflowError):
+            env._run_batch_until_complete(tuple(places), tuple(env.rates))
+
+        # the type also holds the initial marking
+        with open('../nets/example_net.json') as f:
+            data = json.load(f)
+        data['places'][0]['marking'] = 300
+        with tempfile.NamedTemporaryFile('w', dir='../nets', suffix='.json') as f:
+            json.dump(data, f)
+            f.flush()
+            env = PnpscVecEnv(player_name='Attacker', net_path='../../nets/' + os.path.basename(f.name), num_envs=100,
+                              compact_state=True)
+        self.assertEqual(np.uint16, env.places.dtype)
+        self.assertEqual(300, env.places[0])
+
+    def test_exact_baseline(self):
+        """
+        Test the exact baseline matches the monte carlo estimate, and falls back to it for large marking spaces
+        """
+        env = PnpscVecEnv(player_name='Attacker', net_path='../../nets/example_net.json', num_envs=20_000,
+                          baseline='exact')
+        np.random.seed(0)
+        estimate = env._run_batch_until_complete(tuple(env.places), tuple(env.rates))
+        self.assertAlmostEqual(env._mean_reward(tuple(env.places), tuple(env.rates)), estimate, delta=2.5)
+        self.assertGreater(env.evaluator.num_states, 1)
+
+        state, done = env.reset(), False
+        while not done:
+            state, reward, done, info = env.step(None)
+
+        env = PnpscVecEnv(player_name='Attacker', net_path='../../nets/example_net.json', num_envs=20_000,
+                          baseline='exact', max_states=1)
+        np.random.seed(0)
+        self.assertEqual(env._mean_reward(tuple(env.places), tuple(env.rates)), estimate)
+
+    def test_baseline_cache(self):
+        """
+        Test the least recently used eviction, counters, rate quantization and pooling of the baseline cache
+        """
+        cache = BaselineCache(max_size=2, rate_decimals=1)
+        self.assertEqual(cache.key((1, 0), (0.51, 2)), cache.key((1, 0), (0.49, 2.0)))
+        cache.put('a', 10, 100)
+        cache.put('b', 20, 100)
+        self.assertEqual((10, 100), cache.get('a'))
+        cache.put('c', 30, 100)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual({'hits': 1, 'misses': 1, 'evictions': 1, 'size': 2}, cache.stats())
+        self.assertEqual(15, cache.pool('a', 20, 100))
+        self.assertEqual((15, 200), cache.get('a'))
+
+        env = PnpscVecEnv(player_name='Attacker', net_path='../../nets/example_net.json', num_envs=1_000,
+                          cache_size=16, refine_samples=3_000)
+        estimates = [env._mean_reward(tuple(env.places), tuple(env.rates)) for _ in range(4)]
+        self.assertEqual(estimates[2], estimates[3])
+        self.assertEqual(3, env.cache.hits)
+        self.assertEqual((estimates[3], 3_000), env.cache.get(env.cache.key(env.places, env.rates)))
+
+    def test_baseline_store(self):
+        """
+        Test baselines are pooled on disk and shared between environments
+        """
+        x = np.random.random(100)
+        n, mean, m2 = merge_moments((60, np.mean(x[:60]), np.var(x[:60]) * 60),
+                                    (40, np.mean(x[60:]), np.var(x[60:]) * 40))
+        self.assertEqual(100, n)
+        self.assertAlmostEqual(np.mean(x), mean)
+        self.assertAlmostEqual(np.var(x) * 100, m2)
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'baselines.db')
+            env = PnpscVecEnv(player_name='Attacker', net_path='../../nets/example_net.json', num_envs=1_000,
+                              store_path=path)
+            estimate = env._mean_reward(tuple(env.places), tuple(env.rates))
+            samples, mean, variance = env.store.get(env.places, env.rates, {})
+            self.assertEqual((1_000, estimate), (samples, mean))
+            self.assertGreater(variance, 0)
+
+            # a second environment reuses the stored estimate, and pools another batch when more samples are needed
+            env = PnpscVecEnv(player_name='Attacker', net_path='../../nets/example_net.json', num_envs=1_000,
+                              store_path=path)
+            self.assertEqual(estimate, env._mean_reward(tuple(env.places), tuple(env.rates)))
+            env = PnpscVecEnv(player_name='Attacker', net_path='../../nets/example_net.json', num_envs=1_000,
+                              store_path=path, store_samples=2_000)
+            env._mean_reward(tuple(env.places), tuple(env.rates))
+            self.assertEqual(2_000, env.store.get(env.places, env.rates, {})[0])
+            env.store.close()
+
+            env = MeanWrapper(PnpscLocalEnv(player_name='Attacker', net_path='../../nets/example_net.json'),
+                              num_runs=10, store_path=path)
+            env.reset()
+            env.step(None)
+            self.assertEqual(10, BaselineStore(path, env.env.net.json).get(env.places.values(),
+                                                                           env.rates.values())[0])
+
+            # rounded keys are shared by float32 and float64 rates
+            store = BaselineStore(os.path.join(directory, 'rounded.db'), env.env.net.json, rate_decimals=6)
+            store.add([10, 0], np.array([0.1, -0.0], dtype=np.float32), None, 10, 1.0, 0.0)
+            self.assertEqual(10, store.get([10, 0], [0.1, 0.0])[0])
+            self.assertEqual(1, len(store))
+            store.close()
+
+    def test_common_random_numbers(self):
+        """
+        Test common random numbers and antithetic draws give unbiased baselines with low variance differences
+        """
+        env = PnpscVecEnv(player_name='Attacker', net_path='../../nets/example_net.json', num_envs=20_000)
+        np.random.seed(0)
+        estimate = env._run_batch_until_complete(tuple(env.places), tuple(env.rates))
+        env.step(None)
+        after = tuple(env.places), tuple(env.rates)
+
+        for antithetic in [False, True]:
+            env = PnpscVecEnv(player_name='Attacker', net_path='../../nets/example_net.json', num_envs=20_000,
+                              common_random_numbers=True, antithetic=antithetic)
+            before = tuple(env.places), tuple(env.rates)
+            self.assertAlmostEqual(env._run_batch_until_complete(*before), estimate, delta=2.5)
+            # the same seed gives the same baseline
+            self.assertEqual(env._run_batch_until_complete(*before), env._run_batch_until_complete(*before))
+            differences = []
+            for seed in range(10):
+                env.crn_seed = seed
+                differences.append(env._run_batch_until_complete(*after) - env._run_batch_until_complete(*before))
+            self.assertLess(np.std(differences), 0.5)
+
+        env = PnpscVecEnv(player_name='Attacker', net_path='../../nets/example_net.json', num_envs=20_000,
+                          antithetic=True)
+        self.assertAlmostEqual(env._run_batch_until_complete(*before), estimate, delta=2.5)
+
+    def test_adaptive_samples(self):
+        """
+        Test batches are added until the confidence interval reaches the target, within the sample bounds
+        """
+        env = PnpscVecEnv(player_name='Attacker', net_path='../../nets/example_net.json', num_envs=1_000,
+                          target_half_width=2.0)
+        np.random.seed(0)
+        total, total_sq, samples = env._run_sequential(tuple(env.places), tuple(env.rates))
+        variance = (total_sq - total * total / samples) / (samples - 1)
+        self.assertLessEqual(1.96 * np.sqrt(variance / samples), 2.0)
+        self.assertGreater(1.96 * np.sqrt(variance / (samples - 1_000)), 2.0)
+        self.assertEqual(samples, env.last_samples)
+        self.assertEqual(samples % 1_000, 0)
+
+        env = PnpscVecEnv(player_name='Attacker', net_path='../../nets/example_net.json', num_envs=1_000,
+                          target_half_width=0.01, max_samples=3_000)
+        env._mean_reward(tuple(env.places), tuple(env.rates))
+        self.assertEqual(3_000, env.last_samples)
+        env = PnpscVecEnv(player_name='Attacker', net_path='../../nets/example_net.json', num_envs=1_000,
+                          target_half_width=100, min_samples=2_000)
+        env._mean_reward(tuple(env.places), tuple(env.rates))
+        self.assertEqual(2_000, env.last_samples)
+        self.assertEqual(2_000, env.total_samples)
+
+    def test_chunks(self):
+        """
+        Test running a batch in chunks gives the same estimate, and common random numbers do not depend on the chunks
+        """
+        means = {}
+        for chunk_size in [20_000, 3_000]:
+            env = PnpscVecEnv(player_name='Attacker', net_path='../../nets/example_net.json', num_envs=20_000,
+                              chunk_size=chunk_size)
+            np.random.seed(0)
+            means[chunk_size] = env._run_batch_until_complete(tuple(env.places), tuple(env.rates))
+        self.assertAlmostEqual(means[20_000], means[3_000], delta=2.5)
+
+        means = {}
+        for chunk_size in [1_000, 300]:
+            env = PnpscVecEnv(player_name='Attacker', net_path='../../nets/example_net.json', num_envs=1_000,
+                              common_random_numbers=True, chunk_size=chunk_size)
+            env.crn_seed = 0
+            means[chunk_size] = env._run_batch_until_complete(tuple(env.places), tuple(env.rates))
+        self.assertAlmostEqual(means[1_000], means[300])
+
+        env = PnpscVecEnv(player_name='Attacker', net_path='../../nets/example_net.json', num_envs=1_000)
+        self.assertEqual(1_000, env.chunk_size)
+
+    def test_threads(self):
+        """
+        Test threaded batches are reproducible for a seed and give the same estimate as a single thread
+        """
+        env = PnpscVecEnv(player_name='Attacker', net_path='../../nets/example_net.json', num_envs=20_000)
+        np.random.seed(0)
+        estimate = env._run_batch_until_complete(tuple(env.places), tuple(env.rates))
+
+        env = PnpscVecEnv(player_name='Attacker', net_path='../../nets/example_net.json', num_envs=20_000,
+                          num_threads=3)
+        self.assertEqual(3, len(set(env.kernels)))
+        means = []
+        for _ in range(2):
+            np.random.seed(1)
+            means.append(env._run_batch_until_complete(tuple(env.places), tuple(env.rates)))
+        self.assertEqual(means[0], means[1])
+        self.assertAlmostEqual(means[0], estimate, delta=2.5)
+
+
+    def test_seed(self):
+        """
+        Test seeded environments give the same baselines whatever the global random state
+        """
+        means = []
+        for global_seed in range(2):
+            np.random.seed(global_seed)
+            env = PnpscVecEnv(player_name='Attacker', net_path='../../nets/example_net.json', num_envs=1_000,
+                              num_threads=2, common_random_numbers=True, seed=4)
+            means.append(env._run_batch_until_complete(tuple(env.places), tuple(env.rates)))
+            env.seed(4)
+            env.reset()
+            means.append(env._run_batch_until_complete(tuple(env.places), tuple(env.rates)))
+            env.close()
+        self.assertEqual([means[0]] * 4, means)
+
+    def test_snapshot(self):
+        """
+        Test restoring a snapshot replays the episode and the mean wrapper returns to the state it simulated from
+        """
+        env = PnpscVecEnv(player_name='Attacker', net_path='../../nets/example_net.json', num_envs=100, seed=2)
+        env.reset()
+        env.step([5])
+        state = env.snapshot()
+        first = [env.step([i])[:3] for i in range(3)]
+        env.restore(state)
+        replay = [env.step([i])[:3] for i in range(3)]
+        self.assertEqual([(o.tolist(), r, d) for o, r, d in first], [(o.tolist(), r, d) for o, r, d in replay])
+        env.close()
+
+        env = MeanWrapper(PnpscLocalEnv(player_name='Attacker', net_path='../../nets/example_net.json', seed=3),
+                          num_runs=10)
+        env.reset()
+        env.step([5])
+        places, rates, t = dict(env.env.net.places), dict(env.env.net.rates), env.env.simulator.t
+        MeanWrapper.calc_mean_reward.__wrapped__(env, env.places, env.rates)
+        self.assertEqual((places, rates, t), (dict(env.env.net.places), dict(env.env.net.rates), env.env.simulator.t))
+
+
+if __name__ == '__main__':
+    unittest.main()